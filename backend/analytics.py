@@ -0,0 +1,429 @@
+"""Transfer analytics: volume and value per day or month, by zoning, status and risk level.
+
+    cd backend
+    python analytics.py refresh [--full]
+
+`transfer_rollups` holds the count and total amount of the transfers
+created on each day, and in each month, for every (parcel zoning, transfer
+status, parcel fraud risk level). Zoning and risk level are the parcel's
+current ones, so a rezoned or rescored parcel moves its transfers between
+groups. `transfer_rollup_members` records the group and amount each
+transfer is counted in.
+
+Refreshes are incremental from a high-water mark kept in
+`rollup_watermarks`. The transfers to look at again are those written after
+the mark, those whose parcel was, and those whose parcel's AI analysis
+changed risk level (found through the updated_at and risk_changed_at
+indexes). A rescoring that keeps a parcel's level brings nothing back. Each one's current group and amount is compared with
+its member row and only the difference is added to the day and month
+rollups, so a refresh costs in proportion to what changed, not to the table.
+Refreshes and reads also look ANALYTICS_SETTLE_SECONDS back past the mark,
+for transactions that commit after the timestamps they wrote; a transfer
+seen twice adds nothing the second time.
+
+`query` merges the rollups with the fresh tail: the same differences are
+computed at read time for the transfers changed since the mark and added to
+the stored rows, so answers do not wait for the next refresh. Deleted
+transfers leave the rollups only on a full refresh.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import (
+    Date, String, bindparam, cast, delete, func, insert, inspect, literal, select, text, union, union_all, update
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
+
+from models import (
+    AIAnalysis, FraudRiskLevel, Parcel, RollupWatermark, Transfer, TransferRollup, TransferRollupMember, TransferStatus
+)
+from schemas import TransferAnalytics, TransferAnalyticsRow, TransferRollupReport
+from valuations import month_start
+
+logger = logging.getLogger(__name__)
+
+# Seconds between incremental refreshes (0 disables; reads still merge the fresh tail)
+ANALYTICS_ROLLUP_INTERVAL = float(os.getenv("ANALYTICS_ROLLUP_INTERVAL", "60"))
+# How far before the high-water mark refreshes and reads look for changes
+ANALYTICS_SETTLE_SECONDS = float(os.getenv("ANALYTICS_SETTLE_SECONDS", "60"))
+DIMENSIONS = ("zoning", "status", "risk_level")
+WATERMARK = "transfer_rollups"
+# Most IDs or keys in one IN list, and most rows in one INSERT
+CHUNK_SIZE = 1000
+WRITE_CHUNK_SIZE = 10000
+MEMBER_COLUMNS = ("transfer_id", "period", "zoning", "status", "risk_level", "amount")
+ROLLUP_COLUMNS = ("grain", "period", "zoning", "status", "risk_level", "transfers", "total_value", "computed_at")
+
+# A rollup group: (period, zoning, status name, risk level name or "")
+Key = Tuple[date, str, str, str]
+
+
+class day_start(FunctionElement):
+    """Day of a timestamp column"""
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(day_start)
+def _day_start(element, compiler, **kw):
+    return f"CAST({compiler.process(element.clauses, **kw)} AS DATE)"
+
+
+@compiles(day_start, "sqlite")
+def _sqlite_day_start(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)})"
+
+
+def month_of(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _chunks(items: Sequence[Any], size: int = CHUNK_SIZE) -> Iterable[Sequence[Any]]:
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+
+def _add(groups: Dict[Tuple, List[float]], key: Tuple, transfers: float, total: float) -> None:
+    group = groups.setdefault(key, [0, 0.0])
+    group[0] += transfers
+    group[1] += total
+
+
+# Sources
+
+# The group of a transfer as stored in the rollups. SQLEnum columns hold member
+# names; transfers without a status count as pending, as in the status transitions
+GROUP_COLUMNS = (
+    day_start(Transfer.created_at),
+    func.coalesce(Parcel.zoning, ""),
+    func.coalesce(cast(Transfer.status, String), TransferStatus.PENDING.name),
+    func.coalesce(cast(AIAnalysis.fraud_risk, String), ""),
+)
+
+
+def grouped(*columns: Any):
+    """SELECT `columns` from transfers joined with their parcel and AI analysis"""
+    return (
+        select(*columns)
+        .select_from(Transfer)
+        .outerjoin(Parcel, Parcel.id == Transfer.parcel_id)
+        .outerjoin(AIAnalysis, AIAnalysis.parcel_id == Transfer.parcel_id)
+        .where(Transfer.created_at.is_not(None))
+    )
+
+
+def changed_since(since: datetime):
+    """IDs of the transfers written after `since`, or whose parcel was, or whose parcel's risk level changed"""
+    return union(
+        select(Transfer.id).where(Transfer.updated_at > since),
+        select(Transfer.id).join(Parcel, Parcel.id == Transfer.parcel_id).where(Parcel.updated_at > since),
+        select(Transfer.id).join(AIAnalysis, AIAnalysis.parcel_id == Transfer.parcel_id)
+        .where(AIAnalysis.risk_changed_at > since),
+    )
+
+
+def add_risk_changed_at(engine: Engine) -> bool:
+    """Add `ai_analysis.risk_changed_at` to a database created before it existed.
+
+    create_all leaves existing tables alone. Rows start from their updated_at,
+    so the next refresh misses no risk level changed before the upgrade.
+    Returns whether the column was added.
+    """
+    table = AIAnalysis.__table__
+    with engine.begin() as conn:
+        added = "risk_changed_at" not in {c["name"] for c in inspect(conn).get_columns(table.name)}
+        if added:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN risk_changed_at TIMESTAMP"))
+            conn.execute(update(table).values(risk_changed_at=table.c.updated_at))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    return added
+
+
+def changed_transfers(db, since: datetime) -> List[str]:
+    return sorted(db.scalars(changed_since(since)))
+
+
+def changes(db, transfer_ids: Sequence[str]) -> Tuple[List[Dict[str, Any]], Dict[Key, List[float]]]:
+    """Current member rows of `transfer_ids`, and the (transfers, total) each day group needs added to match them"""
+    members: List[Dict[str, Any]] = []
+    deltas: Dict[Key, List[float]] = {}
+    for chunk in _chunks(transfer_ids):
+        for row in db.execute(grouped(Transfer.id, *GROUP_COLUMNS, Transfer.amount).where(Transfer.id.in_(chunk))):
+            members.append(dict(zip(MEMBER_COLUMNS, row)))
+            _add(deltas, tuple(row[1:5]), 1, row[5])
+        for *key, amount in db.execute(
+            select(
+                TransferRollupMember.period, TransferRollupMember.zoning, TransferRollupMember.status,
+                TransferRollupMember.risk_level, TransferRollupMember.amount,
+            ).where(TransferRollupMember.transfer_id.in_(chunk))
+        ):
+            _add(deltas, tuple(key), -1, -amount)
+    # A transfer still in the same group with the same amount cancels out
+    return members, {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+
+
+def by_month(deltas: Dict[Key, List[float]]) -> Dict[Key, List[float]]:
+    months: Dict[Key, List[float]] = {}
+    for (day, *rest), (transfers, total) in deltas.items():
+        _add(months, (month_of(day), *rest), transfers, total)
+    return months
+
+
+def tail(db, since: datetime) -> Tuple[int, Dict[Key, List[float]]]:
+    """The transfers changed after `since` and the day group differences of `changes`, in one GROUP BY"""
+    changed = select(changed_since(since).subquery().c[0])
+    current = grouped(
+        *GROUP_COLUMNS, literal(1).label("seen"), literal(1).label("n"), Transfer.amount.label("amount")
+    ).where(Transfer.id.in_(changed))
+    counted = select(
+        TransferRollupMember.period, TransferRollupMember.zoning, TransferRollupMember.status,
+        TransferRollupMember.risk_level, literal(0), literal(-1), -TransferRollupMember.amount,
+    ).where(TransferRollupMember.transfer_id.in_(changed))
+    both = union_all(current, counted).subquery()
+    key = list(both.c)[:4]
+    transfers, deltas = 0, {}
+    for *group, seen, delta, total in db.execute(
+        select(*key, func.sum(both.c.seen), func.sum(both.c.n), func.sum(both.c.amount)).group_by(*key)
+    ):
+        transfers += seen
+        if delta or total:
+            deltas[tuple(group)] = [delta, total]
+    return transfers, deltas
+
+
+# Refresh
+
+def high_water_mark(db) -> Optional[datetime]:
+    return db.scalar(select(RollupWatermark.high_water).where(RollupWatermark.name == WATERMARK))
+
+
+def _rebuild(conn, computed_at: datetime) -> int:
+    """Every member row and rollup again from `transfers`, in SQL; returns the transfers counted"""
+    conn.execute(delete(TransferRollupMember))
+    conn.execute(delete(TransferRollup))
+    conn.execute(insert(TransferRollupMember).from_select(
+        MEMBER_COLUMNS, grouped(Transfer.id, *GROUP_COLUMNS, Transfer.amount)
+    ))
+    member_key = (
+        TransferRollupMember.period, TransferRollupMember.zoning, TransferRollupMember.status,
+        TransferRollupMember.risk_level,
+    )
+    conn.execute(insert(TransferRollup).from_select(ROLLUP_COLUMNS, select(
+        literal("day"), *member_key, func.count(), func.sum(TransferRollupMember.amount), literal(computed_at),
+    ).group_by(*member_key)))
+    month_key = (
+        month_start(TransferRollup.period), TransferRollup.zoning, TransferRollup.status, TransferRollup.risk_level,
+    )
+    conn.execute(insert(TransferRollup).from_select(ROLLUP_COLUMNS, select(
+        literal("month"), *month_key, func.sum(TransferRollup.transfers), func.sum(TransferRollup.total_value),
+        literal(computed_at),
+    ).where(TransferRollup.grain == "day").group_by(*month_key)))
+    return conn.scalar(select(func.count()).select_from(TransferRollupMember))
+
+
+def _apply(conn, grain: str, deltas: Dict[Key, List[float]], computed_at: datetime) -> None:
+    """Add `deltas` to the `grain` rollups, creating the groups that appear and dropping those left empty"""
+    table = TransferRollup.__table__
+    keys = list(deltas)
+    # Looked up by period, the leading key column after grain, which is far cheaper than IN over key tuples
+    existing = set()
+    for chunk in _chunks(sorted({key[0] for key in keys})):
+        existing.update(tuple(row) for row in conn.execute(
+            select(table.c.period, table.c.zoning, table.c.status, table.c.risk_level)
+            .where(table.c.grain == grain, table.c.period.in_(chunk))
+        ))
+    stored = [key for key in keys if key in existing]
+    if stored:
+        conn.execute(
+            update(table).where(
+                table.c.grain == grain, table.c.period == bindparam("b_period"),
+                table.c.zoning == bindparam("b_zoning"), table.c.status == bindparam("b_status"),
+                table.c.risk_level == bindparam("b_risk_level"),
+            ).values(
+                transfers=table.c.transfers + bindparam("b_transfers"),
+                total_value=table.c.total_value + bindparam("b_total_value"),
+                computed_at=computed_at,
+            ),
+            [
+                dict(zip(("b_period", "b_zoning", "b_status", "b_risk_level"), key),
+                     b_transfers=deltas[key][0], b_total_value=deltas[key][1])
+                for key in stored
+            ],
+        )
+        conn.execute(delete(table).where(table.c.grain == grain, table.c.transfers <= 0))
+    created = [
+        dict(zip(ROLLUP_COLUMNS, (grain, *key, *deltas[key], computed_at)))
+        for key in keys if key not in existing and deltas[key][0] > 0
+    ]
+    for chunk in _chunks(created, WRITE_CHUNK_SIZE):
+        conn.execute(insert(table), list(chunk))
+
+
+def refresh_rollups(engine: Engine, full: bool = False) -> TransferRollupReport:
+    """Apply the transfers changed since the high-water mark, or rebuild everything when `full` or never refreshed"""
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        # Taken first: anything written while this runs is after the new mark, or within the settle window.
+        # From the database clock, which timestamps the rows the mark is compared with.
+        high_water = conn.scalar(select(func.now()))
+        report = TransferRollupReport(full=full, high_water=high_water)
+        previous = None if full else high_water_mark(conn)
+        if previous is None:
+            report.full = True
+            loaded = time.perf_counter()
+            report.transfers = _rebuild(conn, high_water)
+        else:
+            transfer_ids = changed_transfers(conn, previous - timedelta(seconds=ANALYTICS_SETTLE_SECONDS))
+            members, deltas = changes(conn, transfer_ids)
+            loaded = time.perf_counter()
+            _apply(conn, "day", deltas, high_water)
+            _apply(conn, "month", by_month(deltas), high_water)
+            for chunk in _chunks(transfer_ids):
+                conn.execute(delete(TransferRollupMember).where(TransferRollupMember.transfer_id.in_(chunk)))
+            for chunk in _chunks(members, WRITE_CHUNK_SIZE):
+                conn.execute(insert(TransferRollupMember), list(chunk))
+            report.transfers = len(transfer_ids)
+        if conn.execute(
+            update(RollupWatermark).where(RollupWatermark.name == WATERMARK).values(high_water=high_water)
+        ).rowcount == 0:
+            conn.execute(insert(RollupWatermark).values(name=WATERMARK, high_water=high_water))
+        report.rollups = conn.scalar(select(func.count()).select_from(TransferRollup))
+    written = time.perf_counter()
+    report.seconds = {"load": round(loaded - started, 3), "write": round(written - loaded, 3)}
+    return report
+
+
+class RollupRefresher:
+    """Background thread refreshing the transfer rollups from their high-water mark every `interval` seconds"""
+
+    def __init__(self, engine: Engine, interval: float = ANALYTICS_ROLLUP_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="transfer-rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                refresh_rollups(self.engine)
+            except Exception:
+                logger.exception("Transfer rollup refresh failed")
+            if self._stop.wait(self.interval):
+                return
+
+
+# Reads
+
+def query(
+    db: Session, grain: str, start: Optional[date], end: Optional[date], zoning: Optional[str],
+    status: Optional[TransferStatus], risk_level: Optional[str], group_by: Sequence[str],
+) -> TransferAnalytics:
+    """Transfers per period of `grain` from `start` to `end`, broken down by the `group_by` dimensions"""
+    dimensions = [dimension for dimension in DIMENSIONS if dimension in group_by]
+    period_of = month_of if grain == "month" else (lambda day: day)
+    first = period_of(start) if start else None
+    # Filters as the rollups store them
+    wanted = dict(zip(DIMENSIONS, (
+        zoning,
+        status.name if status is not None else None,
+        None if risk_level is None else FraudRiskLevel(risk_level).name if risk_level else "",
+    )))
+
+    groups: Dict[Tuple, List[float]] = {}
+
+    def add(key: Key, transfers: float, total: float) -> None:
+        period, *values = key
+        row = dict(zip(DIMENSIONS, values))
+        if (first and period < first) or (end and period > end) or any(
+            value is not None and row[dimension] != value for dimension, value in wanted.items()
+        ):
+            return
+        _add(groups, (period, *(row[dimension] for dimension in dimensions)), transfers, total)
+
+    high_water = high_water_mark(db)
+    if high_water is None:
+        # Never refreshed: the whole range comes from transfers
+        where = [column == value for column, value in zip(GROUP_COLUMNS[1:], wanted.values()) if value is not None]
+        if first:
+            where.append(Transfer.created_at >= datetime(first.year, first.month, first.day))
+        if end:
+            # Up to the end of the period holding `end`
+            last = month_of(end).replace(year=end.year + end.month // 12, month=end.month % 12 + 1) \
+                if grain == "month" else end + timedelta(days=1)
+            where.append(Transfer.created_at < datetime(last.year, last.month, last.day))
+        tail_transfers = 0
+        for day, *rest, transfers, total in db.execute(
+            grouped(*GROUP_COLUMNS, func.count(), func.sum(Transfer.amount)).where(*where).group_by(*GROUP_COLUMNS)
+        ):
+            add((period_of(day), *rest), transfers, total)
+            tail_transfers += transfers
+    else:
+        where = [TransferRollup.grain == grain]
+        if first:
+            where.append(TransferRollup.period >= first)
+        if end:
+            where.append(TransferRollup.period <= end)
+        for column, value in zip((TransferRollup.zoning, TransferRollup.status, TransferRollup.risk_level),
+                                 wanted.values()):
+            if value is not None:
+                where.append(column == value)
+        for *key, transfers, total in db.execute(select(
+            TransferRollup.period, TransferRollup.zoning, TransferRollup.status, TransferRollup.risk_level,
+            TransferRollup.transfers, TransferRollup.total_value,
+        ).where(*where)):
+            add(tuple(key), transfers, total)
+        # The fresh tail: what the next refresh will add
+        tail_transfers, deltas = tail(db, high_water - timedelta(seconds=ANALYTICS_SETTLE_SECONDS))
+        for key, (transfers, total) in (by_month(deltas) if grain == "month" else deltas).items():
+            add(key, transfers, total)
+
+    rows = []
+    for (period, *values), (transfers, total) in sorted(groups.items()):
+        if transfers <= 0:
+            continue
+        row = dict(zip(dimensions, values))
+        rows.append(TransferAnalyticsRow(
+            period=period,
+            zoning=row.get("zoning") or None,
+            status=TransferStatus[row["status"]] if "status" in row else None,
+            risk_level=FraudRiskLevel[row["risk_level"]] if row.get("risk_level") else None,
+            transfers=transfers, total_value=total, mean_value=total / transfers,
+        ))
+    return TransferAnalytics(
+        grain=grain, group_by=dimensions, high_water=high_water, tail_transfers=tail_transfers, rows=rows
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Transfer analytics rollups")
+    commands = parser.add_subparsers(dest="command", required=True)
+    refresh = commands.add_parser("refresh", help="Apply the transfers changed since the high-water mark")
+    refresh.add_argument("--full", action="store_true", help="Rebuild the rollups from every transfer")
+    args = parser.parse_args()
+
+    from database import engine
+
+    add_risk_changed_at(engine)
+    print(refresh_rollups(engine, args.full).model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
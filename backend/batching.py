@@ -0,0 +1,226 @@
+import asyncio
+import os
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+from fastapi import HTTPException, Response
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+
+import database
+import metrics
+
+# Most IDs accepted by one batch lookup, and most single lookups merged into one batch
+BATCH_MAX_IDS = int(os.getenv("BATCH_MAX_IDS", "200"))
+# How long a single lookup waits for others to join its batch; 0 merges those arriving in the same event-loop pass
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "0"))
+# Most writes committed in one group-commit transaction
+GROUP_COMMIT_MAX_WRITES = int(os.getenv("GROUP_COMMIT_MAX_WRITES", "256"))
+# How long the first write of an idle committer waits for others; later batches form while the previous one commits
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0"))
+
+_ids = TypeAdapter(List[str])
+_id = TypeAdapter(str)
+
+
+def unique_ids(ids: Sequence[str]) -> List[str]:
+    """Requested IDs without repeats, in request order, within BATCH_MAX_IDS"""
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} IDs per batch")
+    return ids
+
+
+def batch_response(ids: Sequence[str], found: Dict[str, tuple]) -> Response:
+    """`{"items": {id: detail}, "not_found": [id]}` spliced from cached (etag, body) pairs"""
+    with metrics.encoding():
+        items = b",".join(_id.dump_json(i) + b":" + found[i][1] for i in ids if i in found)
+        not_found = _ids.dump_json([i for i in ids if i not in found])
+    return Response(content=b'{"items":{' + items + b'},"not_found":' + not_found + b"}", media_type="application/json")
+
+
+Waiter = Tuple[asyncio.Future, Optional[metrics.RequestMetrics]]
+
+
+async def run_shared(waiters: Sequence[Waiter], fn: Callable[..., Any], *args: Any) -> Any:
+    """`database.run_detached` for work done on behalf of several requests.
+
+    Its SQL and encoding time are split evenly across the requests still
+    waiting, instead of being charged to the one whose task started the batch.
+    """
+    shared = metrics.RequestMetrics()
+    token = metrics.current_request.set(shared)
+    try:
+        return await database.run_detached(fn, *args)
+    finally:
+        metrics.current_request.reset(token)
+        requests = [request for future, request in waiters if request is not None and not future.done()]
+        for request in requests:
+            request.add_share(shared, 1 / len(requests))
+
+
+class Coalescer:
+    """DataLoader-style merging of concurrent single-key lookups.
+
+    The first `load` opens a batch and schedules its dispatch; lookups made
+    before the dispatch runs (within BATCH_WINDOW_MS, or the same event-loop
+    pass when 0) join it. The batch is resolved by one `fetch(session, keys)`
+    call on a session of its own, returning a value per key; keys it leaves
+    out resolve to None. Lookups that may read from the replica and those
+    that must read the primary (see replication.py) are batched separately;
+    the dispatch task inherits the routing of the lookup that opened it.
+    The batch's SQL is charged to the metrics of its waiting requests in
+    equal shares (see run_shared).
+    """
+
+    def __init__(self, fetch: Callable[[Session, List[Hashable]], Dict[Hashable, Any]],
+                 max_batch: int = BATCH_MAX_IDS, window: float = BATCH_WINDOW_MS / 1000):
+        self.fetch = fetch
+        self.max_batch = max_batch
+        self.window = window
+        # Open batch per database.replica_reads value
+        self._pending: Dict[bool, Dict[Hashable, List[Waiter]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.keys = 0
+
+    async def load(self, key: Hashable) -> Any:
+        loop = asyncio.get_running_loop()
+        route = database.replica_reads.get()
+        batch = self._pending.get(route)
+        if batch is None or len(batch) >= self.max_batch:
+            batch = self._pending[route] = {}
+            task = loop.create_task(self._dispatch(route, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        future = loop.create_future()
+        batch.setdefault(key, []).append((future, metrics.current_request.get()))
+        return await future
+
+    async def _dispatch(self, route: bool, batch: Dict[Hashable, List[Waiter]]) -> None:
+        await asyncio.sleep(self.window)
+        if self._pending.get(route) is batch:
+            del self._pending[route]
+        self.batches += 1
+        self.keys += len(batch)
+        try:
+            results = await run_shared([w for waiters in batch.values() for w in waiters], self.fetch, list(batch))
+        except Exception as exc:
+            for waiters in batch.values():
+                for future, _ in waiters:
+                    if not future.done():
+                        future.set_exception(exc)
+            return
+        for key, waiters in batch.items():
+            value = results.get(key)
+            for future, _ in waiters:
+                # Waiters whose request was cancelled have a done future already
+                if not future.done():
+                    future.set_result(value)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "keys": self.keys,
+            "mean_batch": self.keys / self.batches if self.batches else 0.0,
+        }
+
+
+class GroupCommitter:
+    """Group commit: concurrent writes share one transaction.
+
+    `submit(fn, *args)` queues `fn(session, *args)`, which makes its changes
+    without committing and returns the caller's result. Queued writes run one
+    after another on a session of their own and are flushed and committed
+    once, so a burst of N requests costs one commit (one WAL flush) instead
+    of N. Objects added by earlier writes of a batch are pending, not yet in
+    the database, when later ones run. One batch is in flight at a time;
+    writes submitted meanwhile form the next, and each batch's SQL is charged
+    to the submitting requests in equal shares.
+
+    A write rejects itself by raising HTTPException before it changes
+    anything; the rest of the batch still commits. Any other error (a
+    constraint violation at flush, a failed commit) rolls the batch back and
+    its writes are retried one transaction each, so only the offending write
+    fails. Savepoints would isolate writes without the retry, but the index
+    and cache listeners treat a savepoint's release as a commit.
+    """
+
+    def __init__(self, max_batch: int = GROUP_COMMIT_MAX_WRITES, window: float = GROUP_COMMIT_WINDOW_MS / 1000):
+        self.max_batch = max_batch
+        self.window = window
+        self._queue: List[Tuple[Callable[..., Any], tuple, Waiter]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.writes = 0
+        self.retried = 0
+
+    async def submit(self, fn: Callable[..., Any], *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((fn, args, (future, metrics.current_request.get())))
+        if self._task is None:
+            self._task = loop.create_task(self._drain())
+        return await future
+
+    async def _drain(self) -> None:
+        try:
+            await asyncio.sleep(self.window)
+            while self._queue:
+                batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+                # Writes whose request was cancelled before their batch started are dropped
+                batch = [item for item in batch if not item[2][0].done()]
+                if not batch:
+                    continue
+                self.batches += 1
+                self.writes += len(batch)
+                try:
+                    outcomes = await run_shared(
+                        [waiter for _, _, waiter in batch], self._commit, [(fn, args) for fn, args, _ in batch]
+                    )
+                except Exception as exc:
+                    outcomes = [(False, exc)] * len(batch)
+                for (_, _, (future, _)), (ok, value) in zip(batch, outcomes):
+                    if not future.done():
+                        if ok:
+                            future.set_result(value)
+                        else:
+                            future.set_exception(value)
+        finally:
+            self._task = None
+
+    def _commit(self, db: Session, writes: List[Tuple[Callable[..., Any], tuple]]) -> List[Tuple[bool, Any]]:
+        if db.get_bind().dialect.name == "sqlite":
+            # Take the write lock before the checks read, so no other connection writes between them
+            # (pysqlite would only begin at the first INSERT/UPDATE)
+            db.connection().exec_driver_sql("BEGIN IMMEDIATE")
+        outcomes: List[Tuple[bool, Any]] = []
+        try:
+            for fn, args in writes:
+                try:
+                    outcomes.append((True, fn(db, *args)))
+                except HTTPException as exc:
+                    outcomes.append((False, exc))
+            # One flush for the batch: flush listeners (counters, fraud scoring) run once, not per write
+            db.commit()
+            return outcomes
+        except Exception:
+            db.rollback()
+        self.retried += len(writes)
+        outcomes = []
+        for fn, args in writes:
+            try:
+                result = fn(db, *args)
+                db.commit()
+                outcomes.append((True, result))
+            except Exception as exc:
+                db.rollback()
+                outcomes.append((False, exc))
+        return outcomes
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "writes": self.writes,
+            "mean_batch": self.writes / self.batches if self.batches else 0.0,
+            "retried": self.retried,
+        }
@@ -0,0 +1,136 @@
+"""Time transfer rollup refreshes and analytics reads against aggregating transfers on every request.
+
+    cd backend
+    python benchmarks/analytics_bench.py --transfers 1000000 --changes 2000 --documents 0
+
+Generates the registry with benchmarks/datagen.py and times a full rollup
+refresh. It then writes --changes changes after the high-water mark: status
+changes of random transfers, new transfers and rescored parcels. Reads of
+monthly totals by zoning, status and risk level are timed three ways: from
+the rollups plus the fresh tail of changed transfers, after an incremental
+refresh from the rollups alone, and as the GROUP BY over all transfers that
+each request would otherwise run. The answers are checked against that
+GROUP BY.
+"""
+import argparse
+import math
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select, update
+from sqlalchemy.orm import Session
+
+import analytics
+import datagen
+from models import AIAnalysis, FraudRiskLevel, Parcel, Transfer, TransferStatus
+from valuations import month_start
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def write_changes(engine, changes: int, seed: int) -> None:
+    """A third each: status changes, new transfers dated over the last week, rescored parcels"""
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        transfer_ids = conn.scalars(select(Transfer.id)).all()
+        parcels = conn.execute(select(Parcel.id, Parcel.owner_id)).all()
+        for transfer_id in rng.sample(transfer_ids, changes // 3):
+            conn.execute(update(Transfer).where(Transfer.id == transfer_id).values(
+                status=rng.choice(list(TransferStatus)), updated_at=now
+            ))
+        conn.execute(insert(Transfer), [
+            {"id": f"TXN-{uuid.uuid4().hex[:16]}", "parcel_id": parcel_id, "from_user_id": owner,
+             "to_user_id": rng.choice(parcels)[1], "amount": round(rng.lognormvariate(12.8, 0.6), -2),
+             "status": TransferStatus.PENDING, "created_at": now - timedelta(days=rng.randint(0, 6)), "updated_at": now}
+            for parcel_id, owner in rng.sample(parcels, changes // 3)
+        ])
+        for parcel_id, _ in rng.sample(parcels, changes - 2 * (changes // 3)):
+            conn.execute(update(AIAnalysis).where(AIAnalysis.parcel_id == parcel_id).values(
+                fraud_risk=rng.choice(list(FraudRiskLevel)), updated_at=now, risk_changed_at=now
+            ))
+
+
+def read(engine):
+    with Session(engine) as db:
+        return analytics.query(db, "month", None, None, None, None, None, analytics.DIMENSIONS)
+
+
+def on_the_fly(engine):
+    """What each request would compute without rollups, keyed like the rollups"""
+    key = (month_start(analytics.GROUP_COLUMNS[0]), *analytics.GROUP_COLUMNS[1:])
+    with engine.connect() as conn:
+        rows = conn.execute(analytics.grouped(*key, func.count(), func.sum(Transfer.amount)).group_by(*key))
+        return {tuple(row[:4]): tuple(row[4:]) for row in rows}
+
+
+def matches(result, expected) -> bool:
+    found = {
+        (row.period, row.zoning or "", row.status.name, row.risk_level.name if row.risk_level else ""): row
+        for row in result.rows
+    }
+    return found.keys() == expected.keys() and all(
+        found[key].transfers == transfers and math.isclose(found[key].total_value, total, rel_tol=1e-9)
+        for key, (transfers, total) in expected.items()
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Empty database to fill (default: temporary SQLite file)")
+    parser.add_argument("--changes", type=int, default=2000, help="Writes made after the full refresh")
+    parser.add_argument("--repeat", type=int, default=20)
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+    # The writes below are newer than the high-water mark; no settle window needed
+    analytics.ANALYTICS_SETTLE_SECONDS = 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        started = time.perf_counter()
+        datagen.generate(engine, datagen.sizes_from_args(args), args.seed)
+        print(f"generated registry in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        report = analytics.refresh_rollups(engine, full=True)
+        print(f"refresh    full: {sum(report.seconds.values()):7.3f}s  "
+              f"{report.transfers} transfers, {report.rollups} rollups")
+
+        time.sleep(0.01)
+        write_changes(engine, args.changes, args.seed)
+        scan_ms = timed(lambda: on_the_fly(engine), max(args.repeat // 10, 1))
+        expected = on_the_fly(engine)
+        tail = read(engine)
+        tail_ms = timed(lambda: read(engine), args.repeat)
+
+        report = analytics.refresh_rollups(engine)
+        print(f"refresh    incr: {sum(report.seconds.values()):7.3f}s  "
+              f"{report.transfers} transfers, {report.rollups} rollups after {args.changes} changes")
+        refreshed = read(engine)
+        refreshed_ms = timed(lambda: read(engine), args.repeat)
+
+        print(f"monthly totals by zoning, status and risk ({len(expected)} rows):")
+        print(f"  rollups + tail of {tail.tail_transfers} transfers: {tail_ms:8.2f} ms  "
+              f"{'matches' if matches(tail, expected) else 'MISMATCH'}")
+        print(f"  rollups after refresh:  {refreshed_ms:8.2f} ms  "
+              f"{'matches' if matches(refreshed, expected) else 'MISMATCH'}")
+        print(f"  GROUP BY over transfers: {scan_ms:7.2f} ms ({scan_ms / refreshed_ms:.0f}x the rollup read)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Deterministic synthetic registry generator.
+
+    cd backend
+    python benchmarks/datagen.py --database-url sqlite:////tmp/registry.db --parcels 100000
+
+The same seed and sizes always produce the same rows. Ownership and
+activity are skewed the way real registries are: owners and parcels are
+drawn from a Zipf-like distribution, so user-0000000 is the most prolific
+owner and PLT-0000000 the most transferred ("hot") parcel, and parcels are
+clustered around a handful of towns.
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import Engine
+
+from models import (
+    AIAnalysis, Base, Document, DocumentType, Encumbrance, FraudAlert, FraudRiskLevel, Parcel,
+    ParcelStatus, Transaction, Transfer, TransferStatus, User, UserRole,
+)
+
+STREETS = ["Oak", "Pine", "Maple", "Cedar", "Elm", "Birch", "Willow", "Aspen", "Spruce", "Hickory"]
+SUFFIXES = ["Street", "Avenue", "Drive", "Lane", "Road", "Court"]
+# (name, lat, lng) of the town centres parcels cluster around
+TOWNS = [
+    ("Springfield", 40.71, -74.01), ("Riverside", 40.76, -73.98), ("Fairview", 40.82, -74.12),
+    ("Greenville", 40.64, -73.87), ("Franklin", 40.91, -74.19), ("Clinton", 40.58, -74.15),
+]
+FIRST = ["John", "Sarah", "Mike", "Emma", "Liam", "Olivia", "Noah", "Ava", "Ethan", "Mia"]
+LAST = ["Smith", "Johnson", "Wilson", "Brown", "Taylor", "Anderson", "Thomas", "Moore"]
+ENCUMBRANCE_TYPES = ["mortgage", "lien", "easement"]
+ALERT_REASONS = [
+    "Rapid successive transfers", "Price far below valuation", "Document hash mismatch",
+    "Owner identity flagged", "Duplicate survey report",
+]
+
+# Fixed so generated timestamps do not depend on when the generator runs
+EPOCH = datetime(2023, 1, 1)
+HISTORY_DAYS = 730
+BATCH_SIZE = 10000
+
+
+@dataclass
+class Sizes:
+    users: int = 2000
+    parcels: int = 10000
+    transfers: int = 20000
+    documents: int = 20000
+    alerts: int = 1000
+    skew: float = 1.0  # Zipf exponent; 0 is uniform
+
+
+class ZipfSampler:
+    """Draw indexes in [0, n) with P(i) proportional to 1 / (i + 1) ** s"""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1 / (i + 1) ** s for i in range(n)))
+
+    def __call__(self) -> int:
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+def _batched(rows: Iterator[dict]) -> Iterator[List[dict]]:
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def _timestamp(rng: random.Random) -> datetime:
+    return EPOCH + timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+
+
+def user_id(i: int) -> str:
+    return f"user-{i:07d}"
+
+
+def parcel_id(i: int) -> str:
+    return f"PLT-{i:07d}"
+
+
+def transfer_id(i: int) -> str:
+    return f"TXN-{i:07d}"
+
+
+def generate(engine: Engine, sizes: Sizes, seed: int = 7) -> Dict[str, int]:
+    """Create the schema and insert a synthetic registry; returns row counts per table"""
+    rng = random.Random(seed)
+    Base.metadata.create_all(engine)
+    owner_of = ZipfSampler(sizes.users, sizes.skew, rng)
+    hot_parcel = ZipfSampler(sizes.parcels, sizes.skew, rng)
+    owners = [0] * sizes.parcels
+    counts: Dict[str, int] = {}
+
+    def users():
+        for i in range(sizes.users):
+            yield {
+                "id": user_id(i), "email": f"user{i}@example.com",
+                "name": f"{rng.choice(FIRST)} {rng.choice(LAST)}", "phone": f"+1-555-{i % 10000:04d}",
+                "id_number": f"ID-{i:09d}",
+                "role": UserRole.ADMIN if i == sizes.users - 1 else UserRole.USER,
+                "is_active": rng.random() > 0.05,
+                "created_at": _timestamp(rng), "updated_at": EPOCH,
+            }
+
+    def parcels():
+        for i in range(sizes.parcels):
+            town, lat, lng = rng.choice(TOWNS)
+            owners[i] = owner_of()
+            created = _timestamp(rng)
+            area = round(rng.lognormvariate(9.2, 0.6), 1)
+            yield {
+                "id": parcel_id(i),
+                "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(SUFFIXES)}, {town}",
+                "coordinates_lat": rng.gauss(lat, 0.03), "coordinates_lng": rng.gauss(lng, 0.03),
+                "area_sqft": area, "area_display": f"{area / 43560:.2f} acres",
+                "zoning": rng.choice(["Residential R-1", "Residential R-2", "Commercial C-1"]),
+                "status": rng.choices(list(ParcelStatus), weights=[80, 15, 3, 2])[0],
+                "blockchain_hash": f"0x{rng.getrandbits(160):040x}",
+                "owner_id": user_id(owners[i]), "created_at": created, "updated_at": created,
+            }
+
+    def analyses():
+        for i in range(sizes.parcels):
+            risk = rng.random() ** 3
+            yield {
+                "id": f"ai-{i:07d}", "parcel_id": parcel_id(i),
+                "fraud_risk": list(FraudRiskLevel)[min(int(risk * 4), 3)], "risk_score": round(risk, 3),
+                "market_value": round(rng.lognormvariate(12.8, 0.5), -3), "confidence": round(rng.uniform(0.6, 0.99), 2),
+                "last_valuation": EPOCH, "created_at": EPOCH, "updated_at": EPOCH, "risk_changed_at": EPOCH,
+            }
+
+    def transfers():
+        for i in range(sizes.transfers):
+            parcel = hot_parcel()
+            created = _timestamp(rng)
+            yield {
+                "id": transfer_id(i), "parcel_id": parcel_id(parcel),
+                "from_user_id": user_id(owners[parcel]), "to_user_id": user_id(rng.randrange(sizes.users)),
+                "amount": round(rng.lognormvariate(12.8, 0.5), -2),
+                "status": rng.choices(list(TransferStatus), weights=[10, 5, 3, 80, 2])[0],
+                "transfer_date": created, "blockchain_hash": f"0x{rng.getrandbits(160):040x}",
+                "created_at": created, "updated_at": created,
+            }
+
+    def transactions():
+        for i in range(sizes.transfers):
+            yield {
+                "id": f"tx-{i:07d}", "type": "ownership_transfer", "parcel_id": parcel_id(hot_parcel()),
+                "from_entity": user_id(rng.randrange(sizes.users)), "to_entity": user_id(rng.randrange(sizes.users)),
+                "blockchain_hash": f"0x{rng.getrandbits(160):040x}", "transaction_date": _timestamp(rng),
+            }
+
+    def documents():
+        for i in range(sizes.documents):
+            on_transfer = sizes.transfers and rng.random() < 0.4
+            yield {
+                "id": f"doc-{i:07d}", "name": f"document-{i}.pdf",
+                "type": rng.choice(list(DocumentType)), "file_path": f"/documents/{i % 1000:03d}/{i}.pdf",
+                "file_size": rng.randint(20000, 5000000), "file_hash": f"{rng.getrandbits(256):064x}",
+                "is_verified": rng.random() < 0.7, "created_at": _timestamp(rng),
+                "parcel_id": None if on_transfer else parcel_id(hot_parcel()),
+                "transfer_id": transfer_id(rng.randrange(sizes.transfers)) if on_transfer else None,
+            }
+
+    def encumbrances():
+        for i in range(sizes.parcels // 10):
+            yield {
+                "id": f"enc-{i:07d}", "parcel_id": parcel_id(hot_parcel()), "type": rng.choice(ENCUMBRANCE_TYPES),
+                "description": "Synthetic encumbrance", "amount": round(rng.uniform(10000, 500000), -2),
+                "is_active": rng.random() < 0.8, "created_at": _timestamp(rng),
+            }
+
+    def alerts():
+        for i in range(sizes.alerts):
+            resolved = rng.random() < 0.6
+            created = _timestamp(rng)
+            yield {
+                "id": f"alert-{i:07d}", "parcel_id": parcel_id(hot_parcel()),
+                "risk_level": rng.choices(list(FraudRiskLevel), weights=[40, 35, 20, 5])[0],
+                "reason": rng.choice(ALERT_REASONS), "is_resolved": resolved, "created_at": created,
+                "resolved_at": created + timedelta(days=rng.randint(1, 60)) if resolved else None,
+                "reported_by": user_id(sizes.users - 1),
+            }
+
+    # Parents before children so foreign keys hold on PostgreSQL
+    for model, rows in [
+        (User, users()), (Parcel, parcels()), (AIAnalysis, analyses()), (Transfer, transfers()),
+        (Transaction, transactions()), (Document, documents()), (Encumbrance, encumbrances()),
+        (FraudAlert, alerts()),
+    ]:
+        counts[model.__tablename__] = 0
+        for batch in _batched(rows):
+            with engine.begin() as conn:
+                conn.execute(insert(model), batch)
+            counts[model.__tablename__] += len(batch)
+    return counts
+
+
+def add_size_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Sizes()
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name}", type=type(value), default=value)
+    parser.add_argument("--seed", type=int, default=7)
+
+
+def sizes_from_args(args: argparse.Namespace) -> Sizes:
+    return Sizes(**{name: getattr(args, name) for name in asdict(Sizes())})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", required=True, help="Empty database to fill")
+    add_size_arguments(parser)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    for table, count in generate(engine, sizes_from_args(args), args.seed).items():
+        print(f"{table:>14}: {count:,}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""Latency, throughput and SQL query counts for every read endpoint.
+
+    cd backend
+    python benchmarks/endpoint_bench.py --parcels 100000 --output bench.json
+    python benchmarks/endpoint_bench.py --parcels 100000 --compare bench.json
+
+Generates a synthetic registry with benchmarks/datagen.py (into a temporary
+SQLite file, or into --database-url, e.g. a local PostgreSQL), starts the
+app in-process and requests each scenario --requests times. Results are
+written as JSON so runs on different commits can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine, event
+from starlette.routing import Match
+
+import datagen
+
+HOT_PARCEL = datagen.parcel_id(0)
+HOT_USER = datagen.user_id(0)
+# Town centre of the first datagen town, and a viewport around it
+LAT, LNG = 40.71, -74.01
+STREET_BBOX = f"{LNG - 0.005},{LAT - 0.005},{LNG + 0.005},{LAT + 0.005}"
+CITY_BBOX = f"{LNG - 0.3},{LAT - 0.3},{LNG + 0.3},{LAT + 0.3}"
+
+
+def scenarios(sizes: datagen.Sizes) -> List[Tuple[str, str, Dict[str, str]]]:
+    """(name, path, headers); parcel/user/transfer IDs are the hottest and a cold one"""
+    cold_parcel = datagen.parcel_id(sizes.parcels - 1)
+    return [
+        ("parcels_list", "/parcels", {}),
+        ("parcels_search", "/parcels?search=oak%20street", {}),
+        ("parcels_search_owner", "/parcels?search=wilson", {}),
+        ("parcels_status", "/parcels?status=disputed", {}),
+        ("parcels_within_street", f"/parcels/within?bbox={STREET_BBOX}", {}),
+        ("parcels_within_city", f"/parcels/within?bbox={CITY_BBOX}", {}),
+        ("parcels_near", f"/parcels/near?lat={LAT}&lng={LNG}&radius=500", {}),
+        ("parcels_nearest", f"/parcels/nearest?lat={LAT}&lng={LNG}&k=10", {}),
+        ("parcel_hot", f"/parcel/{HOT_PARCEL}", {}),
+        ("parcel_cold", f"/parcel/{cold_parcel}", {}),
+        ("parcel_hot_not_modified", f"/parcel/{HOT_PARCEL}", {"If-None-Match": "*"}),
+        ("transfers_list", "/transfers", {}),
+        ("transfers_pending", "/transfers?status=pending", {}),
+        ("transfer_detail", f"/transfers/{datagen.transfer_id(0)}", {}),
+        ("dashboard_stats", "/dashboard/stats", {}),
+        ("fraud_alerts", "/fraud-alerts", {}),
+        ("fraud_alerts_open", "/fraud-alerts?resolved=false", {}),
+        ("users_list", "/users", {}),
+        ("user_detail", f"/users/{HOT_USER}", {}),
+        ("cache_stats", "/cache/stats", {}),
+        ("export_transfers", "/export/transfers", {}),
+    ]
+
+
+def percentile(samples: List[float], q: int) -> float:
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1] if len(samples) > 1 else samples[0]
+
+
+def run(database_url: str, sizes: datagen.Sizes, seed: int, requests: int, warmup: int, generate: bool) -> dict:
+    if generate:
+        engine = create_engine(database_url)
+        started = time.perf_counter()
+        datagen.generate(engine, sizes, seed)
+        engine.dispose()
+        print(f"generated registry in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    # database.py reads DATABASE_URL at import time
+    os.environ["DATABASE_URL"] = database_url
+    from fastapi.routing import APIRoute
+    from fastapi.testclient import TestClient
+
+    import database
+    import main
+
+    queries = 0
+
+    def count_query(*args):
+        nonlocal queries
+        queries += 1
+
+    event.listen(database.engine, "before_cursor_execute", count_query)
+    if database.async_engine is not None:
+        event.listen(database.async_engine.sync_engine, "before_cursor_execute", count_query)
+
+    results = []
+    covered = set()
+    with TestClient(main.app) as client:
+        routes = [route for route in main.app.routes if isinstance(route, APIRoute) and "GET" in route.methods]
+        for name, path, headers in scenarios(sizes):
+            scope = {"type": "http", "path": path.split("?")[0], "method": "GET"}
+            covered.update(route.path_format for route in routes if route.matches(scope)[0] == Match.FULL)
+            for _ in range(warmup):
+                client.get(path, headers=headers)
+            latencies, statuses, query_counts = [], {}, []
+            started = time.perf_counter()
+            for _ in range(requests):
+                before = queries
+                t0 = time.perf_counter()
+                response = client.get(path, headers=headers)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                query_counts.append(queries - before)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            elapsed = time.perf_counter() - started
+            results.append({
+                "name": name,
+                "path": path,
+                "requests": requests,
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "mean_ms": round(statistics.fmean(latencies), 3),
+                "throughput_rps": round(requests / elapsed, 1),
+                "queries_per_request": round(statistics.fmean(query_counts), 2),
+                "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+            })
+            print(f"{name:>26}  p50 {results[-1]['p50_ms']:8.2f} ms  p99 {results[-1]['p99_ms']:8.2f} ms  "
+                  f"{results[-1]['throughput_rps']:8.1f} req/s  {results[-1]['queries_per_request']:5.1f} queries",
+                  file=sys.stderr)
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "dialect": database.engine.dialect.name,
+            "db_async": database.DB_ASYNC,
+            "python": platform.python_version(),
+            "sizes": asdict(sizes),
+            "seed": seed,
+            "requests": requests,
+            "warmup": warmup,
+        },
+        "results": results,
+        # Read endpoints without a scenario; writes (e.g. POST /import) are not benchmarked here
+        "not_covered": sorted({route.path_format for route in routes} - covered),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict) -> None:
+    """Print p50/p99/query-count changes per scenario against an earlier run"""
+    before = {result["name"]: result for result in previous["results"]}
+    print(f"compared with {previous['meta'].get('commit')} ({previous['meta'].get('timestamp')})")
+    for result in current["results"]:
+        old = before.get(result["name"])
+        if old is None:
+            continue
+        p50 = (result["p50_ms"] / old["p50_ms"] - 1) * 100 if old["p50_ms"] else 0.0
+        p99 = (result["p99_ms"] / old["p99_ms"] - 1) * 100 if old["p99_ms"] else 0.0
+        print(f"{result['name']:>26}  p50 {p50:+7.1f}%  p99 {p99:+7.1f}%  "
+              f"queries {old['queries_per_request']:.1f} -> {result['queries_per_request']:.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Database to use instead of a temporary SQLite file")
+    parser.add_argument("--no-generate", action="store_true", help="Benchmark --database-url as is")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier JSON results to compare against")
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    # Read before --output may overwrite the same file
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    sizes = datagen.sizes_from_args(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        report = run(database_url, sizes, args.seed, args.requests, args.warmup, not args.no_generate)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if previous:
+        compare(previous, report)
+    elif not args.output:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Time ownership-graph queries against the SQL they replace.
+
+    cd backend
+    python benchmarks/graph_bench.py --transfers 200000 --documents 0 --synthetic 10000000
+
+Generates the registry with benchmarks/datagen.py, loads the ownership graph
+from it, and compares the provenance of the busiest parcel and the 2-hop
+neighborhood of the busiest user with the per-parcel and per-hop SQL queries
+they replace. --synthetic then appends that many more random transfers
+(datagen's skew, in memory only) and times every graph query again, to show
+latency at tens of millions of edges without generating them in a database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sqlalchemy import create_engine, func, or_, select
+from sqlalchemy.orm import Session
+
+import datagen
+import ownership_graph
+from fraud_scoring import FAILED
+from models import Transfer
+
+BATCH = 1000000
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def sql_neighborhood(session: Session, user_id: str, hops: int) -> set:
+    """The recursive-query way: one round trip per hop"""
+    seen, frontier = {user_id}, {user_id}
+    for _ in range(hops):
+        rows = session.execute(
+            select(Transfer.from_user_id, Transfer.to_user_id).where(
+                or_(Transfer.from_user_id.in_(frontier), Transfer.to_user_id.in_(frontier)),
+                Transfer.status.not_in(FAILED),
+            )
+        )
+        frontier = {user for row in rows for user in row} - seen
+        seen |= frontier
+    return seen
+
+
+def add_synthetic(graph: ownership_graph.OwnershipGraph, count: int, sizes, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    start = ownership_graph._seconds(datagen.EPOCH)
+    codes = np.array(list(ownership_graph._CODE.values()), np.int8)
+    for offset in range(0, count, BATCH):
+        n = min(BATCH, count - offset)
+        # Zipf-like parcels and sellers, uniform buyers, as datagen draws them
+        parcels = np.minimum(rng.zipf(1 + max(sizes.skew, 0.01), n) - 1, sizes.parcels - 1)
+        sellers = np.minimum(rng.zipf(1 + max(sizes.skew, 0.01), n) - 1, sizes.users - 1)
+        buyers = rng.integers(0, sizes.users, n)
+        times = start + rng.uniform(0, datagen.HISTORY_DAYS * 86400, n)
+        amounts = np.round(rng.lognormal(12.8, 0.5, n), -2)
+        statuses = rng.choice(codes, n, p=[0.1, 0.05, 0.03, 0.8, 0.02])
+        graph.add(
+            ownership_graph.Edge(
+                f"SYN-{offset + i:09d}", datagen.parcel_id(p), datagen.user_id(s), datagen.user_id(b), t, a, c
+            )
+            for i, (p, s, b, t, a, c) in enumerate(zip(
+                parcels.tolist(), sellers.tolist(), buyers.tolist(), times.tolist(), amounts.tolist(), statuses.tolist()
+            ))
+        )
+
+
+def report(graph: ownership_graph.OwnershipGraph, repeat: int) -> None:
+    columns = graph._columns
+    size = len(graph)
+    parcel = graph.parcels[int(np.bincount(columns["parcel"][:size]).argmax())]
+    user = graph.users[int(np.bincount(columns["src"][:size]).argmax())]
+    end = graph._latest
+    print(f"{size:,} transfers, {len(graph.users):,} users, {len(graph.parcels):,} parcels")
+    for label, fn in (
+        ("provenance (busiest parcel)", lambda: graph.provenance(parcel)),
+        ("neighborhood 2 hops, 90 days", lambda: graph.neighborhood(user, 2, end - 90 * 86400, end, 200)),
+        ("parcel cycles, 30 days", lambda: graph.parcel_cycles(end - 30 * 86400, end, None, 100)),
+        ("transfer cycles, 7 days", lambda: graph.transfer_cycles(end - 7 * 86400, end, None, 4, 100)),
+        ("clusters k=3, 30 days", lambda: graph.clusters(end - 30 * 86400, end, 3, 3, 50)),
+    ):
+        print(f"  {label:32} {timed(fn, repeat):9.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Empty database to fill (default: temporary SQLite file)")
+    parser.add_argument("--synthetic", type=int, default=0, help="In-memory transfers to add after the comparison")
+    parser.add_argument("--repeat", type=int, default=20)
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+    sizes = datagen.sizes_from_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        started = time.perf_counter()
+        datagen.generate(engine, sizes, args.seed)
+        print(f"generated registry in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        graph = ownership_graph.OwnershipGraph()
+        with Session(engine) as session:
+            started = time.perf_counter()
+            graph.rebuild(session)
+            print(f"rebuild: {time.perf_counter() - started:.2f}s")
+
+            busiest_parcel = session.execute(
+                select(Transfer.parcel_id).group_by(Transfer.parcel_id).order_by(func.count().desc()).limit(1)
+            ).scalar()
+            busiest_user = session.execute(
+                select(Transfer.from_user_id).group_by(Transfer.from_user_id).order_by(func.count().desc()).limit(1)
+            ).scalar()
+            end = graph._latest
+            sql_ms = timed(lambda: session.execute(
+                select(Transfer).where(Transfer.parcel_id == busiest_parcel).order_by(Transfer.transfer_date)
+            ).all(), max(args.repeat // 4, 1))
+            graph_ms = timed(lambda: graph.provenance(busiest_parcel), args.repeat)
+            print(f"provenance: SQL {sql_ms:.2f} ms, graph {graph_ms:.2f} ms ({sql_ms / graph_ms:.0f}x)")
+            sql_ms = timed(lambda: sql_neighborhood(session, busiest_user, 2), max(args.repeat // 4, 1))
+            graph_ms = timed(lambda: graph.neighborhood(
+                busiest_user, 2, ownership_graph._seconds(datagen.EPOCH - timedelta(days=1)), end, 1000
+            ), args.repeat)
+            print(f"neighborhood 2 hops: SQL {sql_ms:.2f} ms, graph {graph_ms:.2f} ms ({sql_ms / graph_ms:.0f}x)")
+        engine.dispose()
+
+    report(graph, args.repeat)
+    if args.synthetic:
+        started = time.perf_counter()
+        add_synthetic(graph, args.synthetic, sizes, args.seed)
+        print(f"added {args.synthetic:,} synthetic transfers in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        report(graph, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Time the ledger backfill, appends, proofs and a full rehash.
+
+    cd backend
+    python benchmarks/ledger_bench.py --transfers 200000 --documents 0
+
+Generates the registry with benchmarks/datagen.py and appends every transfer
+and transaction to an empty ledger, hashing on LEDGER_WORKERS processes. Then
+it times appending --batch new leaves, building inclusion and consistency
+proofs, and, for comparison, recomputing the root from all leaf hashes, which
+is what each proof would cost without the stored tree levels.
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+import datagen
+import ledger
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Empty database to fill (default: temporary SQLite file)")
+    parser.add_argument("--batch", type=int, default=1000, help="Leaves per timed in-memory append")
+    parser.add_argument("--repeat", type=int, default=200)
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        started = time.perf_counter()
+        datagen.generate(engine, datagen.sizes_from_args(args), args.seed)
+        print(f"generated registry in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        started = time.perf_counter()
+        appended = ledger.ledger.append_missing(engine)
+        print(f"backfill: {time.perf_counter() - started:6.2f}s  {appended:,} leaves on {ledger.LEDGER_WORKERS} workers")
+
+        tree = ledger.ledger.tree
+        size = len(tree)
+        extra = ledger.hash_leaves([("transfer", {"id": f"bench-{i}"}) for i in range(args.batch)])
+        append_ms = timed(lambda: (tree.extend(extra), tree.truncate(size)), max(args.repeat // 10, 1))
+        root_ms = timed(tree.root, args.repeat)
+        inclusion_ms = timed(lambda: tree.inclusion_proof(size // 3, size), args.repeat)
+        consistency_ms = timed(lambda: tree.consistency_proof(size // 3, size), args.repeat)
+
+        leaves = [tree.leaf(i) for i in range(size)]
+
+        def full_root():
+            level = leaves
+            while len(level) > 1:
+                # RFC 6962 promotes an odd last node unchanged, like the stored levels do
+                level = [
+                    hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest() if i + 1 < len(level) else level[i]
+                    for i in range(0, len(level), 2)
+                ]
+            return level[0]
+
+        assert full_root() == tree.root()
+        rehash_ms = timed(full_root, 3)
+        print(f"{size:,} leaves: append {args.batch} {append_ms:.2f} ms, root {root_ms:.3f} ms, "
+              f"inclusion proof {inclusion_ms:.3f} ms, consistency proof {consistency_ms:.3f} ms, "
+              f"full rehash {rehash_ms:.0f} ms ({rehash_ms / inclusion_ms:.0f}x a proof)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Read-replica routing against two local SQLite files.
+
+    cd backend
+    python benchmarks/replica_bench.py --readers 16 --duration 20 --replication-delay 2 --documents 0
+
+Generates the registry into a primary file with benchmarks/datagen.py and
+starts the API under uvicorn with DATABASE_REPLICA_URL pointing at a second
+file. A thread stands in for replication: every --replication-delay seconds
+it copies the primary into the replica with SQLite's backup API. The first
+half of the run replicates; in the second half the copies stop, so the
+replica falls behind and reads must move to the primary.
+
+Reader clients request the read endpoints throughout. A writer sells a
+parcel, reads the transfer back at once with the cookie its write set (it
+must always be found), and checks whether a client without the cookie sees
+it yet, which shows the replica is really read. Both halves report read
+throughput, where the reads went (GET /replica/stats) and any
+read-your-writes violations.
+
+Against PostgreSQL, point DATABASE_REPLICA_URL at a streaming standby
+instead; no copying is involved.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import create_engine, select
+
+import datagen
+from db_mode_bench import BACKEND_DIR, PATHS, free_port
+from models import Parcel, Transfer, TransferStatus, User
+
+
+class Replicator(threading.Thread):
+    """Copies the primary file over the replica every `delay` seconds while `running` is set"""
+
+    def __init__(self, primary: str, replica: str, delay: float):
+        super().__init__(name="replicator", daemon=True)
+        self.primary, self.replica, self.delay = primary, replica, delay
+        self.running = threading.Event()
+        self.stopped = threading.Event()
+        self.copies = 0
+
+    def copy(self) -> None:
+        source, target = sqlite3.connect(self.primary), sqlite3.connect(self.replica, timeout=30)
+        try:
+            source.backup(target)
+            self.copies += 1
+        finally:
+            source.close()
+            target.close()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.delay):
+            if self.running.is_set():
+                self.copy()
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            stats = (await client.get("/replica/stats")).json()
+            # Ready once the first heartbeat has been read back from the replica
+            if stats["lag"] is not None:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start, or the replica never received a heartbeat")
+
+
+async def phase(base_url: str, parcels, users, seconds: float, args) -> dict:
+    rng = random.Random(args.seed)
+    latencies, checks = [], Counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as stats_client:
+        before = (await stats_client.get("/replica/stats")).json()["reads"]
+        stop = time.monotonic() + seconds
+
+        async def reader() -> None:
+            async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+                while time.monotonic() < stop:
+                    started = time.perf_counter()
+                    await client.get(rng.choice(PATHS))
+                    latencies.append(time.perf_counter() - started)
+
+        async def writer() -> None:
+            # Its own cookie jar, so its reads carry the write cookie; `other` has none
+            async with httpx.AsyncClient(base_url=base_url, timeout=60) as client, \
+                    httpx.AsyncClient(base_url=base_url, timeout=60) as other:
+                while time.monotonic() < stop:
+                    parcel_id, owner = rng.choice(parcels)
+                    buyer = rng.choice(users)
+                    if buyer == owner:
+                        continue
+                    sale = await client.post(
+                        "/transfers", json={"parcel_id": parcel_id, "to_user_id": buyer, "amount": 100000.0}
+                    )
+                    if sale.status_code != 201:
+                        checks[f"sale {sale.status_code}"] += 1
+                        continue
+                    transfer_id = sale.json()["id"]
+                    checks["own read found" if (await client.get(f"/transfers/{transfer_id}")).status_code == 200
+                           else "own read MISSING"] += 1
+                    checks["other client found" if (await other.get(f"/transfers/{transfer_id}")).status_code == 200
+                           else "other client not yet"] += 1
+                    await client.post(f"/transfers/{transfer_id}/status", json={"status": "cancelled"})
+                    await asyncio.sleep(args.write_interval)
+
+        started = time.monotonic()
+        await asyncio.gather(writer(), *(reader() for _ in range(args.readers)))
+        elapsed = time.monotonic() - started
+        after = (await stats_client.get("/replica/stats")).json()
+    latencies.sort()
+    return {
+        "reads/s": len(latencies) / elapsed,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "routed": {name: after["reads"][name] - before[name] for name in before},
+        "lag": after["lag"],
+        "checks": dict(checks),
+    }
+
+
+async def drive(base_url: str, replicator: Replicator, parcels, users, args) -> None:
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        await wait_ready(client, args.startup_timeout)
+    for label, replicating in (("replicating", True), ("replication stopped", False)):
+        (replicator.running.set if replicating else replicator.running.clear)()
+        result = await phase(base_url, parcels, users, args.duration / 2, args)
+        lag = "unknown" if result["lag"] is None else f"{result['lag']:.1f}s"
+        print(
+            f"{label:>19}: {result['reads/s']:8.1f} reads/s  p50 {result['p50 ms']:7.1f} ms  "
+            f"p99 {result['p99 ms']:7.1f} ms  lag {lag}"
+        )
+        print(f"{'':>21}reads {result['routed']}")
+        print(f"{'':>21}writer {result['checks']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="Seconds, split between the two phases")
+    parser.add_argument("--replication-delay", type=float, default=2, help="Seconds between copies to the replica")
+    parser.add_argument("--max-lag", type=float, default=5, help="DB_REPLICA_MAX_LAG of the server")
+    parser.add_argument("--write-interval", type=float, default=0.05, help="Pause of the writer between sales")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        primary, replica = os.path.join(tmp, "primary.db"), os.path.join(tmp, "replica.db")
+        engine = create_engine(f"sqlite:///{primary}")
+        started = time.perf_counter()
+        datagen.generate(engine, datagen.sizes_from_args(args), args.seed)
+        print(f"generated registry in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        with engine.connect() as conn:
+            # Parcels with an open transfer take no new sale
+            busy = select(Transfer.parcel_id).where(Transfer.status.in_((TransferStatus.PENDING, TransferStatus.APPROVED)))
+            parcels = conn.execute(select(Parcel.id, Parcel.owner_id).where(Parcel.id.not_in(busy))).all()
+            users = conn.scalars(select(User.id)).all()
+        engine.dispose()
+
+        replicator = Replicator(primary, replica, args.replication_delay)
+        replicator.copy()
+        replicator.running.set()
+        replicator.start()
+        port = free_port()
+        env = dict(
+            os.environ, DATABASE_URL=f"sqlite:///{primary}", DATABASE_REPLICA_URL=f"sqlite:///{replica}",
+            DB_REPLICA_MAX_LAG=str(args.max_lag),
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env,
+        )
+        try:
+            asyncio.run(drive(f"http://127.0.0.1:{port}", replicator, parcels, users, args))
+        finally:
+            server.terminate()
+            server.wait()
+            replicator.stopped.set()
+            replicator.join()
+        print(f"{replicator.copies} copies to the replica")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Compare the legacy ILIKE search path with the trigram search index.
+
+    cd backend
+    python benchmarks/search_bench.py --sizes 100000 1000000
+
+Builds a throwaway SQLite registry per size (or uses --database-url for a
+local PostgreSQL, where the pg_trgm path is measured instead of the
+in-process index) and reports the median latency of a few representative
+search terms.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from models import Base, Parcel, ParcelStatus, User, UserRole
+import search as parcel_search
+
+STREETS = ["Oak", "Pine", "Maple", "Cedar", "Elm", "Birch", "Willow", "Aspen", "Spruce", "Hickory"]
+SUFFIXES = ["Street", "Avenue", "Drive", "Lane", "Road", "Court"]
+TOWNS = ["Springfield", "Riverside", "Fairview", "Greenville", "Franklin", "Clinton"]
+FIRST = ["John", "Sarah", "Mike", "Emma", "Liam", "Olivia", "Noah", "Ava", "Ethan", "Mia"]
+LAST = ["Smith", "Johnson", "Wilson", "Brown", "Taylor", "Anderson", "Thomas", "Moore"]
+TERMS = ["oak street", "Riverside", "wilson", "PLT-00012", "zzz-no-match"]
+
+
+def populate(engine, parcels: int, seed: int = 7) -> None:
+    rng = random.Random(seed)
+    users = max(parcels // 5, 1)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"id": f"user-{i:07d}", "email": f"user{i}@example.com",
+             "name": f"{rng.choice(FIRST)} {rng.choice(LAST)}", "role": UserRole.USER}
+            for i in range(users)
+        ])
+        for start in range(0, parcels, 50000):
+            conn.execute(insert(Parcel), [
+                {"id": f"PLT-{i:07d}",
+                 "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)} {rng.choice(SUFFIXES)}, {rng.choice(TOWNS)}",
+                 "coordinates_lat": 40 + rng.random(), "coordinates_lng": -74 + rng.random(),
+                 "area_sqft": rng.uniform(2000, 40000), "status": ParcelStatus.VERIFIED,
+                 "owner_id": f"user-{rng.randrange(users):07d}"}
+                for i in range(start, min(start + 50000, parcels))
+            ])
+
+
+def ilike_search(db: Session, term: str):
+    pattern = f"%{term}%"
+    query = (
+        select(Parcel.id)
+        .join(User, Parcel.owner_id == User.id)
+        .where(Parcel.address.ilike(pattern) | User.name.ilike(pattern) | Parcel.id.ilike(pattern))
+        .order_by(Parcel.id)
+        .limit(50)
+    )
+    return db.execute(query).all()
+
+
+def trigram_sql_search(db: Session, term: str):
+    rank = parcel_search.rank_expression(term)
+    query = (
+        select(Parcel.id, rank)
+        .join(User, Parcel.owner_id == User.id)
+        .where(parcel_search.search_filter(term))
+        .order_by(rank, Parcel.id)
+        .limit(50)
+    )
+    return db.execute(query).all()
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def run(size: int, database_url: str, repeat: int) -> None:
+    engine = create_engine(database_url)
+    populate(engine, size)
+    index = parcel_search.ParcelSearchIndex()
+    with Session(engine) as db:
+        use_sql = parcel_search.uses_sql_trigram(engine)
+        if not use_sql:
+            start = time.perf_counter()
+            index.rebuild(db)
+            print(f"[{size:>9,}] index build: {time.perf_counter() - start:.1f}s")
+        for term in TERMS:
+            legacy = timed(lambda: ilike_search(db, term), repeat)
+            if use_sql:
+                fast = timed(lambda: trigram_sql_search(db, term), repeat)
+            else:
+                fast = timed(lambda: index.page(term, None, None, 50), repeat)
+            print(f"[{size:>9,}] {term!r:>16}  ilike {legacy:9.2f} ms   trigram {fast:9.2f} ms")
+    engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--database-url", help="Existing empty database to use instead of a temporary SQLite file")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        if args.database_url:
+            run(size, args.database_url, args.repeat)
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            run(size, f"sqlite:///{os.path.join(tmp, 'bench.db')}", args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Time the fast-path list serialization against the pydantic path.
+
+    cd backend
+    python benchmarks/serialization_bench.py --parcels 50000 --limit 500
+
+Builds a synthetic registry, then requests the first page of every
+fast-path endpoint with FAST_SERIALIZATION on and off and reports the
+median latency of both paths. That both answer byte-identical bodies is
+checked by tests/test_serialization.py.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+
+import datagen
+
+PATHS = [
+    "/parcels?limit={limit}",
+    "/parcels?search=oak&limit={limit}",
+    "/users?limit={limit}",
+    "/fraud-alerts?limit={limit}",
+    "/transfers?compact=true&limit={limit}",
+]
+
+
+def timed(client, path: str, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        client.get(path)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_engine(database_url)
+        datagen.generate(engine, datagen.sizes_from_args(args), args.seed)
+        engine.dispose()
+
+        os.environ["DATABASE_URL"] = database_url
+        from fastapi.testclient import TestClient
+
+        import main as app_main
+        import serialization
+
+        if serialization.orjson is None:
+            sys.exit("orjson is not installed; the fast path is disabled")
+
+        with TestClient(app_main.app) as client:
+            for template in PATHS:
+                path = template.format(limit=args.limit)
+                serialization.FAST_SERIALIZATION = "none"
+                slow_ms = timed(client, path, args.repeat)
+                serialization.FAST_SERIALIZATION = "all"
+                fast_ms = timed(client, path, args.repeat)
+                print(f"{path:>42}  pydantic {slow_ms:7.2f} ms  fast {fast_ms:7.2f} ms  ({slow_ms / fast_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Throughput of POST /transfers under contention, with and without group commit.
+
+    cd backend
+    python benchmarks/transfer_write_bench.py --concurrency 64 --duration 15 --documents 0
+
+Generates the registry with benchmarks/datagen.py, then starts the API under
+uvicorn twice against it: once with GROUP_COMMIT_MAX_WRITES=1 (a commit per
+write) and once with the default group commit. Each client sells a parcel
+and cancels the sale once it is accepted, so the parcel can be sold again.
+--hot-share of the sales go to --hot-parcels parcels, which makes clients
+race for them; the losers get 409. --retry-share of accepted sales are sent
+again under the same Idempotency-Key and must be replayed. Afterwards no
+parcel may have gained a second open transfer.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import create_engine, func, select
+
+import datagen
+from db_mode_bench import BACKEND_DIR, free_port
+from models import Parcel, Transfer, TransferStatus, User
+
+# transfers.OPEN; importing transfers would connect to DATABASE_URL
+OPEN = (TransferStatus.PENDING, TransferStatus.APPROVED)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/transfers/writes/stats")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def drive(base_url: str, parcels, users, args) -> dict:
+    rng = random.Random(args.seed)
+    hot = parcels[:args.hot_parcels]
+    cold = parcels[args.hot_parcels:]
+    latencies, outcomes = [], Counter()
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        await wait_ready(client, args.startup_timeout)
+        stop = time.monotonic() + args.duration
+
+        async def post(path: str, body: dict, key: str) -> httpx.Response:
+            started = time.perf_counter()
+            response = await client.post(path, json=body, headers={"Idempotency-Key": key})
+            latencies.append(time.perf_counter() - started)
+            return response
+
+        async def worker(n: int) -> None:
+            # Cold parcels are split between clients, so only hot ones are contended
+            mine = cold[n::args.concurrency] or cold
+            while time.monotonic() < stop:
+                parcel_id, owner = rng.choice(hot) if rng.random() < args.hot_share else rng.choice(mine)
+                buyer = rng.choice(users)
+                if buyer == owner:
+                    continue
+                body = {"parcel_id": parcel_id, "to_user_id": buyer, "amount": 100000.0}
+                key = uuid.uuid4().hex
+                try:
+                    response = await post("/transfers", body, key)
+                    outcomes[response.status_code] += 1
+                    if response.status_code != 201:
+                        continue
+                    if rng.random() < args.retry_share:
+                        retry = await post("/transfers", body, key)
+                        outcomes["replayed" if retry.headers.get("idempotent-replayed") else "not replayed"] += 1
+                    cancel = await post(f"/transfers/{response.json()['id']}/status", {"status": "cancelled"}, uuid.uuid4().hex)
+                    outcomes[f"cancel {cancel.status_code}"] += 1
+                except httpx.TransportError as exc:
+                    # A keep-alive connection the server closed as it was reused; the sale may stay open
+                    outcomes[type(exc).__name__] += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(worker(n) for n in range(args.concurrency)))
+        elapsed = time.monotonic() - started
+        batches = (await client.get("/transfers/writes/stats")).json()
+    latencies.sort()
+    return {
+        "writes/s": len(latencies) / elapsed,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "outcomes": dict(outcomes),
+        "mean batch": batches["mean_batch"],
+        "retried": batches["retried"],
+    }
+
+
+def double_sold(engine) -> int:
+    """Parcels with more than one open transfer (datagen's random statuses leave some)"""
+    with engine.connect() as conn:
+        return conn.scalar(select(func.count()).select_from(
+            select(Transfer.parcel_id).where(Transfer.status.in_(OPEN))
+            .group_by(Transfer.parcel_id).having(func.count() > 1).subquery()
+        ))
+
+
+def run(label: str, database_url: str, max_writes: str, parcels, users, args) -> None:
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, GROUP_COMMIT_MAX_WRITES=max_writes)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        result = asyncio.run(drive(f"http://127.0.0.1:{port}", parcels, users, args))
+    finally:
+        server.terminate()
+        server.wait()
+    print(
+        f"{label:>13}: {result['writes/s']:8.1f} writes/s  p50 {result['p50 ms']:7.1f} ms  "
+        f"p99 {result['p99 ms']:7.1f} ms  mean batch {result['mean batch']:5.1f}  retried {result['retried']}"
+    )
+    print(f"{'':>15}{result['outcomes']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Empty database to fill (default: temporary SQLite file)")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--hot-parcels", type=int, default=8, help="Parcels every client competes for")
+    parser.add_argument("--hot-share", type=float, default=0.2, help="Share of sales that go to the hot parcels")
+    parser.add_argument("--retry-share", type=float, default=0.1, help="Share of accepted sales sent twice")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        engine = create_engine(database_url)
+        started = time.perf_counter()
+        datagen.generate(engine, datagen.sizes_from_args(args), args.seed)
+        print(f"generated registry in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        if engine.dialect.name == "sqlite":
+            # Readers then do not wait for each commit; the mode is stored in the file
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        with engine.connect() as conn:
+            # Parcels with an open transfer take no new sale
+            busy = select(Transfer.parcel_id).where(Transfer.status.in_(OPEN))
+            parcels = conn.execute(
+                select(Parcel.id, Parcel.owner_id).where(Parcel.id.not_in(busy)).order_by(Parcel.id)
+            ).all()
+            users = conn.scalars(select(User.id)).all()
+        random.Random(args.seed).shuffle(parcels)
+        before = double_sold(engine)
+        print(f"{len(parcels):,} parcels without an open transfer, {args.hot_parcels} hot", file=sys.stderr)
+
+        run("commit each", database_url, "1", parcels, users, args)
+        run("group commit", database_url, os.getenv("GROUP_COMMIT_MAX_WRITES", "256"), parcels, users, args)
+
+        print(f"parcels sold twice: {double_sold(engine) - before}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Time the valuation migration, rollup refreshes and rollup reads.
+
+    cd backend
+    python benchmarks/valuation_bench.py --parcels 100000 --points 24 --legacy 0.2 --documents 0
+
+Generates the registry with benchmarks/datagen.py, then gives every parcel
+--points monthly valuations over datagen's history: a --legacy share of the
+parcels as AIAnalysis.price_history arrays, the rest as valuation rows. It
+migrates the arrays, times a full and a newest-quarter rollup refresh, and then
+compares the median latency of reading a year of per-zoning rollups with
+the same year aggregated on the fly by SQL. The SQL version only averages,
+because medians have no portable SQL form.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, insert, select, update
+
+import datagen
+import valuations
+from models import AIAnalysis, Parcel, Valuation, ValuationRollup
+
+
+def add_points(engine, parcels: int, points: int, legacy: float, seed: int) -> None:
+    rng = random.Random(seed)
+    start = datagen.EPOCH.date()
+    months = [date(start.year + (start.month - 1 + i) // 12, (start.month - 1 + i) % 12 + 1, 1) for i in range(points)]
+    rows = []
+    for i in range(parcels):
+        value = rng.lognormvariate(12.8, 0.5)
+        series = []
+        for month in months:
+            value *= rng.uniform(0.98, 1.03)
+            series.append((month.replace(day=rng.randint(1, 28)), round(value, -2)))
+        if rng.random() < legacy:
+            history = [{"date": day.isoformat(), "value": v} for day, v in series]
+            with engine.begin() as conn:
+                conn.execute(update(AIAnalysis).where(AIAnalysis.parcel_id == datagen.parcel_id(i)).values(
+                    price_history=history
+                ))
+            continue
+        rows.extend({"parcel_id": datagen.parcel_id(i), "date": day, "value": v, "source": "ai"} for day, v in series)
+        if len(rows) >= datagen.BATCH_SIZE or i == parcels - 1:
+            with engine.begin() as conn:
+                conn.execute(insert(Valuation), rows)
+            rows = []
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", help="Empty database to fill (default: temporary SQLite file)")
+    parser.add_argument("--points", type=int, default=24, help="Monthly valuations per parcel")
+    parser.add_argument("--legacy", type=float, default=0.2, help="Share of parcels whose history starts as JSON")
+    parser.add_argument("--repeat", type=int, default=20)
+    datagen.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        started = time.perf_counter()
+        datagen.generate(engine, datagen.sizes_from_args(args), args.seed)
+        add_points(engine, args.parcels, args.points, args.legacy, args.seed)
+        print(f"generated registry in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        started = time.perf_counter()
+        migrated = valuations.migrate_price_history(engine)
+        print(f"migrate: {time.perf_counter() - started:6.2f}s  {migrated['analyses']} analyses, "
+              f"{migrated['points']} points")
+
+        # Everything, then only the newest quarter, which is what the background refresh sees day to day
+        with engine.connect() as conn:
+            newest = conn.execute(select(func.max(Valuation.date))).scalar()
+        for label, since in (("full", None), ("quarter", newest)):
+            report = valuations.refresh_rollups(engine, since)
+            print(f"refresh {label:>7}: {sum(report.seconds.values()):6.2f}s  {report.model_dump_json()}")
+
+        year = (date(datagen.EPOCH.year, 1, 1), date(datagen.EPOCH.year, 12, 31))
+        period = valuations.month_start(Valuation.date)
+        with engine.connect() as conn:
+            rollups_ms = timed(lambda: conn.execute(
+                select(ValuationRollup).where(
+                    ValuationRollup.interval == "month", ValuationRollup.period.between(*year)
+                )
+            ).all(), args.repeat)
+            on_the_fly_ms = timed(lambda: conn.execute(
+                select(period, Parcel.zoning, func.count(), func.avg(Valuation.value))
+                .join(Parcel, Parcel.id == Valuation.parcel_id)
+                .where(Valuation.date.between(*year)).group_by(period, Parcel.zoning)
+            ).all(), max(args.repeat // 10, 1))
+            total = conn.execute(select(func.count()).select_from(Valuation)).scalar()
+        print(f"{total:,} points; a year of monthly aggregates: rollups {rollups_ms:.2f} ms, "
+              f"SQL GROUP BY {on_the_fly_ms:.2f} ms ({on_the_fly_ms / rollups_ms:.0f}x)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Streaming bulk import of users, parcels, transfers and documents.
+
+    cd backend
+    python bulk_import.py parcels parcels.csv --chunk-size 5000 --checkpoint parcels-2024
+
+Input is CSV (header row) or NDJSON, read in bounded chunks. Every row is
+validated with the matching *Create schema, chunks are written with batched
+executemany (or PostgreSQL COPY with --copy), and rows that fail validation
+or a constraint are reported individually without aborting the import.
+"""
+import argparse
+import csv
+import json
+import sys
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from models import Document, ImportCheckpoint, Parcel, Transfer, User
+from schemas import DocumentCreate, ImportReport, ImportRowError, ParcelCreate, TransferCreate, UserCreate
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+
+# entity -> (model, create schema, id prefix for rows without an "id")
+ENTITIES: Dict[str, Tuple[type, type, str]] = {
+    "users": (User, UserCreate, "user"),
+    "parcels": (Parcel, ParcelCreate, "PLT"),
+    "transfers": (Transfer, TransferCreate, "TXN"),
+    "documents": (Document, DocumentCreate, "doc"),
+}
+
+
+def iter_records(stream: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yield one dict per input row without reading the whole stream (or a
+    ValueError for an NDJSON line that does not parse)"""
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            # Empty CSV cells mean "not provided", so schema defaults apply
+            yield {key: value for key, value in row.items() if key is not None and value != ""}
+    elif fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as exc:
+                    # Reported against its row number instead of aborting the stream
+                    yield ValueError(f"invalid JSON: {exc}")
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _column_defaults(table, now: datetime) -> Dict[str, Any]:
+    """Python values for column defaults, so executemany and COPY rows are identical.
+
+    `now` replaces func.now(); it is read from the database, whose clock the
+    analytics high-water mark and the stats month boundary also use.
+    """
+    defaults = {}
+    for column in table.columns:
+        if column.default is None:
+            continue
+        if column.default.is_scalar:
+            defaults[column.name] = column.default.arg
+        elif column.default.is_clause_element:  # func.now()
+            defaults[column.name] = now
+    return defaults
+
+
+def _validate_chunk(
+    entity: str, records: List[Tuple[int, Dict[str, Any]]], report: ImportReport, conn: Connection
+) -> List[Tuple[int, Dict[str, Any]]]:
+    model, schema, prefix = ENTITIES[entity]
+    now = conn.scalar(select(func.now())).replace(tzinfo=None)
+    defaults = _column_defaults(model.__table__, now)
+    valid = []
+    for row_number, record in records:
+        if isinstance(record, ValueError):
+            _record_error(report, row_number, str(record))
+            continue
+        try:
+            values = schema.model_validate(record).model_dump()
+        except ValidationError as exc:
+            _record_error(report, row_number, "; ".join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in exc.errors()
+            ))
+            continue
+        values["id"] = record.get("id") or f"{prefix}-{uuid.uuid4().hex[:16]}"
+        if entity == "transfers":
+            values["from_user_id"] = record.get("from_user_id")
+        if entity == "documents":
+            values["file_path"] = record.get("file_path")
+        valid.append((row_number, {**defaults, **values}))
+
+    if entity == "transfers":
+        # TransferCreate has no sender; default it to the parcel's owner, one query per chunk
+        missing = {v["parcel_id"] for _, v in valid if not v["from_user_id"]}
+        owners = dict(conn.execute(select(Parcel.id, Parcel.owner_id).where(Parcel.id.in_(missing))).all()) if missing else {}
+        for row_number, values in list(valid):
+            if not values["from_user_id"]:
+                values["from_user_id"] = owners.get(values["parcel_id"])
+                if values["from_user_id"] is None:
+                    _record_error(report, row_number, f"parcel_id: unknown parcel {values['parcel_id']}")
+                    valid.remove((row_number, values))
+    return valid
+
+
+def _record_error(report: ImportReport, row_number: int, message: str) -> None:
+    report.failed += 1
+    if len(report.errors) < MAX_REPORTED_ERRORS:
+        report.errors.append(ImportRowError(row=row_number, error=message))
+
+
+def copy_rows(conn: Connection, table, rows: List[Dict[str, Any]]) -> None:
+    """PostgreSQL COPY FROM STDIN through the psycopg 3 driver connection"""
+    columns = list(rows[0].keys())
+    processors = [table.c[name].type.bind_processor(conn.dialect) for name in columns]
+    cursor = conn.connection.driver_connection.cursor()
+    with cursor.copy(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row([
+                process(row[name]) if process and row[name] is not None else row[name]
+                for name, process in zip(columns, processors)
+            ])
+
+
+def _write_chunk(
+    conn: Connection, entity: str, rows: List[Tuple[int, Dict[str, Any]]], report: ImportReport, use_copy: bool
+) -> List[Dict[str, Any]]:
+    """Insert a validated chunk in one batch; on a constraint error, retry row by
+    row so only the offending rows are rejected. Returns the inserted rows."""
+    table = ENTITIES[entity][0].__table__
+    if not rows:
+        return []
+    try:
+        with conn.begin_nested():
+            if use_copy:
+                copy_rows(conn, table, [values for _, values in rows])
+            else:
+                conn.execute(insert(table), [values for _, values in rows])
+        return [values for _, values in rows]
+    except DBAPIError:
+        pass
+
+    inserted = []
+    for row_number, values in rows:
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(table), [values])
+            inserted.append(values)
+        except DBAPIError as exc:
+            _record_error(report, row_number, str(exc.orig).splitlines()[0])
+    return inserted
+
+
+def read_checkpoint(conn: Connection, name: str, entity: str) -> Optional[int]:
+    """Rows already committed by the import named `name`, or None for a new one"""
+    stored = conn.execute(
+        select(ImportCheckpoint.entity, ImportCheckpoint.rows_done).where(ImportCheckpoint.name == name)
+    ).first()
+    if stored is None:
+        return None
+    if stored.entity != entity:
+        raise ValueError(f"Checkpoint {name} belongs to an import of {stored.entity}, not {entity}")
+    return stored.rows_done
+
+
+def write_checkpoint(conn: Connection, name: str, entity: str, rows_done: int) -> None:
+    if conn.execute(
+        update(ImportCheckpoint).where(ImportCheckpoint.name == name).values(rows_done=rows_done)
+    ).rowcount == 0:
+        conn.execute(insert(ImportCheckpoint).values(name=name, entity=entity, rows_done=rows_done))
+
+
+def import_records(
+    engine: Engine,
+    entity: str,
+    records: Iterable[Dict[str, Any]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    checkpoint: Optional[str] = None,
+    use_copy: bool = False,
+    start_row: int = 0,
+    on_chunk: Optional[Callable[[str, List[Dict[str, Any]]], None]] = None,
+) -> ImportReport:
+    """Import `records` chunk by chunk, committing each chunk with its checkpoint.
+
+    `checkpoint` names a row of import_checkpoints, updated in the same
+    transaction as each chunk's inserts, so a crash never leaves a committed
+    chunk unrecorded. Rows it covers (or the first `start_row` rows of a new
+    checkpoint or none) are skipped, so a failed import can be resumed by
+    rerunning the same command. `on_chunk` is called with the rows
+    of every committed chunk (used to refresh in-process indexes).
+    """
+    if entity not in ENTITIES:
+        raise ValueError(f"Unknown entity: {entity}")
+    use_copy = use_copy and engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg"
+
+    done = start_row
+    if checkpoint:
+        ImportCheckpoint.__table__.create(engine, checkfirst=True)
+        with engine.connect() as conn:
+            stored = read_checkpoint(conn, checkpoint, entity)
+        if stored is not None:
+            done = stored
+    report = ImportReport(entity=entity, resumed_from=done)
+    numbered = islice(enumerate(records, start=1), done, None)
+    while True:
+        chunk = list(islice(numbered, chunk_size))
+        if not chunk:
+            break
+        with engine.begin() as conn:
+            # First, so the transaction is open before _write_chunk's savepoints: pysqlite
+            # only begins one at the first DML, and a SAVEPOINT outside it commits on release
+            if checkpoint:
+                write_checkpoint(conn, checkpoint, entity, chunk[-1][0])
+            valid = _validate_chunk(entity, chunk, report, conn)
+            inserted = _write_chunk(conn, entity, valid, report, use_copy)
+        report.rows_read += len(chunk)
+        report.inserted += len(inserted)
+        done = chunk[-1][0]
+        if on_chunk and inserted:
+            on_chunk(entity, inserted)
+    report.last_row = done
+    report.errors.sort(key=lambda error: error.row)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import registry data from CSV or NDJSON")
+    parser.add_argument("entity", choices=sorted(ENTITIES))
+    parser.add_argument("path", help="Input file, or - for stdin")
+    parser.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--checkpoint", help="Name under which committed rows are recorded in the database, for resuming")
+    parser.add_argument("--copy", action="store_true", help="Use PostgreSQL COPY instead of executemany")
+    args = parser.parse_args()
+
+    from database import SessionLocal, engine
+    from stats import reconcile_stats
+
+    fmt = args.format or ("ndjson" if args.path.endswith((".ndjson", ".jsonl")) else "csv")
+    stream = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    with stream:
+        report = import_records(
+            engine, args.entity, iter_records(stream, fmt), args.chunk_size, args.checkpoint, args.copy
+        )
+    # Inserts bypass the incremental dashboard counters
+    with SessionLocal() as db:
+        reconcile_stats(db)
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import case, event, func, select
+from sqlalchemy.orm import Session
+
+from models import AIAnalysis, Document, Encumbrance, Parcel, Transaction, Transfer, User, Valuation
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+# Representations (include=/fields=/page combinations) kept per cached resource
+RESPONSE_CACHE_VARIANTS = 8
+
+
+class TTLCache:
+    """Single-value cache that is recomputed at most once per `ttl` seconds"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._expires = 0.0
+
+    def get(self, loader: Callable[[], Any]) -> Any:
+        now = time.monotonic()
+        if self._value is not None and now < self._expires:
+            return self._value
+        with self._lock:
+            if self._value is None or time.monotonic() >= self._expires:
+                self._value = loader()
+                self._expires = time.monotonic() + self.ttl
+            return self._value
+
+    def clear(self) -> None:
+        self._expires = 0.0
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU map with hit/miss/eviction counters"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, current: Optional[Callable[[Any], bool]] = None) -> Optional[Any]:
+        """The value under `key`, counted as one hit or miss.
+
+        With `current`, a value it rejects (e.g. a stale version) is still
+        returned but counts as a miss.
+        """
+        with self._lock:
+            value = self._data.get(key)
+            if value is None or (current is not None and not current(value)):
+                self.misses += 1
+                return value
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: Hashable) -> Optional[Any]:
+        """The value under `key`, without counting a lookup or refreshing its recency"""
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Serialized detail bodies keyed by ("parcel" | "transfer" | "user", id) -> {variant: (version, etag, body)}
+response_cache = LRUCache(RESPONSE_CACHE_SIZE)
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison, so W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def cached_bodies(
+    kind: str,
+    versions: Dict[str, Tuple],
+    render: Callable[[List[str]], Dict[str, bytes]],
+    variant: Hashable = None,
+) -> Dict[str, Tuple[str, bytes]]:
+    """Current (etag, body) for each resource in `versions`.
+
+    The version vector decides whether a cached body is still current, so a
+    hit costs no ORM loading or serialization; the misses are rendered
+    together by one `render(ids)` call. The ETag is a hash of the body
+    itself, so it changes exactly when the representation does. `variant`
+    distinguishes representations of the same resource; they share one cache
+    entry so invalidating the resource drops all of them.
+    """
+    found: Dict[str, Tuple[str, bytes]] = {}
+    missing = []
+    for resource_id, version in versions.items():
+        # One hit or miss per lookup of this variant, whatever else the entry holds
+        cached = (response_cache.get(
+            (kind, resource_id), lambda variants: variants.get(variant, (None,))[0] == version
+        ) or {}).get(variant)
+        if cached is not None and cached[0] == version:
+            found[resource_id] = cached[1:]
+        else:
+            missing.append(resource_id)
+
+    rendered = render(missing) if missing else {}
+    for resource_id, body in rendered.items():
+        version = versions[resource_id]
+        etag = make_etag(body)
+        key = (kind, resource_id)
+        # Copy on write: other threads may be reading the current dict
+        variants = {k: v for k, v in (response_cache.peek(key) or {}).items() if k != variant and v[0] == version}
+        variants[variant] = (version, etag, body)
+        while len(variants) > RESPONSE_CACHE_VARIANTS:
+            del variants[next(iter(variants))]
+        response_cache.set(key, variants)
+        found[resource_id] = (etag, body)
+    return found
+
+
+def conditional_response(request: Request, found: Optional[Tuple[str, bytes]], not_found: str) -> Response:
+    """Serve one (etag, body) from `cached_bodies`, or 304 when If-None-Match matches"""
+    if found is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    etag, body = found
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# Version vectors: one aggregate statement per batch of resources covering
+# every row embedded in their responses. Tables without updated_at contribute
+# counts and aggregates of their mutable columns; writes made through this
+# process also invalidate the cache explicitly (see track_changes).
+
+def parcel_versions(db: Session, parcel_ids: Sequence[str]) -> Dict[str, Tuple]:
+    rows = db.execute(
+        select(
+            Parcel.id,
+            Parcel.updated_at,
+            select(User.updated_at).where(User.id == Parcel.owner_id).scalar_subquery(),
+            select(AIAnalysis.updated_at).where(AIAnalysis.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.count()).where(Document.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.max(Document.created_at)).where(Document.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.sum(case((Document.is_verified.is_(True), 1), else_=0)))
+            .where(Document.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.count()).where(Transaction.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.max(Transaction.transaction_date)).where(Transaction.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.count()).where(Encumbrance.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.max(Encumbrance.resolved_at)).where(Encumbrance.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.sum(case((Encumbrance.is_active.is_(True), 1), else_=0)))
+            .where(Encumbrance.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.sum(Encumbrance.amount)).where(Encumbrance.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.sum(func.length(Encumbrance.description)))
+            .where(Encumbrance.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.count()).where(Valuation.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.max(Valuation.date)).where(Valuation.parcel_id == Parcel.id).scalar_subquery(),
+            select(func.sum(Valuation.value)).where(Valuation.parcel_id == Parcel.id).scalar_subquery(),
+        ).where(Parcel.id.in_(parcel_ids))
+    )
+    return {parcel_id: ("parcel", parcel_id, *row) for parcel_id, *row in rows}
+
+
+def transfer_versions(db: Session, transfer_ids: Sequence[str]) -> Dict[str, Tuple]:
+    rows = db.execute(
+        select(
+            Transfer.id,
+            Transfer.updated_at,
+            select(Parcel.updated_at).where(Parcel.id == Transfer.parcel_id).scalar_subquery(),
+            select(User.updated_at).where(User.id == Transfer.from_user_id).scalar_subquery(),
+            select(User.updated_at).where(User.id == Transfer.to_user_id).scalar_subquery(),
+            select(func.count()).where(Document.transfer_id == Transfer.id).scalar_subquery(),
+            select(func.max(Document.created_at)).where(Document.transfer_id == Transfer.id).scalar_subquery(),
+            select(func.sum(case((Document.is_verified.is_(True), 1), else_=0)))
+            .where(Document.transfer_id == Transfer.id).scalar_subquery(),
+        ).where(Transfer.id.in_(transfer_ids))
+    )
+    return {transfer_id: ("transfer", transfer_id, *row) for transfer_id, *row in rows}
+
+
+def user_versions(db: Session, user_ids: Sequence[str]) -> Dict[str, Tuple]:
+    rows = db.execute(select(User.id, User.updated_at).where(User.id.in_(user_ids)))
+    return {user_id: ("user", user_id, *row) for user_id, *row in rows}
+
+
+def _affected_keys(obj):
+    if isinstance(obj, Parcel):
+        yield ("parcel", obj.id)
+    elif isinstance(obj, Transfer):
+        yield ("transfer", obj.id)
+    elif isinstance(obj, User):
+        yield ("user", obj.id)
+    elif isinstance(obj, Document):
+        if obj.parcel_id:
+            yield ("parcel", obj.parcel_id)
+        if obj.transfer_id:
+            yield ("transfer", obj.transfer_id)
+    elif isinstance(obj, (Transaction, AIAnalysis, Encumbrance, Valuation)):
+        yield ("parcel", obj.parcel_id)
+
+
+def _collect_invalidations(session, flush_context):
+    keys = session.info.setdefault("cache_invalidations", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        keys.update(_affected_keys(obj))
+
+
+def _invalidate_on_commit(session):
+    for key in session.info.pop("cache_invalidations", ()):
+        response_cache.invalidate(key)
+
+
+def _discard(session):
+    session.info.pop("cache_invalidations", None)
+
+
+def track_changes(session_factory) -> None:
+    """Drop cached bodies for resources touched by a committed write"""
+    event.listen(session_factory, "after_flush", _collect_invalidations)
+    event.listen(session_factory, "after_commit", _invalidate_on_commit)
+    event.listen(session_factory, "after_rollback", _discard)
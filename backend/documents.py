@@ -0,0 +1,242 @@
+"""Content-addressed document storage.
+
+    cd backend
+    python documents.py verify      # rehash every stored document file on a process pool
+
+Uploads are written to disk in chunks while SHA-256 is computed over the same
+chunks, so a multi-MB deed scan is never held in memory whole. Each file is
+stored once, under its hash (`sha256/ab/cd/abcd...` below DOCUMENT_STORAGE_DIR),
+and `Document.file_path` holds that relative path. A file whose hash already
+belongs to a document is not stored twice: the upload returns that document.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from typing import AsyncIterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from models import Document
+from schemas import DocumentVerificationReport
+
+# Root of the content-addressed files
+DOCUMENT_STORAGE_DIR = os.getenv(
+    "DOCUMENT_STORAGE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage")
+)
+# Largest accepted upload
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", str(100 * 1024 * 1024)))
+# Processes rehashing files in a verification pass (below 2: in the calling thread)
+DOCUMENT_VERIFY_WORKERS = int(os.getenv("DOCUMENT_VERIFY_WORKERS", str(min(os.cpu_count() or 1, 8))))
+
+# Received chunks are gathered to this size before a threadpool hop writes and hashes them
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Files handed to a worker per task; whole files, so big scans are split by count not bytes
+VERIFY_TASK_SIZE = 32
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class StoredFile(NamedTuple):
+    file_hash: str
+    file_size: int
+    file_path: str
+    # False when the same content was already stored
+    created: bool
+
+
+def content_path(file_hash: str) -> str:
+    """Storage path of a SHA-256 hex digest, relative to the storage root"""
+    return os.path.join("sha256", file_hash[:2], file_hash[2:4], file_hash)
+
+
+def absolute_path(file_path: str, root: Optional[str] = None) -> str:
+    # Paths recorded before this storage existed may already be absolute; join keeps them
+    return os.path.join(root or DOCUMENT_STORAGE_DIR, file_path)
+
+
+class _Writer:
+    """Temporary file in the storage root that hashes what is written to it"""
+
+    def __init__(self, root: str):
+        self.root = root
+        incoming = os.path.join(root, "incoming")
+        os.makedirs(incoming, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=incoming, delete=False)
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> None:
+        self._hash.update(data)
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self) -> StoredFile:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        file_hash = self._hash.hexdigest()
+        file_path = content_path(file_hash)
+        target = absolute_path(file_path, self.root)
+        if os.path.exists(target):
+            os.unlink(self._file.name)
+            return StoredFile(file_hash, self.size, file_path, False)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Atomic on one filesystem; a concurrent upload of the same bytes replaces it with identical content
+        os.replace(self._file.name, target)
+        return StoredFile(file_hash, self.size, file_path, True)
+
+    def discard(self) -> None:
+        self._file.close()
+        try:
+            os.unlink(self._file.name)
+        except FileNotFoundError:
+            pass
+
+
+async def store_stream(
+    chunks: AsyncIterator[bytes], max_bytes: int = DOCUMENT_MAX_BYTES, root: Optional[str] = None
+) -> StoredFile:
+    """Write a streamed body to content-addressed storage, hashing it on the way.
+
+    Raises UploadTooLarge as soon as the body passes `max_bytes`; nothing is
+    kept of an upload that fails or is cancelled.
+    """
+    writer = await run_in_threadpool(_Writer, root or DOCUMENT_STORAGE_DIR)
+    buffer = bytearray()
+    try:
+        async for chunk in chunks:
+            if writer.size + len(buffer) + len(chunk) > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            buffer += chunk
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                data, buffer = buffer, bytearray()
+                await run_in_threadpool(writer.write, data)
+        if buffer:
+            await run_in_threadpool(writer.write, buffer)
+        return await run_in_threadpool(writer.commit)
+    except BaseException:
+        writer.discard()
+        raise
+
+
+def remove_file(stored: StoredFile, root: Optional[str] = None) -> None:
+    """Delete a file stored by `store_stream` that ended up with no document"""
+    if stored.created:
+        try:
+            os.unlink(absolute_path(stored.file_path, root))
+        except FileNotFoundError:
+            pass
+
+
+def _check_files(items: Sequence[Tuple[str, str, Optional[str]]], root: str) -> List[Tuple[str, str]]:
+    """(id, "intact" | "mismatched" | "missing") for (id, file_path, file_hash) items"""
+    results = []
+    for doc_id, file_path, file_hash in items:
+        try:
+            with open(absolute_path(file_path, root), "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+        except FileNotFoundError:
+            results.append((doc_id, "missing"))
+            continue
+        results.append((doc_id, "intact" if digest == file_hash else "mismatched"))
+    return results
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _executor(workers: int) -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if workers < 2:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded server process is unsafe
+            _pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def verify_documents(
+    engine: Engine,
+    ids: Optional[List[str]] = None,
+    workers: int = DOCUMENT_VERIFY_WORKERS,
+    root: Optional[str] = None,
+) -> DocumentVerificationReport:
+    """Rehash the stored files of the given documents (default: all) and compare with `file_hash`.
+
+    Files are read and hashed on a process pool, a few tasks per worker in
+    flight, so a pass over every document neither blocks the server's threads
+    on hashing nor loads more than one batch of paths at a time.
+    """
+    started = time.perf_counter()
+    root = root or DOCUMENT_STORAGE_DIR
+    report = DocumentVerificationReport()
+    query = select(Document.id, Document.file_path, Document.file_hash).order_by(Document.id)
+    if ids is not None:
+        query = query.where(Document.id.in_(ids))
+    found: Set[str] = set()
+    pool = _executor(workers)
+    pending: Set[Future] = set()
+
+    def collect(results: List[Tuple[str, str]]) -> None:
+        for doc_id, status in results:
+            if status == "intact":
+                report.intact += 1
+            else:
+                getattr(report, status).append(doc_id)
+
+    with engine.connect() as conn:
+        rows = conn.execute(query.execution_options(yield_per=VERIFY_TASK_SIZE * 64))
+        for part in rows.partitions():
+            for start in range(0, len(part), VERIFY_TASK_SIZE):
+                task = []
+                for doc_id, file_path, file_hash in part[start:start + VERIFY_TASK_SIZE]:
+                    found.add(doc_id)
+                    if file_path is None:
+                        report.unstored += 1
+                    else:
+                        task.append((doc_id, file_path, file_hash))
+                report.checked += len(task)
+                if pool is None:
+                    collect(_check_files(task, root))
+                    continue
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future.result())
+                pending.add(pool.submit(_check_files, task, root))
+    for future in pending:
+        collect(future.result())
+
+    report.not_found = [doc_id for doc_id in ids or () if doc_id not in found]
+    report.mismatched.sort()
+    report.missing.sort()
+    report.seconds = round(time.perf_counter() - started, 3)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Document storage maintenance")
+    parser.add_argument("command", choices=("verify",))
+    parser.add_argument("--workers", type=int, default=DOCUMENT_VERIFY_WORKERS)
+    args = parser.parse_args()
+
+    from database import engine
+
+    report = verify_documents(engine, workers=args.workers)
+    print(json.dumps(report.model_dump(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
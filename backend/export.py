@@ -0,0 +1,121 @@
+"""Streaming NDJSON/CSV export of registry tables.
+
+    cd backend
+    python export.py parcels --format csv --gzip -o parcels.csv.gz
+
+Rows are read with a server-side cursor in batches of `batch_size` and
+encoded batch by batch, so memory stays flat regardless of table size.
+"""
+import argparse
+import csv
+import enum
+import io
+import json
+import sys
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from models import Document, Encumbrance, Parcel, Transaction, Transfer
+
+DEFAULT_BATCH_SIZE = 5000
+
+ENTITIES: Dict[str, type] = {
+    "parcels": Parcel,
+    "transfers": Transfer,
+    "transactions": Transaction,
+    "documents": Document,
+    "encumbrances": Encumbrance,
+}
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _csv_cell(value: Any) -> Any:
+    value = _plain(value)
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+def iter_batches(engine: Engine, entity: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[tuple]]:
+    """Row tuples in primary-key order, one server-side cursor batch at a time"""
+    table = ENTITIES[entity].__table__
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+            select(table).order_by(*table.primary_key.columns)
+        )
+        for batch in result.partitions():
+            yield batch
+
+
+def encode(engine: Engine, entity: str, fmt: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[bytes]:
+    """Encoded export, one chunk per batch (the CSV header is its own chunk)"""
+    columns = [column.name for column in ENTITIES[entity].__table__.columns]
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for batch in iter_batches(engine, entity, batch_size):
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows([_csv_cell(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode()
+    elif fmt == "ndjson":
+        for batch in iter_batches(engine, entity, batch_size):
+            yield "".join(
+                json.dumps({name: _plain(value) for name, value in zip(columns, row)}) + "\n" for row in batch
+            ).encode()
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def gzipped(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """Compress a byte stream on the fly into a single gzip member"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(engine: Engine, entity: str, fmt: str, gzip: bool = False, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[bytes]:
+    if entity not in ENTITIES:
+        raise ValueError(f"Unknown entity: {entity}")
+    chunks = encode(engine, entity, fmt, batch_size)
+    return gzipped(chunks) if gzip else chunks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stream a registry table as NDJSON or CSV")
+    parser.add_argument("entity", choices=sorted(ENTITIES))
+    parser.add_argument("--format", choices=sorted(MEDIA_TYPES), default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    from database import engine
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    with out:
+        for chunk in export(engine, args.entity, args.format, args.gzip, args.batch_size):
+            out.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
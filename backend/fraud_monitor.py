@@ -0,0 +1,315 @@
+"""Incremental fraud detection on transfer writes.
+
+Scores a parcel the moment one of its transfers is created or changes
+status, with the same features and weights as the batch scorer
+(fraud_scoring), from sliding-window state kept in memory:
+
+- per parcel, its live (not rejected or cancelled) transfers in the window
+- per user, their sales in the window plus lifetime transfer and failure counts
+
+The score runs in before_flush, so the AIAnalysis update and any FraudAlert
+commit in the same transaction as the transfer that caused them; only the
+parcels touched by the flush are read or written. The in-memory state only
+advances after commit and is rebuilt from the transfers table on startup.
+"""
+import bisect
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+import fraud_scoring
+from database import env_flag
+from fraud_scoring import ALERT_FROM, FAILED, FLIP_DAYS, FRAUD_WINDOW_DAYS, LEVEL_THRESHOLDS, LEVELS, SELLER_BURST
+from models import AIAnalysis, Encumbrance, FraudAlert, Parcel, Transfer
+
+# Score parcels as their transfers are written
+FRAUD_MONITOR = env_flag("FRAUD_MONITOR", True)
+# Drop transfers that have left the window after this many applied events
+SWEEP_EVERY = 10000
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _seconds(moment: Optional[datetime]) -> float:
+    """Naive UTC timestamp as seconds since 1970, like fraud_scoring.epoch_seconds"""
+    return ((moment or datetime.utcnow()) - EPOCH).total_seconds()
+
+
+class Sale(NamedTuple):
+    seconds: float
+    transfer_id: str
+    parcel_id: str
+    from_user_id: str
+    to_user_id: str
+    amount: float
+
+
+# ("new", sale, failed) or ("status", sale, was_failed, failed)
+Event = Tuple
+
+
+class _State:
+    """Sliding-window transfer state; the monitor keeps the committed copy and
+    scores against a partial copy with the transaction's pending events applied"""
+
+    def __init__(self):
+        self.parcels: Dict[str, List[Sale]] = {}  # sorted by time
+        self.sales: Dict[str, List[Tuple[float, str]]] = {}  # seller -> sorted (seconds, transfer id)
+        self.history: Dict[str, List[int]] = {}  # user -> [transfers, rejected or cancelled]
+        self.live: Dict[str, Sale] = {}
+
+    def subset(self, parcel_ids: Iterable[str], user_ids: Iterable[str]) -> "_State":
+        copy = _State()
+        for parcel_id in parcel_ids:
+            copy.parcels[parcel_id] = list(self.parcels.get(parcel_id, ()))
+            for sale in copy.parcels[parcel_id]:
+                copy.live[sale.transfer_id] = sale
+        for user_id in user_ids:
+            copy.sales[user_id] = list(self.sales.get(user_id, ()))
+            copy.history[user_id] = list(self.history.get(user_id, (0, 0)))
+        return copy
+
+    def users(self, parcel_id: str) -> Set[str]:
+        return {user for sale in self.parcels.get(parcel_id, ()) for user in (sale.from_user_id, sale.to_user_id)}
+
+    def _count(self, user_id: str, transfers: int, failed: int) -> None:
+        counts = self.history.setdefault(user_id, [0, 0])
+        counts[0] += transfers
+        counts[1] += failed
+
+    def _add(self, sale: Sale) -> None:
+        if sale.transfer_id in self.live:
+            return
+        self.live[sale.transfer_id] = sale
+        bisect.insort(self.parcels.setdefault(sale.parcel_id, []), sale)
+        bisect.insort(self.sales.setdefault(sale.from_user_id, []), (sale.seconds, sale.transfer_id))
+
+    def _remove(self, sale: Sale) -> None:
+        sale = self.live.pop(sale.transfer_id, None)
+        if sale is None:
+            return
+        for items, item in (
+            (self.parcels.get(sale.parcel_id), sale),
+            (self.sales.get(sale.from_user_id), (sale.seconds, sale.transfer_id)),
+        ):
+            if items and item in items:
+                items.remove(item)
+
+    def apply(self, event: Event) -> None:
+        if event[0] == "new":
+            _, sale, failed = event
+            for user_id in (sale.from_user_id, sale.to_user_id):
+                self._count(user_id, 1, int(failed))
+            if not failed:
+                self._add(sale)
+        else:
+            _, sale, was_failed, failed = event
+            if was_failed != failed:
+                for user_id in (sale.from_user_id, sale.to_user_id):
+                    self._count(user_id, 0, 1 if failed else -1)
+            if failed:
+                self._remove(sale)
+            else:
+                self._add(sale)
+
+    def sweep(self, cutoff: float) -> None:
+        """Forget live transfers older than `cutoff`"""
+        for index in (self.parcels, self.sales):
+            for key in list(index):
+                items = index[key]
+                del items[:bisect.bisect_left(items, (cutoff,))]
+                if not items:
+                    del index[key]
+        self.live = {tid: sale for tid, sale in self.live.items() if sale.seconds >= cutoff}
+
+    def features(self, parcel_id: str, market: float, encumbered: float, now: float, window: float) -> Dict[str, np.ndarray]:
+        """fraud_scoring.compute_features for one parcel, as length-1 columns"""
+        sales = [sale for sale in self.parcels.get(parcel_id, ()) if now - window <= sale.seconds <= now]
+        value = market if market and market > 0 else None
+        ratios = [sale.amount / value if value else 1.0 for sale in sales]
+        gaps = [(b.seconds - a.seconds) / 86400 for a, b in zip(sales, sales[1:])]
+
+        def failure_rate(user_id: str) -> float:
+            total, failed = self.history.get(user_id, (0, 0))
+            return failed / (total + 2)
+
+        def sales_in_window(user_id: str) -> int:
+            items = self.sales.get(user_id, ())
+            return bisect.bisect_right(items, (now, "\uffff")) - bisect.bisect_left(items, (now - window,))
+
+        sellers = {}
+        for sale in sales:
+            sellers.setdefault(sale.from_user_id, sale.seconds)
+        values = {
+            "underpricing": max((min(max(1 - r, 0), 1) for r in ratios), default=0.0),
+            "overpricing": max((min(max(r - 1, 0), 2) for r in ratios), default=0.0),
+            "velocity": float(min(max(len(sales) - 1, 0), 5)),
+            "flip": min(max(1 - min(gaps) / FLIP_DAYS, 0), 1) if gaps else 0.0,
+            "exposure": min(encumbered / value, 2) if value else 0.0,
+            "party_history": max(
+                (max(failure_rate(sale.from_user_id), failure_rate(sale.to_user_id)) for sale in sales), default=0.0
+            ),
+            "self_dealing": float(any(sale.from_user_id == sale.to_user_id for sale in sales)),
+            "round_trip": float(any(sellers.get(sale.to_user_id, sale.seconds) < sale.seconds for sale in sales)),
+            "seller_velocity": max(
+                (min(max((sales_in_window(sale.from_user_id) - 1) / SELLER_BURST, 0), 1) for sale in sales),
+                default=0.0,
+            ),
+        }
+        return {name: np.array([value]) for name, value in values.items()}
+
+
+class FraudMonitor:
+    def __init__(self, window_days: int = FRAUD_WINDOW_DAYS):
+        self.window_days = window_days
+        self._lock = threading.Lock()
+        self._state = _State()
+        self._latest = 0.0
+        self._applied = 0
+        self.alerts_raised = 0
+
+    def rebuild(self, db: Session, as_of: Optional[datetime] = None, batch_size: int = 10000) -> None:
+        """Reload the state from the transfers table"""
+        as_of = as_of or datetime.utcnow()
+        moment = func.coalesce(Transfer.transfer_date, Transfer.created_at)
+        state = _State()
+        for user_column in (Transfer.from_user_id, Transfer.to_user_id):
+            rows = db.execute(
+                select(user_column, func.count(), func.count().filter(Transfer.status.in_(FAILED))).group_by(user_column)
+            )
+            for user_id, transfers, failed in rows:
+                state._count(user_id, transfers, failed)
+        rows = db.execute(
+            select(
+                Transfer.id, Transfer.parcel_id, Transfer.from_user_id, Transfer.to_user_id, Transfer.amount, moment,
+            )
+            .where(moment >= as_of - timedelta(days=self.window_days), Transfer.status.not_in(FAILED))
+            .execution_options(yield_per=batch_size)
+        )
+        for transfer_id, parcel_id, from_user_id, to_user_id, amount, moment_value in rows:
+            state._add(Sale(_seconds(moment_value), transfer_id, parcel_id, from_user_id, to_user_id, amount))
+        with self._lock:
+            self._state = state
+            self._latest = _seconds(as_of)
+
+    def record(self, events: List[Event]) -> None:
+        """Advance the committed state by the events of a committed transaction"""
+        if not events:
+            return
+        with self._lock:
+            for event_ in events:
+                self._state.apply(event_)
+                self._latest = max(self._latest, event_[1].seconds)
+            self._applied += len(events)
+            if self._applied >= SWEEP_EVERY:
+                self._applied = 0
+                self._state.sweep(self._latest - self.window_days * 86400)
+
+    def record_imported(self, rows: List[dict]) -> None:
+        """Transfers written by a bulk import, which bypasses session events.
+        They only update the state; the batch scorer covers their parcels."""
+        self.record([
+            ("new", _sale_of(row), row.get("status") in FAILED) for row in rows
+        ])
+
+    def score(self, db: Session, events: List[Event], parcel_ids: Set[str]) -> None:
+        """Update AIAnalysis and raise alerts for `parcel_ids`, with the
+        transaction's pending `events` applied on top of the committed state"""
+        users = {user for event_ in events for user in (event_[1].from_user_id, event_[1].to_user_id)}
+        with self._lock:
+            for parcel_id in parcel_ids:
+                users |= self._state.users(parcel_id)
+            state = self._state.subset(parcel_ids | {event_[1].parcel_id for event_ in events}, users)
+        for event_ in events:
+            state.apply(event_)
+
+        analyses = {
+            analysis.parcel_id: analysis
+            for analysis in db.scalars(select(AIAnalysis).where(AIAnalysis.parcel_id.in_(parcel_ids)))
+        }
+        context = db.execute(
+            select(
+                Parcel.id,
+                select(func.coalesce(func.sum(Encumbrance.amount), 0.0))
+                .where(Encumbrance.parcel_id == Parcel.id, Encumbrance.is_active.is_(True)).scalar_subquery(),
+                select(func.max(fraud_scoring.level_code(FraudAlert.risk_level)))
+                .where(FraudAlert.parcel_id == Parcel.id, FraudAlert.is_resolved.is_(False)).scalar_subquery(),
+            ).where(Parcel.id.in_(parcel_ids))
+        )
+        window = self.window_days * 86400
+        for parcel_id, encumbered, open_level in context:
+            analysis = analyses.get(parcel_id)
+            # Parcels the batch scorer has not valued yet are scored without the price features
+            market = analysis.market_value if analysis is not None else None
+            now = max([self._latest] + [e[1].seconds for e in events if e[1].parcel_id == parcel_id])
+            features = state.features(parcel_id, market, encumbered or 0.0, now, window)
+            risk_score = float(fraud_scoring.score(features)[0])
+            level = int(np.searchsorted(LEVEL_THRESHOLDS, risk_score, side="right"))
+            if analysis is not None and (analysis.risk_score != risk_score or analysis.fraud_risk != LEVELS[level]):
+                analysis.risk_score = risk_score
+                analysis.fraud_risk = LEVELS[level]
+            if level >= ALERT_FROM and level > (open_level if open_level is not None else -1):
+                db.add(FraudAlert(
+                    id=f"alert-{uuid.uuid4().hex[:16]}", parcel_id=parcel_id, risk_level=LEVELS[level],
+                    reason=fraud_scoring.describe(features, 0, self.window_days), is_resolved=False,
+                ))
+                self.alerts_raised += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "parcels": len(self._state.parcels),
+                "live_transfers": len(self._state.live),
+                "users": len(self._state.history),
+                "alerts_raised": self.alerts_raised,
+            }
+
+
+transfer_monitor = FraudMonitor()
+
+
+def _sale_of(values) -> Sale:
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name)
+    return Sale(
+        _seconds(get("transfer_date") or get("created_at")), get("id"), get("parcel_id"),
+        get("from_user_id"), get("to_user_id"), get("amount"),
+    )
+
+
+def _score_changes(session, flush_context, instances):
+    events = []
+    for obj in session.new:
+        if isinstance(obj, Transfer):
+            events.append(("new", _sale_of(obj), obj.status in FAILED))
+    for obj in session.dirty:
+        if isinstance(obj, Transfer):
+            history = inspect(obj).attrs.status.history
+            if history.added and history.added[0] not in history.deleted:
+                # An unloaded previous status is unknown; assume it was live
+                was_failed = bool(history.deleted) and history.deleted[0] in FAILED
+                events.append(("status", _sale_of(obj), was_failed, history.added[0] in FAILED))
+    if not events:
+        return
+    pending = session.info.setdefault("fraud_events", [])
+    pending.extend(events)
+    transfer_monitor.score(session, pending, {event_[1].parcel_id for event_ in events})
+
+
+def _apply_changes(session):
+    transfer_monitor.record(session.info.pop("fraud_events", []))
+
+
+def _discard_changes(session):
+    session.info.pop("fraud_events", None)
+
+
+def track_changes(session_factory) -> None:
+    """Score parcels as their transfers are written and keep `transfer_monitor` in sync with commits"""
+    event.listen(session_factory, "before_flush", _score_changes)
+    event.listen(session_factory, "after_commit", _apply_changes)
+    event.listen(session_factory, "after_rollback", _discard_changes)
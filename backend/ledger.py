@@ -0,0 +1,501 @@
+"""Append-only Merkle ledger over transactions and transfers.
+
+    cd backend
+    python ledger.py append      # add every record not in the ledger yet
+    python ledger.py verify      # rehash every ledgered record and list those that changed
+
+Every Transaction and Transfer becomes a leaf of an RFC 6962 Merkle tree
+(the Certificate Transparency construction): the leaf is the SHA-256 of a
+canonical JSON form of the record's immutable fields, and `ledger_entries`
+keeps each leaf hash with its position. The tree is held in memory as one
+flat byte array of hashes per level, so appending a leaf touches at most one
+node per level and the root, inclusion proofs and consistency proofs cost
+O(log n) hashes. Large batches hash on a process pool.
+
+An auditor who holds a root can check any record's inclusion with
+`verify_inclusion`, and that a later root extends it with
+`verify_consistency`, without rehashing the rest of the ledger.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import and_, event, insert, select
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+from models import LedgerEntry, LedgerHead, Transaction, Transfer
+from schemas import ConsistencyProof, InclusionProof
+
+logger = logging.getLogger(__name__)
+
+# Seconds between appends of newly committed records (they are also appended as soon as they commit)
+LEDGER_APPEND_INTERVAL = float(os.getenv("LEDGER_APPEND_INTERVAL", "5"))
+# Worker processes hashing large batches (below 2: hash in the calling thread)
+LEDGER_WORKERS = int(os.getenv("LEDGER_WORKERS", str(min(os.cpu_count() or 1, 8))))
+# Batches smaller than this hash inline; a process round trip costs more than it saves
+PARALLEL_MIN_HASHES = 50000
+APPEND_BATCH_SIZE = 50000
+
+HASH_SIZE = 32
+EMPTY_ROOT = hashlib.sha256(b"").digest()
+
+# Immutable fields that make up each kind of leaf; later edits to them break the record's proof
+LEAF_FIELDS = {
+    "transaction": (Transaction, ("id", "parcel_id", "type", "from_entity", "to_entity", "blockchain_hash", "transaction_date")),
+    "transfer": (Transfer, ("id", "parcel_id", "from_user_id", "to_user_id", "amount", "blockchain_hash", "created_at")),
+}
+
+
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+
+
+def leaf_data(kind: str, values: Dict) -> bytes:
+    """Canonical bytes of a record: sorted-key compact JSON of its leaf fields plus its kind"""
+    data = {name: value.isoformat() if isinstance(value, datetime) else value for name, value in values.items()}
+    data["kind"] = kind
+    return _encoder.encode(data).encode()
+
+
+def _hash_leaves(records: Sequence[Tuple[str, Dict]]) -> bytes:
+    return b"".join(hashlib.sha256(b"\x00" + leaf_data(kind, values)).digest() for kind, values in records)
+
+
+def _hash_pairs(children: bytes) -> bytes:
+    return b"".join(
+        hashlib.sha256(b"\x01" + children[i:i + 2 * HASH_SIZE]).digest() for i in range(0, len(children), 2 * HASH_SIZE)
+    )
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if LEDGER_WORKERS < 2:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a threaded server process is unsafe
+            _pool = ProcessPoolExecutor(LEDGER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _chunked(items, count: int, unit: int = 1) -> List:
+    """`items` split into about LEDGER_WORKERS slices of whole `unit`s"""
+    per = -(-count // LEDGER_WORKERS) * unit
+    return [items[i:i + per] for i in range(0, len(items), per)]
+
+
+def hash_leaves(records: Sequence[Tuple[str, Dict]]) -> bytes:
+    """Concatenated leaf hashes of (kind, leaf field values) records"""
+    pool = _executor() if len(records) >= PARALLEL_MIN_HASHES else None
+    if pool is None:
+        return _hash_leaves(records)
+    return b"".join(pool.map(_hash_leaves, _chunked(list(records), len(records))))
+
+
+def hash_pairs(children: bytes) -> bytes:
+    """Parent hashes of consecutive pairs in a level's concatenated hashes"""
+    count = len(children) // (2 * HASH_SIZE)
+    pool = _executor() if count >= PARALLEL_MIN_HASHES else None
+    if pool is None:
+        return _hash_pairs(children)
+    return b"".join(pool.map(_hash_pairs, _chunked(children, count, 2 * HASH_SIZE)))
+
+
+def _split(size: int) -> int:
+    """Largest power of two below `size` (RFC 6962's k)"""
+    return 1 << ((size - 1).bit_length() - 1)
+
+
+class MerkleTree:
+    """RFC 6962 Merkle tree over leaf hashes.
+
+    Level l holds the hashes of the complete, aligned subtrees of 2**l leaves,
+    so any subtree the proof algorithms ask for is either one stored node or
+    a fold of at most log2(n) of them along the right edge.
+    """
+
+    def __init__(self):
+        self._levels: List[bytearray] = [bytearray()]
+
+    def __len__(self) -> int:
+        return len(self._levels[0]) // HASH_SIZE
+
+    def leaf(self, index: int) -> bytes:
+        return self._node(0, index)
+
+    def _node(self, level: int, index: int) -> bytes:
+        return bytes(self._levels[level][index * HASH_SIZE:(index + 1) * HASH_SIZE])
+
+    def extend(self, leaf_hashes: bytes) -> None:
+        """Append concatenated leaf hashes, hashing only the new nodes of each level"""
+        self._levels[0] += leaf_hashes
+        level = 0
+        while len(self._levels[level]) >= 2 * HASH_SIZE:
+            if len(self._levels) == level + 1:
+                self._levels.append(bytearray())
+            children, parents = self._levels[level], self._levels[level + 1]
+            done = len(parents) // HASH_SIZE
+            complete = len(children) // (2 * HASH_SIZE)
+            parents += hash_pairs(bytes(children[done * 2 * HASH_SIZE:complete * 2 * HASH_SIZE]))
+            level += 1
+
+    def truncate(self, size: int) -> None:
+        for level, nodes in enumerate(self._levels):
+            del nodes[(size >> level) * HASH_SIZE:]
+
+    def subtree(self, start: int, end: int) -> bytes:
+        """MTH(D[start:end]) for `start` aligned to the largest power of two not above the size"""
+        size = end - start
+        if size & (size - 1) == 0:
+            level = size.bit_length() - 1
+            return self._node(level, start >> level)
+        k = _split(size)
+        return node_hash(self.subtree(start, start + k), self.subtree(start + k, end))
+
+    def root(self, size: Optional[int] = None) -> bytes:
+        size = len(self) if size is None else size
+        return self.subtree(0, size) if size else EMPTY_ROOT
+
+    def inclusion_proof(self, index: int, size: int) -> List[bytes]:
+        """RFC 6962 PATH(index, D[0:size]): sibling hashes from the leaf up"""
+        path: List[bytes] = []
+        start, end = 0, size
+        while end - start > 1:
+            k = _split(end - start)
+            if index - start < k:
+                path.append(self.subtree(start + k, end))
+                end = start + k
+            else:
+                path.append(self.subtree(start, start + k))
+                start += k
+        return path[::-1]
+
+    def consistency_proof(self, first: int, second: int) -> List[bytes]:
+        """RFC 6962 PROOF(first, D[0:second])"""
+        proof: List[bytes] = []
+        start, end, complete = 0, second, True
+        while 0 < first - start < end - start:
+            k = _split(end - start)
+            if first - start <= k:
+                proof.append(self.subtree(start + k, end))
+                end = start + k
+            else:
+                proof.append(self.subtree(start, start + k))
+                start, complete = start + k, False
+        if first and not complete:
+            proof.append(self.subtree(start, end))
+        return proof[::-1]
+
+
+def verify_inclusion(leaf_hash: bytes, index: int, size: int, path: Sequence[bytes], root: bytes) -> bool:
+    """RFC 9162 section 2.1.3.2"""
+    if index >= size:
+        return False
+    fn, sn, r = index, size - 1, leaf_hash
+    for p in path:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            r = node_hash(p, r)
+            while not fn & 1 and fn:
+                fn, sn = fn >> 1, sn >> 1
+        else:
+            r = node_hash(r, p)
+        fn, sn = fn >> 1, sn >> 1
+    return sn == 0 and r == root
+
+
+def verify_consistency(first: int, second: int, first_root: bytes, second_root: bytes, proof: Sequence[bytes]) -> bool:
+    """RFC 9162 section 2.1.4.2"""
+    if first == 0:
+        return not proof
+    if first == second:
+        return not proof and first_root == second_root
+    if first > second or not proof:
+        return False
+    path = [first_root, *proof] if first & (first - 1) == 0 else list(proof)
+    fn, sn = first - 1, second - 1
+    while fn & 1:
+        fn, sn = fn >> 1, sn >> 1
+    fr = sr = path[0]
+    for c in path[1:]:
+        if sn == 0:
+            return False
+        if fn & 1 or fn == sn:
+            fr, sr = node_hash(c, fr), node_hash(c, sr)
+            while not fn & 1 and fn:
+                fn, sn = fn >> 1, sn >> 1
+        else:
+            sr = node_hash(sr, c)
+        fn, sn = fn >> 1, sn >> 1
+    return fr == first_root and sr == second_root and sn == 0
+
+
+class Ledger:
+    """The tree of `ledger_entries`, kept in step with the table"""
+
+    def __init__(self):
+        self.tree = MerkleTree()
+        self._lock = threading.RLock()
+
+    def sync(self, conn, batch_size: int = 100000) -> int:
+        """Load leaves appended since the last sync (by any process) through a connection or session; returns the size"""
+        with self._lock:
+            rows = conn.execute(
+                select(LedgerEntry.leaf_hash).where(LedgerEntry.seq >= len(self.tree))
+                .order_by(LedgerEntry.seq).execution_options(yield_per=batch_size)
+            )
+            for part in rows.partitions():
+                self.tree.extend(b"".join(bytes.fromhex(leaf) for leaf, in part))
+            return len(self.tree)
+
+    def rebuild(self, conn: Connection) -> None:
+        with self._lock:
+            self.tree = MerkleTree()
+            self.sync(conn)
+
+    def root(self, size: int) -> str:
+        with self._lock:
+            return self.tree.root(size).hex()
+
+    def consistency(self, first: int, second: int) -> ConsistencyProof:
+        with self._lock:
+            return ConsistencyProof(
+                first=first, second=second,
+                first_root=self.tree.root(first).hex(), second_root=self.tree.root(second).hex(),
+                proof=[node.hex() for node in self.tree.consistency_proof(first, second)],
+            )
+
+    def inclusion(self, db, entries: Sequence[LedgerEntry], size: int) -> List[InclusionProof]:
+        """Audit paths of `entries` in the tree of `size` leaves, and whether each record still matches its leaf"""
+        current: Dict[Tuple[str, str], str] = {}
+        for kind, (model, fields) in LEAF_FIELDS.items():
+            ids = [entry.record_id for entry in entries if entry.kind == kind]
+            if not ids:
+                continue
+            for row in db.execute(select(*(getattr(model, name) for name in fields)).where(model.id.in_(ids))):
+                current[kind, row[0]] = _hash_leaves([(kind, dict(zip(fields, row)))]).hex()
+        with self._lock:
+            return [
+                InclusionProof(
+                    seq=entry.seq, kind=entry.kind, record_id=entry.record_id, leaf_hash=entry.leaf_hash,
+                    intact=current.get((entry.kind, entry.record_id)) == entry.leaf_hash, tree_size=size,
+                    audit_path=[node.hex() for node in self.tree.inclusion_proof(entry.seq, size)],
+                )
+                for entry in entries
+            ]
+
+    def append(self, engine: Engine, records: Dict[str, Set[str]]) -> int:
+        """Append the records {kind: ids} that are not in the ledger yet, oldest first; returns how many"""
+        pending: List[Tuple[datetime, str, str, str, Dict]] = []
+        with engine.connect() as conn:
+            for kind, ids in records.items():
+                for chunk in _chunked_ids(sorted(ids)):
+                    pending.extend(_unledgered(conn, kind, LEAF_FIELDS[kind][0].id.in_(chunk)))
+        return self._append(engine, pending)
+
+    def append_missing(self, engine: Engine) -> int:
+        """Append every record not in the ledger yet, in batches"""
+        appended = 0
+        while True:
+            with engine.connect() as conn:
+                pending = [
+                    row for kind in LEAF_FIELDS
+                    for row in _unledgered(conn, kind, None, APPEND_BATCH_SIZE)
+                ]
+            if not pending:
+                return appended
+            appended += self._append(engine, pending)
+
+    def _append(self, engine: Engine, pending: List[Tuple[datetime, str, str, str, Dict]]) -> int:
+        if not pending:
+            return 0
+        pending.sort(key=lambda row: row[:3])
+        leaf_hashes = hash_leaves([(row[1], row[4]) for row in pending])
+        while True:
+            with self._lock, engine.connect() as conn:
+                start = self.sync(conn)
+                self.tree.extend(leaf_hashes)
+                try:
+                    now = datetime.utcnow()
+                    conn.execute(insert(LedgerEntry), [
+                        {
+                            "seq": start + i, "kind": kind, "record_id": record_id, "parcel_id": parcel_id,
+                            "leaf_hash": leaf_hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE].hex(), "created_at": now,
+                        }
+                        for i, (_, kind, record_id, parcel_id, _) in enumerate(pending)
+                    ])
+                    conn.execute(insert(LedgerHead), [
+                        {"size": len(self.tree), "root_hash": self.tree.root().hex(), "created_at": now}
+                    ])
+                    conn.commit()
+                    return len(pending)
+                except IntegrityError:
+                    # Another process appended first: drop ours and retry on top of theirs
+                    conn.rollback()
+                    self.tree.truncate(start)
+                    appended = {
+                        (kind, record_id)
+                        for kind, record_id in conn.execute(
+                            select(LedgerEntry.kind, LedgerEntry.record_id).where(LedgerEntry.seq >= start)
+                        )
+                    }
+                except Exception:
+                    conn.rollback()
+                    self.tree.truncate(start)
+                    raise
+            # Some of ours may be among what the other process appended
+            kept = [i for i, row in enumerate(pending) if (row[1], row[2]) not in appended]
+            if not kept:
+                return 0
+            pending = [pending[i] for i in kept]
+            leaf_hashes = b"".join(leaf_hashes[i * HASH_SIZE:(i + 1) * HASH_SIZE] for i in kept)
+
+
+def _chunked_ids(ids: List[str], size: int = 1000) -> Iterable[List[str]]:
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _unledgered(conn: Connection, kind: str, where=None, limit: Optional[int] = None):
+    """(timestamp, kind, id, parcel_id, leaf field values) of records of `kind` without a ledger entry"""
+    model, fields = LEAF_FIELDS[kind]
+    columns = [getattr(model, name) for name in fields]
+    query = select(*columns).outerjoin(
+        LedgerEntry, and_(LedgerEntry.kind == kind, LedgerEntry.record_id == model.id)
+    ).where(LedgerEntry.seq.is_(None))
+    if where is not None:
+        query = query.where(where)
+    if limit:
+        query = query.order_by(columns[-1], model.id).limit(limit)
+    for row in conn.execute(query):
+        values = dict(zip(fields, row))
+        yield values[fields[-1]] or datetime.min, kind, values["id"], values["parcel_id"], values
+
+
+ledger = Ledger()
+
+
+class LedgerAppender:
+    """Background thread appending committed records shortly after they commit"""
+
+    def __init__(self, engine: Engine, interval: float = LEDGER_APPEND_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._queued: Dict[str, Set[str]] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, kind: str, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._queued.setdefault(kind, set()).update(ids)
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="ledger-appender", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def flush(self) -> int:
+        """Append everything queued so far"""
+        with self._lock:
+            queued, self._queued = self._queued, {}
+        try:
+            return ledger.append(self.engine, queued) if queued else 0
+        except Exception:
+            for kind, ids in queued.items():
+                self.enqueue(kind, ids)
+            raise
+
+    def _run(self) -> None:
+        # Records written before this process started, or while no process was running
+        try:
+            ledger.append_missing(self.engine)
+        except Exception:
+            logger.exception("Ledger backfill failed")
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ledger append failed")
+
+
+def _collect_records(session, flush_context):
+    records = session.info.setdefault("ledger_records", {})
+    for obj in session.new:
+        for kind, (model, _) in LEAF_FIELDS.items():
+            if isinstance(obj, model):
+                records.setdefault(kind, set()).add(obj.id)
+
+
+def _discard_records(session):
+    session.info.pop("ledger_records", None)
+
+
+def track_changes(session_factory, appender: LedgerAppender) -> None:
+    """Queue committed transactions and transfers for `appender`"""
+
+    def enqueue_records(session):
+        for kind, ids in session.info.pop("ledger_records", {}).items():
+            appender.enqueue(kind, ids)
+
+    event.listen(session_factory, "after_flush", _collect_records)
+    event.listen(session_factory, "after_commit", enqueue_records)
+    event.listen(session_factory, "after_rollback", _discard_records)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Merkle ledger maintenance")
+    parser.add_argument("command", choices=("append", "verify"))
+    args = parser.parse_args()
+
+    from database import engine
+
+    with engine.connect() as conn:
+        ledger.rebuild(conn)
+    if args.command == "append":
+        appended = ledger.append_missing(engine)
+        print({"appended": appended, "size": len(ledger.tree), "root": ledger.tree.root().hex()})
+        return
+
+    # Rehash every ledgered record as it is now and compare with the stored leaves
+    tampered = []
+    with engine.connect() as conn:
+        for kind, (model, fields) in LEAF_FIELDS.items():
+            rows = conn.execute(
+                select(LedgerEntry.seq, *(getattr(model, name) for name in fields))
+                .join(model, and_(LedgerEntry.kind == kind, LedgerEntry.record_id == model.id))
+                .execution_options(yield_per=APPEND_BATCH_SIZE)
+            )
+            for seq, *values in rows:
+                if _hash_leaves([(kind, dict(zip(fields, values)))]) != ledger.tree.leaf(seq):
+                    tampered.append({"seq": seq, "kind": kind, "id": values[0]})
+    print(json.dumps({"size": len(ledger.tree), "root": ledger.tree.root().hex(), "tampered": tampered}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
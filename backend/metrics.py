@@ -0,0 +1,281 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this are logged with their slowest SQL statements
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_STATEMENTS = 3
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RequestMetrics:
+    """Measurements for the request being served, shared through a context variable"""
+
+    __slots__ = ("statements", "db_time", "slowest", "endpoint_done", "serialization")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.slowest: List[Tuple[float, str]] = []
+        self.endpoint_done: Optional[float] = None
+        self.serialization = 0.0
+
+    def record_statement(self, statement: str, duration: float) -> None:
+        self.statements += 1
+        self.db_time += duration
+        self._keep_slowest(duration, statement)
+
+    def add_share(self, shared: "RequestMetrics", share: float) -> None:
+        """Charge `share` of the work measured in `shared`, done for several requests at once"""
+        self.statements += shared.statements * share
+        self.db_time += shared.db_time * share
+        self.serialization += shared.serialization * share
+        # The request did wait for the whole statement
+        for duration, statement in shared.slowest:
+            self._keep_slowest(duration, statement)
+
+    def _keep_slowest(self, duration: float, statement: str) -> None:
+        if len(self.slowest) < SLOW_REQUEST_STATEMENTS or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda s: -s[0])
+            del self.slowest[SLOW_REQUEST_STATEMENTS:]
+
+
+current_request: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar(
+    "current_request", default=None
+)
+
+
+def _label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(f'{name}="{_label_value(value)}"' for name, value in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str]):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [count per bucket..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def expose(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                base = _labels(self.label_names, labels)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{self.name}_bucket{{{base},le="{le}"}} {cumulative}')
+                lines.append(f"{self.name}_sum{{{base}}} {series[-1]}")
+                lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+ROUTE_LABELS = ("method", "route")
+
+requests_total = Counter(
+    "http_requests_total", "Requests served", ("method", "route", "status"))
+request_duration = Histogram(
+    "http_request_duration_seconds", "Total request latency", ROUTE_LABELS, LATENCY_BUCKETS)
+db_statements = Histogram(
+    "http_request_db_statements", "SQL statements executed per request", ROUTE_LABELS, COUNT_BUCKETS)
+db_duration = Histogram(
+    "http_request_db_duration_seconds", "Time spent executing SQL per request", ROUTE_LABELS, LATENCY_BUCKETS)
+serialization_duration = Histogram(
+    "http_request_serialization_seconds", "Response validation and encoding time per request",
+    ROUTE_LABELS, LATENCY_BUCKETS)
+response_size = Histogram(
+    "http_response_size_bytes", "Response body size", ROUTE_LABELS, SIZE_BUCKETS)
+
+REGISTRY = (requests_total, request_duration, db_statements, db_duration, serialization_duration, response_size)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.expose()) + "\n"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start_time"].pop()
+    metrics = current_request.get()
+    if metrics is not None:
+        metrics.record_statement(statement, time.perf_counter() - started)
+
+
+def _handle_error(context):
+    # A failed statement gets no after_cursor_execute; drop its start time so
+    # pooled connections do not collect them and later statements pair with their own.
+    # Errors outside execution (connect, commit, fetching) carry no statement or execution context.
+    started = context.connection.info.get("query_start_time") if context.connection is not None else None
+    if started and context.execution_context is not None and context.statement is not None:
+        started.pop()
+
+
+@contextlib.contextmanager
+def encoding() -> Iterator[None]:
+    """Count the block as serialization time of the current request; for
+    endpoints that build their response body themselves"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current_request.get()
+        if metrics is not None:
+            metrics.serialization += time.perf_counter() - started
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Attribute every statement run on `engine` to the current request"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _mark_endpoint_done(endpoint: Callable) -> Callable:
+    """Wrap a path operation so the time its return value is ready gets recorded"""
+
+    def done():
+        metrics = current_request.get()
+        if metrics is not None:
+            metrics.endpoint_done = time.perf_counter()
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            result = await endpoint(*args, **kwargs)
+            done()
+            return result
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            result = endpoint(*args, **kwargs)
+            done()
+            return result
+    return wrapper
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that measures the time between the endpoint returning and the
+    response object being ready (validation, serialization and JSON encoding).
+    Bodies the endpoint encodes itself are timed with `encoding`."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _mark_endpoint_done(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            metrics = current_request.get()
+            if metrics is not None and metrics.endpoint_done is not None:
+                metrics.serialization += time.perf_counter() - metrics.endpoint_done
+            return response
+
+        return timed_handler
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, SQL and response-size metrics"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            # Route templates, not raw paths, so label cardinality stays bounded
+            labels = (scope["method"], route.path_format if route is not None else "unmatched")
+            requests_total.inc((*labels, str(status)))
+            request_duration.observe(labels, elapsed)
+            db_statements.observe(labels, metrics.statements)
+            db_duration.observe(labels, metrics.db_time)
+            serialization_duration.observe(labels, metrics.serialization)
+            response_size.observe(labels, size)
+            if elapsed * 1000 >= SLOW_REQUEST_MS:
+                logger.warning(
+                    "Slow request %s %s: %.1f ms, %g SQL statements in %.1f ms, serialization %.1f ms, %d bytes%s",
+                    scope["method"], scope["path"], elapsed * 1000, metrics.statements, metrics.db_time * 1000,
+                    metrics.serialization * 1000, size,
+                    "".join(f"\n  {duration * 1000:.1f} ms: {' '.join(sql.split())[:300]}"
+                            for duration, sql in metrics.slowest),
+                )
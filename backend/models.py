@@ -1,11 +1,27 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, Boolean, Text, ForeignKey, JSON, Enum as SQLEnum
+from sqlalchemy import DDL, Index, UniqueConstraint, event, Column, String, Integer, Float, Date, DateTime, Boolean, Text, ForeignKey, JSON, Enum as SQLEnum
 from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import func
+from sqlalchemy.sql.functions import now
 from datetime import datetime
 import enum
 
 Base = declarative_base()
 
+@compiles(now, "sqlite")
+def _sqlite_now(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP has no fractional seconds and a different text
+    # format from the one SQLAlchemy binds datetimes with, which breaks equality
+    # and range comparisons on timestamp columns (e.g. keyset cursors).
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+# pg_trgm must exist before the trigram indexes below are created
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
 class UserRole(str, enum.Enum):
     ADMIN = "admin"
     USER = "user"
@@ -56,6 +72,11 @@ class User(Base):
     transfer_requests = relationship("Transfer", foreign_keys="Transfer.from_user_id", back_populates="from_user")
     received_transfers = relationship("Transfer", foreign_keys="Transfer.to_user_id", back_populates="to_user")
 
+    __table_args__ = (
+        Index("ix_users_name_trgm", "name", postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
 class Parcel(Base):
     __tablename__ = "parcels"
     
@@ -72,7 +93,7 @@ class Parcel(Base):
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     
     # Foreign Keys
-    owner_id = Column(String(64), ForeignKey("users.id"), nullable=False)
+    owner_id = Column(String(64), ForeignKey("users.id"), nullable=False, index=True)
     
     # Relationships
     owner = relationship("User", back_populates="owned_parcels")
@@ -82,6 +103,16 @@ class Parcel(Base):
     ai_analysis = relationship("AIAnalysis", back_populates="parcel", uselist=False)
     encumbrances = relationship("Encumbrance", back_populates="parcel")
 
+    # Trigram indexes backing substring search (PostgreSQL only, see search.py)
+    __table_args__ = (
+        Index("ix_parcels_address_trgm", "address", postgresql_using="gin",
+              postgresql_ops={"address": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_parcels_id_trgm", "id", postgresql_using="gin",
+              postgresql_ops={"id": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        # Parcels changed since the transfer rollups' high-water mark (see analytics.py)
+        Index("ix_parcels_updated_at", "updated_at"),
+    )
+
 class Transfer(Base):
     __tablename__ = "transfers"
     
@@ -105,6 +136,15 @@ class Transfer(Base):
     to_user = relationship("User", foreign_keys=[to_user_id], back_populates="received_transfers")
     documents = relationship("Document", back_populates="transfer")
 
+    __table_args__ = (
+        # Keyset pagination order for GET /transfers
+        Index("ix_transfers_created_at_id", "created_at", "id"),
+        # Open transfers of a parcel, checked before accepting another sale
+        Index("ix_transfers_parcel_status", "parcel_id", "status"),
+        # Transfers written since the transfer rollups' high-water mark (see analytics.py)
+        Index("ix_transfers_updated_at", "updated_at"),
+    )
+
 class Document(Base):
     __tablename__ = "documents"
     
@@ -125,6 +165,12 @@ class Document(Base):
     parcel = relationship("Parcel", back_populates="documents")
     transfer = relationship("Transfer", back_populates="documents")
 
+    # Keyset pages of a parcel's / transfer's documents, newest first
+    __table_args__ = (
+        Index("ix_documents_parcel_created_at_id", "parcel_id", "created_at", "id"),
+        Index("ix_documents_transfer_id", "transfer_id"),
+    )
+
 class Transaction(Base):
     __tablename__ = "transactions"
     
@@ -141,6 +187,8 @@ class Transaction(Base):
     # Relationships
     parcel = relationship("Parcel", back_populates="transactions")
 
+    __table_args__ = (Index("ix_transactions_parcel_date_id", "parcel_id", "transaction_date", "id"),)
+
 class AIAnalysis(Base):
     __tablename__ = "ai_analysis"
     
@@ -150,10 +198,12 @@ class AIAnalysis(Base):
     market_value = Column(Float, nullable=False)
     confidence = Column(Float, nullable=False)  # 0.0 to 1.0
     last_valuation = Column(DateTime, default=func.now())
-    price_history = Column(JSON)  # Array of {date, value} objects
+    price_history = Column(JSON)  # Legacy {date, value} array; moved into valuations on startup
     analysis_metadata = Column(JSON)  # Additional AI analysis data
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # Last change of fraud_risk; a rescoring that keeps the level leaves it alone
+    risk_changed_at = Column(DateTime, default=func.now())
     
     # Foreign Keys
     parcel_id = Column(String(64), ForeignKey("parcels.id"), nullable=False, unique=True)
@@ -161,6 +211,83 @@ class AIAnalysis(Base):
     # Relationships
     parcel = relationship("Parcel", back_populates="ai_analysis")
 
+    # Risk levels changed since the transfer rollups' high-water mark (see analytics.py)
+    __table_args__ = (Index("ix_ai_analysis_risk_changed_at", "risk_changed_at"),)
+
+@event.listens_for(AIAnalysis.fraud_risk, "set")
+def _risk_changed(target, value, oldvalue, initiator):
+    # ORM writes; bulk UPDATEs (fraud_scoring.py) set the column themselves
+    if value != oldvalue:
+        target.risk_changed_at = func.now()
+
+class Valuation(Base):
+    __tablename__ = "valuations"
+
+    # One point of a parcel's valuation time series; the key doubles as the range-query index
+    parcel_id = Column(String(64), ForeignKey("parcels.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    value = Column(Float, nullable=False)
+    source = Column(String(32))  # e.g. "ai", "assessment", "price_history"
+    created_at = Column(DateTime, default=func.now())
+
+    # Area-wide rollups scan by date across parcels
+    __table_args__ = (Index("ix_valuations_date", "date"),)
+
+class ValuationRollup(Base):
+    __tablename__ = "valuation_rollups"
+
+    # Precomputed per-zoning aggregates of each parcel's latest valuation in a period (see valuations.py)
+    interval = Column(String(16), primary_key=True)  # "month" or "quarter"
+    period = Column(Date, primary_key=True)  # first day of the period
+    zoning = Column(String(100), primary_key=True)  # "" for parcels without zoning
+    parcels = Column(Integer, nullable=False)
+    median_value = Column(Float, nullable=False)
+    mean_value = Column(Float, nullable=False)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+    computed_at = Column(DateTime, default=func.now())
+
+class TransferRollup(Base):
+    __tablename__ = "transfer_rollups"
+
+    # Precomputed transfer volume and value per period, by zoning, status and risk level (see analytics.py)
+    grain = Column(String(16), primary_key=True)  # "day" or "month"
+    period = Column(Date, primary_key=True)  # day of created_at, or first day of its month
+    zoning = Column(String(100), primary_key=True)  # "" for parcels without zoning
+    status = Column(String(16), primary_key=True)  # TransferStatus name, as stored in transfers.status
+    risk_level = Column(String(16), primary_key=True)  # FraudRiskLevel name, "" for parcels without analysis
+    transfers = Column(Integer, nullable=False)
+    total_value = Column(Float, nullable=False)
+    computed_at = Column(DateTime, default=func.now())
+
+class TransferRollupMember(Base):
+    __tablename__ = "transfer_rollup_members"
+
+    # The rollup group and amount each transfer is counted in, so a refresh can take it out again when it changes
+    transfer_id = Column(String(64), primary_key=True)
+    period = Column(Date, nullable=False)
+    zoning = Column(String(100), nullable=False)
+    status = Column(String(16), nullable=False)
+    risk_level = Column(String(16), nullable=False)
+    amount = Column(Float, nullable=False)
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+
+    # How far an incrementally refreshed rollup has read its sources: rows changed after high_water are not in it yet
+    name = Column(String(64), primary_key=True)
+    high_water = Column(DateTime, nullable=False)
+    refreshed_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+class ImportCheckpoint(Base):
+    __tablename__ = "import_checkpoints"
+
+    # How far a resumable bulk import has read its input; updated in the transaction that commits each chunk
+    name = Column(String(255), primary_key=True)
+    entity = Column(String(32), nullable=False)
+    rows_done = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
 class Encumbrance(Base):
     __tablename__ = "encumbrances"
     
@@ -173,7 +300,7 @@ class Encumbrance(Base):
     resolved_at = Column(DateTime)
     
     # Foreign Keys
-    parcel_id = Column(String(64), ForeignKey("parcels.id"), nullable=False)
+    parcel_id = Column(String(64), ForeignKey("parcels.id"), nullable=False, index=True)
     
     # Relationships
     parcel = relationship("Parcel", back_populates="encumbrances")
@@ -197,6 +324,41 @@ class FraudAlert(Base):
     parcel = relationship("Parcel")
     reporter = relationship("User")
 
+    # Keyset pagination order for GET /fraud-alerts
+    __table_args__ = (Index("ix_fraud_alerts_created_at_id", "created_at", "id"),)
+
+class LedgerEntry(Base):
+    __tablename__ = "ledger_entries"
+
+    # Leaf `seq` of the Merkle tree over transactions and transfers (see ledger.py)
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    kind = Column(String(16), nullable=False)  # "transaction" or "transfer"
+    record_id = Column(String(64), nullable=False)
+    parcel_id = Column(String(64), ForeignKey("parcels.id"), nullable=False, index=True)
+    leaf_hash = Column(String(64), nullable=False)  # hex SHA-256
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (UniqueConstraint("kind", "record_id", name="uq_ledger_entries_record"),)
+
+class LedgerHead(Base):
+    __tablename__ = "ledger_heads"
+
+    # Root published after each append, for auditors to pin and check consistency against
+    size = Column(Integer, primary_key=True, autoincrement=False)
+    root_hash = Column(String(64), nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    # Client-chosen Idempotency-Key of a write and the response it produced (see transfers.py)
+    key = Column(String(255), primary_key=True)
+    scope = Column(String(255), nullable=False)  # "POST /transfers", "POST /transfers/{id}/status"
+    fingerprint = Column(String(64), nullable=False)  # hex SHA-256 of scope and request body
+    status_code = Column(Integer, nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=func.now(), index=True)
+
 class SystemStats(Base):
     __tablename__ = "system_stats"
     
@@ -205,3 +367,14 @@ class SystemStats(Base):
     stat_value = Column(Float, nullable=False)
     stat_metadata = Column(JSON)
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+def create_missing_indexes(bind) -> None:
+    """Create the declared indexes an existing table lacks.
+
+    create_all skips tables that already exist, and with them every index
+    declared after they were created (e.g. the pg_trgm search indexes).
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
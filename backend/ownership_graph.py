@@ -0,0 +1,576 @@
+"""In-memory ownership graph over transfers.
+
+Users and parcels are interned to dense integers, and every transfer is one
+edge in columnar NumPy arrays (seller, buyer, parcel, time, amount, status).
+CSR offsets group the edges by seller, by buyer and by parcel, so the edges
+around any node are one slice of an array, and a time-sorted order selects
+the edges of a window with two binary searches. Transfers written since the
+last compaction sit in a tail that queries scan with vectorized masks; once
+the tail outgrows COMPACT_MIN edges (or 1/64 of the graph) the groupings are
+rebuilt with one stable sort each.
+
+Queries:
+
+- provenance: a parcel's transfers in time order, its chain of owners, and
+  every return to an earlier owner
+- neighborhood: users within N hops of a user through live transfers in a
+  window, expanded one vectorized hop at a time
+- cycles: time-ordered rings A -> B -> ... -> A inside a window, either one
+  parcel coming back (flips) or value going round across parcels
+- clusters: the k-core of the distinct-counterparty graph of a window, split
+  into connected components
+
+Live transfers are those not rejected or cancelled, as in fraud scoring;
+ownership chains only follow completed transfers. A transfer's time is its
+transfer_date, or its created_at until it has one.
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from fraud_scoring import FAILED
+from models import Transfer, TransferStatus
+from schemas import (
+    NeighborhoodEdge, NeighborhoodUser, OwnershipCluster, OwnershipClusterReport, OwnershipCycle,
+    OwnershipCycleReport, ParcelProvenance, ProvenanceStep, UserNeighborhood,
+)
+
+# Tail edges that trigger a compaction, at least; large graphs compact every 1/64 of their size
+COMPACT_MIN = 65536
+# Longest ring reported, in transfers; a parcel resold back after more hands than this is ordinary turnover
+MAX_CYCLE_TRANSFERS = 8
+# Users listed per cluster (its size is always reported)
+MAX_CLUSTER_USERS = 1000
+# Path extensions one cross-parcel cycle search may try before it reports a truncated result
+CYCLE_SEARCH_BUDGET = 200000
+
+EPOCH = datetime(1970, 1, 1)
+
+_STATUSES = list(TransferStatus)
+_CODE = {status: code for code, status in enumerate(_STATUSES)}
+_FAILED = np.array([_CODE[status] for status in FAILED], dtype=np.int8)
+_COMPLETED = _CODE[TransferStatus.COMPLETED]
+_DELETED = -1
+
+_COLUMNS = (
+    ("src", np.int32), ("dst", np.int32), ("parcel", np.int32),
+    ("time", np.float64), ("amount", np.float64), ("status", np.int8),
+)
+_GROUPINGS = ("src", "dst", "parcel")
+
+
+def _seconds(moment: Optional[datetime]) -> float:
+    return ((moment or datetime.utcnow()) - EPOCH).total_seconds()
+
+
+def _moment(seconds: float) -> datetime:
+    return EPOCH + timedelta(seconds=float(seconds))
+
+
+def _status_code(status) -> int:
+    return _CODE[TransferStatus(status)] if status is not None else _CODE[TransferStatus.PENDING]
+
+
+class Edge(NamedTuple):
+    transfer_id: str
+    parcel_id: str
+    from_user_id: str
+    to_user_id: str
+    seconds: float
+    amount: float
+    status: int
+
+
+def edge_of(values) -> Edge:
+    get = values.get if isinstance(values, dict) else lambda name: getattr(values, name)
+    return Edge(
+        get("id"), get("parcel_id"), get("from_user_id"), get("to_user_id"),
+        _seconds(get("transfer_date") or get("created_at")), float(get("amount") or 0.0), _status_code(get("status")),
+    )
+
+
+class OwnershipGraph:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self) -> None:
+        self.users: List[str] = []
+        self.parcels: List[str] = []
+        self.transfer_ids: List[str] = []
+        self._user_index: Dict[str, int] = {}
+        self._parcel_index: Dict[str, int] = {}
+        self._columns = {name: np.empty(0, dtype) for name, dtype in _COLUMNS}
+        self._size = 0
+        # Edges below this position are in the groupings and the time order
+        self._indexed = 0
+        self._groups = {name: (np.zeros(1, np.int64), np.empty(0, np.int64)) for name in _GROUPINGS}
+        self._by_time = np.empty(0, np.int64)
+        self._sorted_times = np.empty(0, np.float64)
+        # Indexed edges whose time changed since the time order was built
+        self._moved: Set[int] = set()
+        self._latest = float("-inf")
+
+    def __len__(self) -> int:
+        return self._size
+
+    def rebuild(self, db: Session, batch_size: int = 50000) -> None:
+        """Reload the graph from the transfers table"""
+        moment = func.coalesce(Transfer.transfer_date, Transfer.created_at)
+        rows = db.execute(
+            select(
+                Transfer.id, Transfer.parcel_id, Transfer.from_user_id, Transfer.to_user_id, moment,
+                Transfer.amount, Transfer.status,
+            ).execution_options(yield_per=batch_size)
+        )
+        with self._lock:
+            self._clear()
+            for part in rows.partitions():
+                self._append([
+                    Edge(transfer_id, parcel_id, from_user_id, to_user_id, _seconds(at), float(amount or 0.0),
+                         _status_code(status))
+                    for transfer_id, parcel_id, from_user_id, to_user_id, at, amount, status in part
+                ])
+            self._compact()
+
+    # -- writes --
+
+    @staticmethod
+    def _intern(key: str, names: List[str], index: Dict[str, int]) -> int:
+        code = index.get(key)
+        if code is None:
+            code = index[key] = len(names)
+            names.append(key)
+        return code
+
+    def _reserve(self, size: int) -> None:
+        capacity = len(self._columns["src"])
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+        for name, dtype in _COLUMNS:
+            grown = np.empty(capacity, dtype)
+            grown[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = grown
+
+    def _append(self, edges: List[Edge]) -> None:
+        if not edges:
+            return
+        start, end = self._size, self._size + len(edges)
+        self._reserve(end)
+        columns = self._columns
+        users, user_index = self.users, self._user_index
+        columns["src"][start:end] = [self._intern(e.from_user_id, users, user_index) for e in edges]
+        columns["dst"][start:end] = [self._intern(e.to_user_id, users, user_index) for e in edges]
+        columns["parcel"][start:end] = [self._intern(e.parcel_id, self.parcels, self._parcel_index) for e in edges]
+        columns["time"][start:end] = [e.seconds for e in edges]
+        columns["amount"][start:end] = [e.amount for e in edges]
+        columns["status"][start:end] = [e.status for e in edges]
+        self.transfer_ids.extend(e.transfer_id for e in edges)
+        self._size = end
+        self._latest = max(self._latest, float(columns["time"][start:end].max()))
+
+    def _maybe_compact(self) -> None:
+        if self._size - self._indexed >= max(COMPACT_MIN, self._indexed // 64):
+            self._compact()
+
+    def _compact(self) -> None:
+        size = self._size
+        for name, count in (("src", len(self.users)), ("dst", len(self.users)), ("parcel", len(self.parcels))):
+            column = self._columns[name][:size]
+            offsets = np.zeros(count + 1, np.int64)
+            np.cumsum(np.bincount(column, minlength=count), out=offsets[1:])
+            self._groups[name] = (offsets, np.argsort(column, kind="stable"))
+        times = self._columns["time"][:size]
+        self._by_time = np.argsort(times, kind="stable")
+        self._sorted_times = times[self._by_time]
+        self._indexed = size
+        self._moved.clear()
+
+    def add(self, edges: Iterable[Edge]) -> None:
+        with self._lock:
+            self._append(list(edges))
+            self._maybe_compact()
+
+    def update(self, edge: Edge) -> None:
+        """Apply a changed transfer; one the graph does not hold yet is added"""
+        with self._lock:
+            index = self._find(edge.transfer_id, edge.parcel_id)
+            columns = self._columns
+            if index is not None and (
+                self.users[columns["src"][index]] != edge.from_user_id
+                or self.users[columns["dst"][index]] != edge.to_user_id
+            ):
+                # Endpoints are part of the groupings; replace the edge instead of moving it
+                columns["status"][index] = _DELETED
+                index = None
+            if index is None:
+                self._append([edge])
+                self._maybe_compact()
+                return
+            if columns["time"][index] != edge.seconds:
+                columns["time"][index] = edge.seconds
+                self._latest = max(self._latest, edge.seconds)
+                if index < self._indexed:
+                    self._moved.add(index)
+            columns["amount"][index] = edge.amount
+            columns["status"][index] = edge.status
+
+    def remove(self, transfer_id: str, parcel_id: str) -> None:
+        with self._lock:
+            index = self._find(transfer_id, parcel_id)
+            if index is not None:
+                self._columns["status"][index] = _DELETED
+
+    def _find(self, transfer_id: str, parcel_id: str) -> Optional[int]:
+        parcel = self._parcel_index.get(parcel_id)
+        if parcel is None:
+            return None
+        for index in self._edges("parcel", np.array([parcel])):
+            if self.transfer_ids[index] == transfer_id and self._columns["status"][index] != _DELETED:
+                return int(index)
+        return None
+
+    # -- edge selection --
+
+    def _edges(self, grouping: str, nodes: np.ndarray) -> np.ndarray:
+        """Positions of every edge whose `grouping` column is one of `nodes`"""
+        offsets, order = self._groups[grouping]
+        known = nodes[nodes < len(offsets) - 1]
+        starts = offsets[known]
+        lengths = offsets[known + 1] - starts
+        total = int(lengths.sum())
+        if total:
+            # Concatenated ranges [start, start + length) without a Python loop
+            found = order[np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)]
+        else:
+            found = np.empty(0, np.int64)
+        tail = self._columns[grouping][self._indexed:self._size]
+        if len(tail):
+            found = np.concatenate((found, np.flatnonzero(np.isin(tail, nodes)) + self._indexed))
+        return found
+
+    def _live(self, edges: np.ndarray, since: float, until: float) -> np.ndarray:
+        status = self._columns["status"][edges]
+        time = self._columns["time"][edges]
+        return (status != _DELETED) & ~np.isin(status, _FAILED) & (time >= since) & (time <= until)
+
+    def _window(self, since: float, until: float) -> np.ndarray:
+        """Live edges with a time in [since, until]"""
+        lo = np.searchsorted(self._sorted_times, since, side="left")
+        hi = np.searchsorted(self._sorted_times, until, side="right")
+        edges = np.concatenate((self._by_time[lo:hi], np.arange(self._indexed, self._size)))
+        if self._moved:
+            edges = np.unique(np.concatenate((edges, np.fromiter(self._moved, np.int64))))
+        return edges[self._live(edges, since, until)]
+
+    def window_bounds(self, since: Optional[datetime], until: Optional[datetime], days: int) -> Tuple[float, float]:
+        """[since, until] in seconds; `until` defaults to the newest transfer, `since` to `days` before it"""
+        with self._lock:
+            end = _seconds(until) if until is not None else self._latest if self._size else _seconds(None)
+        start = _seconds(since) if since is not None else end - days * 86400
+        return start, end
+
+    # -- queries --
+
+    def provenance(self, parcel_id: str) -> Optional[ParcelProvenance]:
+        """A parcel's transfers oldest first, with owners and returns to an earlier owner; None if it has none"""
+        with self._lock:
+            parcel = self._parcel_index.get(parcel_id)
+            if parcel is None:
+                return None
+            columns = self._columns
+            edges = self._edges("parcel", np.array([parcel]))
+            edges = edges[columns["status"][edges] != _DELETED]
+            edges = edges[np.lexsort((edges, columns["time"][edges]))]
+            steps: List[ProvenanceStep] = []
+            owners: List[str] = []
+            owned_at: Dict[str, int] = {}  # user -> latest position in owners
+            chain: List[int] = []  # completed edges, in order
+            cycles: List[OwnershipCycle] = []
+            for index in edges:
+                seller, buyer = self.users[columns["src"][index]], self.users[columns["dst"][index]]
+                status = int(columns["status"][index])
+                gap = False
+                if status == _COMPLETED:
+                    if not owners:
+                        owners.append(seller)
+                        owned_at[seller] = 0
+                    gap = owners[-1] != seller
+                    returned = owned_at.get(buyer)
+                    chain.append(int(index))
+                    owners.append(buyer)
+                    if returned is not None and len(chain) - returned <= MAX_CYCLE_TRANSFERS:
+                        cycles.append(self._cycle(chain[returned:]))
+                    owned_at[buyer] = len(owners) - 1
+                steps.append(ProvenanceStep(
+                    transfer_id=self.transfer_ids[index], from_user_id=seller, to_user_id=buyer,
+                    amount=float(columns["amount"][index]), status=_STATUSES[status],
+                    at=_moment(columns["time"][index]), gap=gap,
+                ))
+            return ParcelProvenance(
+                parcel_id=parcel_id, owner_id=owners[-1] if owners else None, owners=owners, steps=steps, cycles=cycles,
+            )
+
+    def _cycle(self, edges: List[int]) -> OwnershipCycle:
+        columns = self._columns
+        return OwnershipCycle(
+            users=[self.users[columns["src"][edges[0]]]] + [self.users[columns["dst"][e]] for e in edges],
+            parcel_ids=list(dict.fromkeys(self.parcels[columns["parcel"][e]] for e in edges)),
+            transfer_ids=[self.transfer_ids[e] for e in edges],
+            start=_moment(columns["time"][edges[0]]), end=_moment(columns["time"][edges[-1]]),
+        )
+
+    def has_user(self, user_id: str) -> bool:
+        return user_id in self._user_index
+
+    def neighborhood(self, user_id: str, hops: int, since: float, until: float, limit: int) -> UserNeighborhood:
+        """Users within `hops` transfers of `user_id` (either direction) in the window, nearest first"""
+        with self._lock:
+            start = self._user_index.get(user_id)
+            if start is None:
+                return UserNeighborhood(
+                    user_id=user_id, since=_moment(since), until=_moment(until),
+                    users=[NeighborhoodUser(user_id=user_id, hops=0)], edges=[],
+                )
+            columns = self._columns
+            distance = np.full(len(self.users), -1, np.int8)
+            distance[start] = 0
+            reached = [np.array([start])]
+            frontier = reached[0]
+            count, truncated = 1, False
+            for hop in range(1, hops + 1):
+                sold, bought = self._edges("src", frontier), self._edges("dst", frontier)
+                sold, bought = sold[self._live(sold, since, until)], bought[self._live(bought, since, until)]
+                neighbours = np.unique(np.concatenate((columns["dst"][sold], columns["src"][bought])))
+                frontier = neighbours[distance[neighbours] < 0]
+                if count + len(frontier) > limit:
+                    frontier, truncated = frontier[:limit - count], True
+                distance[frontier] = hop
+                reached.append(frontier)
+                count += len(frontier)
+                if truncated or not len(frontier):
+                    break
+            members = np.concatenate(reached)
+
+            # Transfers among the reached users, one entry per direction of each pair
+            edges = self._edges("src", members)
+            edges = edges[self._live(edges, since, until)]
+            edges = edges[distance[columns["dst"][edges]] >= 0]
+            src, dst = columns["src"][edges], columns["dst"][edges]
+            pairs, inverse = np.unique(src.astype(np.int64) * len(self.users) + dst, return_inverse=True)
+            transfers = np.bincount(inverse, minlength=len(pairs))
+            amounts = np.bincount(inverse, weights=columns["amount"][edges], minlength=len(pairs))
+            first = np.full(len(pairs), np.inf)
+            last = np.full(len(pairs), -np.inf)
+            np.minimum.at(first, inverse, columns["time"][edges])
+            np.maximum.at(last, inverse, columns["time"][edges])
+            # The busiest pairs, at most a few per listed user
+            keep = np.argsort(-transfers, kind="stable")[:4 * limit]
+            return UserNeighborhood(
+                user_id=user_id, since=_moment(since), until=_moment(until), truncated=truncated,
+                users=[NeighborhoodUser(user_id=self.users[u], hops=int(distance[u])) for u in members],
+                edges=[
+                    NeighborhoodEdge(
+                        from_user_id=self.users[pairs[i] // len(self.users)],
+                        to_user_id=self.users[pairs[i] % len(self.users)],
+                        transfers=int(transfers[i]), amount=float(amounts[i]),
+                        first=_moment(first[i]), last=_moment(last[i]),
+                    )
+                    for i in keep
+                ],
+            )
+
+    def parcel_cycles(self, since: float, until: float, user_id: Optional[str], limit: int) -> OwnershipCycleReport:
+        """Parcels that went back to a user who sold them earlier in the window (A -> B -> ... -> A)"""
+        with self._lock:
+            columns = self._columns
+            edges = self._window(since, until)
+            edges = edges[columns["src"][edges] != columns["dst"][edges]]
+            edges = edges[np.lexsort((edges, columns["time"][edges], columns["parcel"][edges]))]
+            parcel = columns["parcel"][edges].astype(np.int64)
+            src, dst = columns["src"][edges], columns["dst"][edges]
+            # A purchase closes a cycle when the buyer sold the same parcel earlier in the window
+            sale_keys, first_sale = np.unique(parcel * len(self.users) + src, return_index=True)
+            buy_keys = parcel * len(self.users) + dst
+            position = np.minimum(np.searchsorted(sale_keys, buy_keys), max(len(sale_keys) - 1, 0))
+            returns = (sale_keys[position] == buy_keys) & (first_sale[position] < np.arange(len(edges)))
+            target = self._user_index.get(user_id) if user_id is not None else None
+            cycles: List[OwnershipCycle] = []
+            for p in np.unique(parcel[returns]):
+                lo, hi = np.searchsorted(parcel, [p, p + 1])
+                sold_at: Dict[int, int] = {}
+                for i in range(lo, hi):
+                    earlier = sold_at.get(int(dst[i]))
+                    if earlier is not None and i - earlier < MAX_CYCLE_TRANSFERS and (
+                        target is None or target in src[earlier:i + 1]
+                    ):
+                        cycles.append(self._cycle([int(e) for e in edges[earlier:i + 1]]))
+                    sold_at[int(src[i])] = i
+            cycles.sort(key=lambda cycle: (cycle.start, cycle.transfer_ids))
+            return OwnershipCycleReport(
+                since=_moment(since), until=_moment(until), cycles=cycles[:limit], truncated=len(cycles) > limit,
+            )
+
+    def transfer_cycles(
+        self, since: float, until: float, user_id: Optional[str], max_length: int, limit: int
+    ) -> OwnershipCycleReport:
+        """Rings of users A -> B -> ... -> A over any parcels, each transfer later than the one before it.
+
+        Only users with both a purchase and a sale in what is left of the
+        window can be on a ring, so they are peeled off first; the search
+        then follows time-ordered transfers depth first from each remaining
+        user (or only from `user_id`), at most `max_length` transfers deep.
+        """
+        with self._lock:
+            columns = self._columns
+            edges = self._window(since, until)
+            edges = edges[columns["src"][edges] != columns["dst"][edges]]
+            while len(edges):
+                src, dst = columns["src"][edges], columns["dst"][edges]
+                sells = np.bincount(src, minlength=len(self.users))
+                buys = np.bincount(dst, minlength=len(self.users))
+                keep = (buys[src] > 0) & (sells[dst] > 0)
+                if keep.all():
+                    break
+                edges = edges[keep]
+
+            # Remaining edges by seller, then time
+            edges = edges[np.lexsort((columns["time"][edges], columns["src"][edges]))]
+            src, dst, times = columns["src"][edges], columns["dst"][edges], columns["time"][edges]
+            sellers, starts = np.unique(src, return_index=True)
+            ranges = dict(zip(sellers.tolist(), zip(starts.tolist(), np.append(starts[1:], len(edges)).tolist())))
+            if user_id is not None:
+                origin = self._user_index.get(user_id)
+                origins = [origin] if origin in ranges else []
+            else:
+                origins = sellers.tolist()
+
+            cycles: List[OwnershipCycle] = []
+            budget = CYCLE_SEARCH_BUDGET
+            for origin in origins:
+                # Each ring is found once: from the seller of its earliest transfer
+                stack = [(origin, -np.inf, [])]
+                while stack and budget > 0 and len(cycles) <= limit:
+                    node, after, path = stack.pop()
+                    lo, hi = ranges.get(node, (0, 0))
+                    lo += int(np.searchsorted(times[lo:hi], after, side="right"))
+                    for i in range(lo, hi):
+                        budget -= 1
+                        nxt = int(dst[i])
+                        if nxt == origin:
+                            cycles.append(self._cycle([int(edges[j]) for j in path + [i]]))
+                        elif len(path) + 1 < max_length and all(int(dst[j]) != nxt for j in path):
+                            stack.append((nxt, times[i], path + [i]))
+                if budget <= 0 or len(cycles) > limit:
+                    break
+            cycles.sort(key=lambda cycle: (cycle.start, cycle.transfer_ids))
+            return OwnershipCycleReport(
+                since=_moment(since), until=_moment(until), cycles=cycles[:limit],
+                truncated=budget <= 0 or len(cycles) > limit,
+            )
+
+    def clusters(self, since: float, until: float, min_degree: int, min_size: int, limit: int) -> OwnershipClusterReport:
+        """Groups of users who each dealt with at least `min_degree` others of the group in the window"""
+        with self._lock:
+            columns = self._columns
+            edges = self._window(since, until)
+            a, b = columns["src"][edges].astype(np.int64), columns["dst"][edges].astype(np.int64)
+            distinct = a != b
+            a, b = np.minimum(a, b)[distinct], np.maximum(a, b)[distinct]
+            n = len(self.users)
+        pairs, transfers = np.unique(a * n + b, return_counts=True)
+        a, b = pairs // n, pairs % n
+
+        # k-core: drop users with fewer than min_degree counterparties until none are left
+        while len(a):
+            degree = np.bincount(np.concatenate((a, b)), minlength=n)
+            keep = (degree[a] >= min_degree) & (degree[b] >= min_degree)
+            if keep.all():
+                break
+            a, b, transfers = a[keep], b[keep], transfers[keep]
+
+        # Connected components by min-label propagation with pointer jumping
+        nodes, inverse = np.unique(np.concatenate((a, b)), return_inverse=True)
+        left, right = inverse[:len(a)], inverse[len(a):]
+        labels = np.arange(len(nodes))
+        while True:
+            previous = labels.copy()
+            smaller = np.minimum(labels[left], labels[right])
+            np.minimum.at(labels, left, smaller)
+            np.minimum.at(labels, right, smaller)
+            labels = labels[labels]
+            if np.array_equal(labels, previous):
+                break
+
+        sizes = np.bincount(labels, minlength=len(nodes))
+        pair_counts = np.bincount(labels[left], minlength=len(nodes))
+        transfer_counts = np.bincount(labels[left], weights=transfers, minlength=len(nodes))
+        roots = np.flatnonzero(sizes >= max(min_size, 2))
+        density = 2 * pair_counts[roots] / (sizes[roots] * (sizes[roots] - 1))
+        roots = roots[np.lexsort((-sizes[roots], -density))][:limit]
+        with self._lock:
+            clusters = []
+            for root in roots:
+                members = nodes[labels == root]
+                size = int(sizes[root])
+                clusters.append(OwnershipCluster(
+                    users=[self.users[u] for u in members[:MAX_CLUSTER_USERS]], size=size,
+                    counterparties=int(pair_counts[root]), transfers=int(transfer_counts[root]),
+                    density=float(2 * pair_counts[root] / (size * (size - 1))),
+                ))
+        return OwnershipClusterReport(since=_moment(since), until=_moment(until), min_degree=min_degree, clusters=clusters)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "users": len(self.users), "parcels": len(self.parcels), "transfers": self._size,
+                "unindexed": self._size - self._indexed,
+            }
+
+
+ownership_graph = OwnershipGraph()
+
+
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("graph_changes", [])
+    for obj in session.new:
+        if isinstance(obj, Transfer):
+            # created_at comes from the database; reading it here would cost a query per transfer
+            values = dict(inspect(obj).dict)
+            values.setdefault("created_at", None)
+            values.setdefault("transfer_date", None)
+            changes.append(("add", edge_of(values)))
+    for obj in session.dirty:
+        if isinstance(obj, Transfer) and session.is_modified(obj):
+            changes.append(("update", edge_of(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Transfer):
+            changes.append(("remove", obj.id, obj.parcel_id))
+
+
+def _apply_changes(session):
+    changes = session.info.pop("graph_changes", [])
+    added = [change[1] for change in changes if change[0] == "add"]
+    if added:
+        ownership_graph.add(added)
+    for change in changes:
+        if change[0] == "update":
+            ownership_graph.update(change[1])
+        elif change[0] == "remove":
+            ownership_graph.remove(change[1], change[2])
+
+
+def _discard_changes(session):
+    session.info.pop("graph_changes", None)
+
+
+def track_changes(session_factory) -> None:
+    """Keep `ownership_graph` in sync with committed transfer writes"""
+    event.listen(session_factory, "after_flush", _collect_changes)
+    event.listen(session_factory, "after_commit", _apply_changes)
+    event.listen(session_factory, "after_rollback", _discard_changes)
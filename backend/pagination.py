@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Date, DateTime, and_, func, or_, select
+from sqlalchemy.orm import Session, aliased
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Encode the sort-key values of the last row into an opaque cursor"""
+    payload = [v.isoformat() if isinstance(v, date) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence[Any]) -> List[Any]:
+    """Decode a cursor produced by encode_cursor for the given sort columns"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("cursor does not match sort key")
+        return [
+            datetime.fromisoformat(v) if isinstance(col.type, DateTime) and v is not None
+            else date.fromisoformat(v) if isinstance(col.type, Date) and v is not None
+            else v
+            for col, v in zip(columns, values)
+        ]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(columns: Sequence[Any], values: Sequence[Any], descending: bool = False):
+    """Build `(c1, c2, ...) > (v1, v2, ...)` (or `<`) as portable OR/AND terms"""
+    clauses = []
+    for i, col in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        step = col < values[i] if descending else col > values[i]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+
+def paginate(
+    query,
+    columns: Sequence[Any],
+    cursor: Optional[str],
+    limit: int,
+    descending: bool = False,
+) -> Tuple[List[Any], Optional[str]]:
+    """Apply keyset pagination to a query ordered by `columns`.
+
+    Fetches one row past the page to know whether another page exists, so the
+    cost of a page is independent of how deep the client has paged.
+    """
+    if cursor:
+        query = query.filter(keyset_filter(columns, decode_cursor(cursor, columns), descending))
+
+    order = [col.desc() for col in columns] if descending else list(columns)
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, col.key) for col in columns])
+    return rows, next_cursor
+
+
+def first_pages(
+    db: Session,
+    model,
+    partition,
+    keys: Sequence[Any],
+    columns: Sequence[Any],
+    limit: int,
+    descending: bool = False,
+) -> Dict[Any, Tuple[List[Any], Optional[str]]]:
+    """The first page of `model` rows for each value of `partition` in `keys`, in one statement.
+
+    Rows are ranked per partition with ROW_NUMBER() and limit + 1 of each are
+    kept, so pages and next cursors match what `paginate` returns for one key.
+    """
+    order = [col.desc() for col in columns] if descending else list(columns)
+    rank = func.row_number().over(partition_by=partition, order_by=order).label("page_rank")
+    ranked = select(model, rank).where(partition.in_(keys)).subquery()
+    rows = db.query(aliased(model, ranked)).filter(ranked.c.page_rank <= limit + 1).order_by(ranked.c.page_rank).all()
+
+    pages: Dict[Any, List[Any]] = {key: [] for key in keys}
+    for row in rows:
+        pages[getattr(row, partition.key)].append(row)
+    result = {}
+    for key, page in pages.items():
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor([getattr(page[-1], col.key) for col in columns])
+        result[key] = (page, next_cursor)
+    return result
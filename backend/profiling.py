@@ -0,0 +1,234 @@
+import contextvars
+import hmac
+import os
+import sys
+import threading
+from collections import Counter
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException, Request
+
+# Profiling is only reachable with this token (header X-Profile-Token or ?profile=<token>); unset disables it
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+SAMPLER_INTERVAL_MS = float(os.getenv("SAMPLER_INTERVAL_MS", "10"))
+
+MAIN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse(frame, stop=None) -> str:
+    """Root-to-leaf `file:function;...` stack, optionally cut just below `stop`"""
+    names = []
+    while frame is not None and frame is not stop:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+def render_collapsed(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed format, readable by flamegraph.pl and speedscope"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def is_authorized(token: Optional[str]) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+def require_token(request: Request) -> None:
+    """Dependency guarding the profiler control endpoints"""
+    if not is_authorized(request.headers.get("x-profile-token")):
+        raise HTTPException(status_code=403, detail="Profiling not allowed")
+
+
+class RequestProfile:
+    """Samples the stacks working on one request.
+
+    The event-loop thread is shared by every request, so a thread's stack
+    only counts when it passes through one of this request's anchor frames:
+    the middleware call, or a `track`-wrapped call on a threadpool worker
+    or SQLAlchemy greenlet.
+    """
+
+    def __init__(self, anchor, interval: float):
+        self.anchors = {anchor}
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                cursor = frame
+                while cursor is not None and cursor not in self.anchors:
+                    cursor = cursor.f_back
+                if cursor is not None:
+                    self.stacks[collapse(frame, cursor)] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+def track(fn: Callable) -> Callable:
+    """Wrap work run off the request's own stack (threadpool, run_sync) so a
+    profiled request samples it too; returns `fn` itself when not profiling"""
+    profile = current_profile.get()
+    if profile is None:
+        return fn
+
+    def tracked(*args, **kwargs):
+        frame = sys._getframe()
+        profile.anchors.add(frame)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.anchors.discard(frame)
+
+    return tracked
+
+
+class ProfilingMiddleware:
+    """Run a request under the sampler when it carries the profile token and
+    answer with the collapsed stacks instead of the normal response body"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def _token(self, scope) -> Optional[str]:
+        for name, value in scope["headers"]:
+            if name == b"x-profile-token":
+                return value.decode("latin-1")
+        if b"profile=" in scope.get("query_string", b""):
+            return parse_qs(scope["query_string"].decode("latin-1")).get("profile", [None])[0]
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if not PROFILE_TOKEN or scope["type"] != "http" or scope["path"].startswith("/profiler"):
+            await self.app(scope, receive, send)
+            return
+        token = self._token(scope)
+        if token is None:
+            await self.app(scope, receive, send)
+            return
+        if not is_authorized(token):
+            await send({"type": "http.response.start", "status": 403, "headers": []})
+            await send({"type": "http.response.body", "body": b"Profiling not allowed"})
+            return
+
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        with RequestProfile(sys._getframe(), PROFILE_INTERVAL_MS / 1000) as profile:
+            token_var = current_profile.set(profile)
+            try:
+                await self.app(scope, receive, discard)
+            finally:
+                current_profile.reset(token_var)
+
+        body = render_collapsed(profile.stacks).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"x-profiled-status", str(status).encode()),
+                (b"x-profile-samples", str(profile.samples).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class BackgroundSampler:
+    """Runtime-switchable sampler aggregating stacks of every thread that is
+    inside a main.py handler; costs nothing while stopped"""
+
+    def __init__(self, interval: float = SAMPLER_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, interval: Optional[float] = None) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            if interval:
+                self.interval = interval
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return render_collapsed(self._stacks)
+
+    def status(self) -> Dict[str, object]:
+        return {"running": self.running, "interval_ms": self.interval * 1000, "samples": self.samples,
+                "stacks": len(self._stacks)}
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            sampled = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                # Keep the stack from the outermost main.py frame down
+                handler = None
+                cursor = frame
+                while cursor is not None:
+                    if cursor.f_code.co_filename == MAIN_FILE:
+                        handler = cursor
+                    cursor = cursor.f_back
+                if handler is not None:
+                    sampled.append(collapse(frame, handler.f_back))
+            with self._lock:
+                self.samples += 1
+                self._stacks.update(sampled)
+
+
+sampler = BackgroundSampler()
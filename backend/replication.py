@@ -0,0 +1,181 @@
+"""Read replica routing: replica lag from a heartbeat, and the request middleware that routes reads.
+
+With DATABASE_REPLICA_URL set, sessions opened in GET and HEAD requests read
+from the replica (database.RoutingSession); writes and everything else use
+the primary. ReplicaMonitor writes the current time into a heartbeat row on
+the primary every DB_REPLICA_CHECK_INTERVAL seconds and reads the row back
+from the replica. The value found there is the primary time up to which the
+replica holds every commit, so the replica serves reads only while that is
+at most DB_REPLICA_MAX_LAG seconds ago, and not at all while it cannot be
+read. Replication itself is left to the database: a PostgreSQL streaming
+standby, or for local testing a SQLite file that is copied from the primary
+(benchmarks/replica_bench.py does both).
+
+Read-your-writes across requests: every write request's response sets a
+short-lived cookie holding the time it finished. A read carrying it goes to
+the primary until the replica's heartbeat has passed that time.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.engine import Engine
+from starlette.requests import cookie_parser
+
+import database
+from models import SystemStats
+
+logger = logging.getLogger(__name__)
+
+# Seconds between heartbeats; DB_REPLICA_MAX_LAG should be a few of these
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))
+
+HEARTBEAT = "replication_heartbeat"
+WRITE_COOKIE = "db_written_at"
+READ_METHODS = ("GET", "HEAD")
+
+# Read-only requests by where they were sent: the replica, the primary because
+# the replica lags or cannot be read, or the primary for the client's own write
+reads: Dict[str, int] = {"replica": 0, "replica_behind": 0, "read_your_writes": 0}
+
+
+def beat(primary: Engine) -> float:
+    """Store the current time in the heartbeat row on the primary"""
+    now = time.time()
+    with primary.begin() as conn:
+        updated = conn.execute(
+            update(SystemStats).where(SystemStats.stat_name == HEARTBEAT).values(stat_value=now, updated_at=func.now())
+        ).rowcount
+        if not updated:
+            conn.execute(insert(SystemStats).values(id=f"stat-{HEARTBEAT}", stat_name=HEARTBEAT, stat_value=now))
+    return now
+
+
+def replica_heartbeat(replica: Engine) -> Optional[float]:
+    """The latest heartbeat the replica has received; None before the first one"""
+    with replica.connect() as conn:
+        return conn.scalar(select(SystemStats.stat_value).where(SystemStats.stat_name == HEARTBEAT))
+
+
+class ReplicaMonitor:
+    """Background thread that beats on the primary and updates database.replica_position from the replica"""
+
+    def __init__(self, primary: Engine, replica: Engine, interval: float = DB_REPLICA_CHECK_INTERVAL):
+        self.primary = primary
+        self.replica = replica
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._failing = {"primary": False, "replica": False}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="replica-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def check(self) -> Optional[float]:
+        """One heartbeat; returns the replica's position"""
+        try:
+            beat(self.primary)
+            self._recovered("primary")
+        except Exception:
+            # The replica's position stops advancing, so reads move to the primary as its lag grows
+            self._failed("primary", "Replication heartbeat could not be written")
+        try:
+            database.replica_position = replica_heartbeat(self.replica)
+            self._recovered("replica")
+        except Exception:
+            database.replica_position = None
+            self._failed("replica", "Replica cannot be read; reads go to the primary")
+        return database.replica_position
+
+    def _failed(self, side: str, message: str) -> None:
+        # Logged once per outage rather than every interval
+        if not self._failing[side]:
+            logger.exception(message)
+        self._failing[side] = True
+
+    def _recovered(self, side: str) -> None:
+        if self._failing[side]:
+            logger.info("Replication heartbeat: %s is reachable again", side)
+        self._failing[side] = False
+
+    def _run(self) -> None:
+        while True:
+            self.check()
+            if self._stop.wait(self.interval):
+                return
+
+
+def lag() -> Optional[float]:
+    """Seconds of commits the replica may be missing; None while its heartbeat is unknown"""
+    position = database.replica_position
+    return None if position is None else max(time.time() - position, 0.0)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "configured": database.replica_engine is not None,
+        "lag": lag(),
+        "max_lag": database.DB_REPLICA_MAX_LAG,
+        "reads": dict(reads),
+    }
+
+
+class ReplicaRouting:
+    """ASGI middleware letting read-only requests read from the replica and marking clients that wrote"""
+
+    def __init__(self, app):
+        self.app = app
+        # Past this age a write cookie no longer matters: the replica has caught up to it or counts as lagging
+        self.cookie = f"; Max-Age={max(math.ceil(database.DB_REPLICA_MAX_LAG), 1)}; Path=/; HttpOnly; SameSite=Lax"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        if scope["method"] not in READ_METHODS:
+            await self.app(scope, receive, self._marking(send))
+            return
+
+        use_replica = database.replica_current()
+        if not use_replica:
+            reads["replica_behind"] += 1
+        elif not database.replica_current(self._written_at(scope)):
+            use_replica = False
+            reads["read_your_writes"] += 1
+        else:
+            reads["replica"] += 1
+        token = database.replica_reads.set(use_replica)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            database.replica_reads.reset(token)
+
+    @staticmethod
+    def _written_at(scope) -> float:
+        for name, value in scope["headers"]:
+            if name == b"cookie":
+                try:
+                    return float(cookie_parser(value.decode("latin-1")).get(WRITE_COOKIE, 0))
+                except ValueError:
+                    return 0.0
+        return 0.0
+
+    def _marking(self, send):
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Taken after the handler committed, so a replica past this time holds the write
+                cookie = f"{WRITE_COOKIE}={time.time():.6f}{self.cookie}".encode("latin-1")
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie)]}
+            await send(message)
+
+        return send_wrapper
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import Generic, List, Optional, Dict, Any, TypeVar
+from datetime import date, datetime
 from models import UserRole, ParcelStatus, TransferStatus, DocumentType, FraudRiskLevel
 
 # User Schemas
@@ -48,10 +48,13 @@ class ParcelResponse(ParcelBase):
         from_attributes = True
 
 class ParcelDetailResponse(ParcelResponse):
-    owner: UserResponse
+    # Relations and fields left out by include=/fields= are omitted from the response
+    owner: Optional[UserResponse] = None
     ai_analysis: Optional['AIAnalysisResponse'] = None
     documents: List['DocumentResponse'] = []
+    documents_next_cursor: Optional[str] = None
     transactions: List['TransactionResponse'] = []
+    transactions_next_cursor: Optional[str] = None
     encumbrances: List['EncumbranceResponse'] = []
 
 # Transfer Schemas
@@ -65,6 +68,15 @@ class TransferCreate(TransferBase):
     parcel_id: str
     to_user_id: str
 
+class TransferSubmission(TransferCreate):
+    # The parcel as the seller last read it; the sale is refused with 409 if it has changed since
+    expected_owner_id: Optional[str] = None
+    expected_updated_at: Optional[datetime] = None
+
+class TransferStatusChange(BaseModel):
+    status: TransferStatus
+    notes: Optional[str] = None
+
 class TransferResponse(TransferBase):
     id: str
     parcel_id: str
@@ -103,6 +115,16 @@ class DocumentResponse(DocumentBase):
     class Config:
         from_attributes = True
 
+class DocumentVerificationReport(BaseModel):
+    checked: int = 0
+    intact: int = 0
+    mismatched: List[str] = []
+    missing: List[str] = []
+    # Documents with metadata only, no stored file
+    unstored: int = 0
+    not_found: List[str] = []
+    seconds: float = 0.0
+
 # Transaction Schemas
 class TransactionBase(BaseModel):
     type: str
@@ -144,6 +166,74 @@ class AIAnalysisResponse(AIAnalysisBase):
     class Config:
         from_attributes = True
 
+# Valuation Schemas
+class ValuationBase(BaseModel):
+    date: date
+    value: float
+    source: Optional[str] = None
+
+class ValuationCreate(ValuationBase):
+    pass
+
+class ValuationResponse(ValuationBase):
+    parcel_id: str
+
+    class Config:
+        from_attributes = True
+
+class ValuationBucket(BaseModel):
+    # One downsampled period of a parcel's series
+    period: date
+    points: int
+    mean_value: float
+    min_value: float
+    max_value: float
+    last_value: float
+
+class ValuationRollupResponse(BaseModel):
+    interval: str
+    period: date
+    zoning: Optional[str] = None
+    parcels: int
+    median_value: float
+    mean_value: float
+    min_value: float
+    max_value: float
+    computed_at: datetime
+
+class ValuationRollupReport(BaseModel):
+    since: Optional[date] = None
+    points: int = 0
+    rollups: int = 0
+    seconds: Dict[str, float] = {}
+
+# Transfer Analytics Schemas
+class TransferAnalyticsRow(BaseModel):
+    period: date
+    # Only the dimensions in group_by are set
+    zoning: Optional[str] = None
+    status: Optional[TransferStatus] = None
+    risk_level: Optional[FraudRiskLevel] = None
+    transfers: int
+    total_value: float
+    mean_value: float
+
+class TransferAnalytics(BaseModel):
+    grain: str
+    group_by: List[str]
+    # Rollups cover changes up to here; transfers changed since are merged in at read time
+    high_water: Optional[datetime] = None
+    tail_transfers: int
+    rows: List[TransferAnalyticsRow]
+
+class TransferRollupReport(BaseModel):
+    full: bool
+    high_water: datetime
+    # Transfers whose rollup group or amount changed
+    transfers: int = 0
+    rollups: int = 0
+    seconds: Dict[str, float] = {}
+
 # Encumbrance Schemas
 class EncumbranceBase(BaseModel):
     type: str
@@ -217,6 +307,172 @@ class ParcelSearchResponse(BaseModel):
     fraud_risk: str
     estimated_value: str
 
+# Map / Spatial Schemas
+class ParcelMapItem(BaseModel):
+    id: str
+    address: str
+    owner_name: str
+    status: str
+    coordinates_lat: float
+    coordinates_lng: float
+    distance_m: Optional[float] = None
+
+class ParcelCluster(BaseModel):
+    coordinates_lat: float
+    coordinates_lng: float
+    count: int
+
+class MapViewResponse(BaseModel):
+    total: int
+    parcels: List[ParcelMapItem] = []
+    clusters: List[ParcelCluster] = []
+
+# Pagination Schemas
+T = TypeVar("T")
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[str] = None
+
+# Bulk Import Schemas
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportReport(BaseModel):
+    entity: str
+    resumed_from: int = 0
+    rows_read: int = 0
+    inserted: int = 0
+    failed: int = 0
+    last_row: int = 0
+    errors: List[ImportRowError] = []
+
+# Transfers listing with each referenced user and parcel sent once
+class CompactTransferPage(BaseModel):
+    items: List[TransferResponse]
+    users: Dict[str, UserResponse] = {}
+    parcels: Dict[str, ParcelResponse] = {}
+    next_cursor: Optional[str] = None
+
+# Fraud Scoring Schemas
+class FraudScoringReport(BaseModel):
+    as_of: datetime
+    window_days: int
+    parcels: int = 0
+    transfers: int = 0
+    analyses_created: int = 0
+    analyses_updated: int = 0
+    alerts_created: int = 0
+    levels: Dict[str, int] = {}
+    seconds: Dict[str, float] = {}
+
+# Batch lookup Schemas
+class BatchLookup(BaseModel):
+    ids: List[str]
+
+class BatchResponse(BaseModel, Generic[T]):
+    # Found resources keyed by ID in request order; unknown IDs are listed in not_found
+    items: Dict[str, T] = {}
+    not_found: List[str] = []
+
+# Ledger Schemas
+class LedgerRoot(BaseModel):
+    size: int
+    root: str  # hex SHA-256; SHA-256 of nothing for the empty tree
+
+class InclusionProof(BaseModel):
+    seq: int
+    kind: str
+    record_id: str
+    leaf_hash: str
+    # The record as it is now still hashes to leaf_hash
+    intact: bool
+    tree_size: int
+    audit_path: List[str]
+
+class ParcelLedgerProof(BaseModel):
+    parcel_id: str
+    tree_size: int
+    root: str
+    entries: List[InclusionProof]
+    next_cursor: Optional[str] = None
+
+class ConsistencyProof(BaseModel):
+    first: int
+    second: int
+    first_root: str
+    second_root: str
+    proof: List[str]
+
+# Ownership Graph Schemas
+class ProvenanceStep(BaseModel):
+    transfer_id: str
+    from_user_id: str
+    to_user_id: str
+    amount: float
+    status: TransferStatus
+    at: datetime
+    # Completed, but not sold by the buyer of the previous completed transfer
+    gap: bool = False
+
+class OwnershipCycle(BaseModel):
+    # Starts and ends with the same user
+    users: List[str]
+    parcel_ids: List[str]
+    transfer_ids: List[str]
+    start: datetime
+    end: datetime
+
+class ParcelProvenance(BaseModel):
+    parcel_id: str
+    # Buyer of the last completed transfer
+    owner_id: Optional[str] = None
+    owners: List[str] = []
+    steps: List[ProvenanceStep] = []
+    cycles: List[OwnershipCycle] = []
+
+class NeighborhoodUser(BaseModel):
+    user_id: str
+    hops: int
+
+class NeighborhoodEdge(BaseModel):
+    from_user_id: str
+    to_user_id: str
+    transfers: int
+    amount: float
+    first: datetime
+    last: datetime
+
+class UserNeighborhood(BaseModel):
+    user_id: str
+    since: datetime
+    until: datetime
+    users: List[NeighborhoodUser]
+    edges: List[NeighborhoodEdge]
+    # The user limit was reached before the last hop was complete
+    truncated: bool = False
+
+class OwnershipCycleReport(BaseModel):
+    since: datetime
+    until: datetime
+    cycles: List[OwnershipCycle]
+    truncated: bool = False
+
+class OwnershipCluster(BaseModel):
+    users: List[str]
+    size: int
+    # Distinct pairs of users with a transfer between them
+    counterparties: int
+    transfers: int
+    density: float
+
+class OwnershipClusterReport(BaseModel):
+    since: datetime
+    until: datetime
+    min_degree: int
+    clusters: List[OwnershipCluster]
+
 # Update forward references
 ParcelDetailResponse.model_rebuild()
 TransferDetailResponse.model_rebuild()
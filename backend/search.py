@@ -0,0 +1,223 @@
+import threading
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import event, func, or_, select
+from sqlalchemy.orm import Session
+
+from models import Parcel, User
+from pagination import decode_cursor, encode_cursor
+
+
+def trigrams(text: str) -> Set[str]:
+    """Lower-cased 3-character windows; every substring of `text` of length >= 3
+    has all of its trigrams in this set, which is what makes candidate lookup
+    equivalent to `ILIKE '%term%'`."""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def uses_sql_trigram(bind) -> bool:
+    """PostgreSQL serves search from pg_trgm GIN indexes; other backends use the in-process index"""
+    return bind.dialect.name == "postgresql"
+
+
+def rank_expression(term: str):
+    """Sort key for SQL search: negated best similarity, so ascending order is most relevant first"""
+    best = func.greatest(
+        func.similarity(Parcel.address, term),
+        func.similarity(User.name, term),
+        func.similarity(Parcel.id, term),
+    )
+    return (-best).label("search_rank")
+
+
+def search_filter(term: str):
+    """ILIKE predicate shaped so each arm can use its own trigram index"""
+    pattern = f"%{term}%"
+    return or_(
+        Parcel.address.ilike(pattern),
+        Parcel.id.ilike(pattern),
+        Parcel.owner_id.in_(select(User.id).where(User.name.ilike(pattern))),
+    )
+
+
+class ParcelSearchIndex:
+    """In-process inverted trigram index over parcel ID, address and owner name.
+
+    Parcel postings are append-only arrays of integer document numbers. Every
+    candidate is re-checked against the current document text, so postings
+    left behind by updates are harmless; they are dropped by compaction once
+    they outnumber the live documents.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._doc_numbers: Dict[str, int] = {}
+        # doc number -> (parcel id, lower-cased id, lower-cased address, owner id, status)
+        self._docs: List[Optional[Tuple[str, str, str, str, str]]] = []
+        self._postings: Dict[str, array] = {}
+        self._stale = 0
+        self._user_names: Dict[str, str] = {}
+        self._user_postings: Dict[str, Set[str]] = {}
+        self._owner_parcels: Dict[str, Set[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_numbers)
+
+    def rebuild(self, db: Session, batch_size: int = 10000) -> None:
+        """Reload the whole index from the users and parcels tables"""
+        with self._lock:
+            self._clear()
+            for user_id, name in db.execute(select(User.id, User.name).execution_options(yield_per=batch_size)):
+                self.upsert_user(user_id, name)
+            rows = db.execute(
+                select(Parcel.id, Parcel.address, Parcel.owner_id, Parcel.status)
+                .execution_options(yield_per=batch_size)
+            )
+            for parcel_id, address, owner_id, status in rows:
+                self.upsert_parcel(parcel_id, address, owner_id, status)
+
+    def upsert_parcel(self, parcel_id: str, address: str, owner_id: str, status) -> None:
+        status = getattr(status, "value", status)
+        with self._lock:
+            self._drop_parcel(parcel_id)
+            number = len(self._docs)
+            lower_id, address = parcel_id.lower(), (address or "").lower()
+            id_grams, address_grams = trigrams(lower_id), trigrams(address)
+            self._docs.append((parcel_id, lower_id, address, owner_id, status))
+            self._doc_numbers[parcel_id] = number
+            self._owner_parcels.setdefault(owner_id, set()).add(number)
+            for gram in id_grams | address_grams:
+                self._postings.setdefault(gram, array("l")).append(number)
+            if self._stale > len(self._doc_numbers):
+                self._compact()
+
+    def remove_parcel(self, parcel_id: str) -> None:
+        with self._lock:
+            self._drop_parcel(parcel_id)
+
+    def _drop_parcel(self, parcel_id: str) -> None:
+        number = self._doc_numbers.pop(parcel_id, None)
+        if number is None:
+            return
+        owner_id = self._docs[number][3]
+        self._owner_parcels.get(owner_id, set()).discard(number)
+        self._docs[number] = None
+        self._stale += 1
+
+    def _compact(self) -> None:
+        live = [doc for doc in self._docs if doc is not None]
+        self._docs, self._doc_numbers, self._postings, self._stale = [], {}, {}, 0
+        self._owner_parcels = {}
+        for parcel_id, _, address, owner_id, status in live:
+            self.upsert_parcel(parcel_id, address, owner_id, status)
+
+    def upsert_user(self, user_id: str, name: str) -> None:
+        with self._lock:
+            self.remove_user(user_id)
+            name = (name or "").lower()
+            self._user_names[user_id] = name
+            for gram in trigrams(name):
+                self._user_postings.setdefault(gram, set()).add(user_id)
+
+    def remove_user(self, user_id: str) -> None:
+        with self._lock:
+            name = self._user_names.pop(user_id, None)
+            if name is None:
+                return
+            for gram in trigrams(name):
+                postings = self._user_postings.get(gram)
+                if postings is not None:
+                    postings.discard(user_id)
+
+    def search(self, term: str, status: Optional[str] = None) -> List[Tuple[float, str]]:
+        """Return (score, parcel id) for every parcel whose ID, address or owner
+        name contains `term`, most relevant first"""
+        term = term.lower()
+        grams = trigrams(term)
+        with self._lock:
+            if grams:
+                # The rarest trigram gives the smallest candidate set to verify
+                rarest = min(grams, key=lambda g: len(self._postings.get(g, ())))
+                candidates = set(self._postings.get(rarest, ()))
+                rarest_user = min(grams, key=lambda g: len(self._user_postings.get(g, ())))
+                users = self._user_postings.get(rarest_user, set())
+            else:
+                candidates = set(self._doc_numbers.values())
+                users = self._user_names.keys()
+            for user_id in users:
+                if term in self._user_names[user_id]:
+                    candidates |= self._owner_parcels.get(user_id, set())
+
+            # A field containing the term contains all of its trigrams, so pg_trgm
+            # similarity reduces to |T(term)| / |T(field)|, i.e. roughly
+            # len(term) / len(field) of the shortest matching field.
+            results = []
+            for number in candidates:
+                doc = self._docs[number]
+                if doc is None or (status and doc[4] != status):
+                    continue
+                parcel_id, lower_id, address, owner_id, _ = doc
+                owner_name = self._user_names.get(owner_id, "")
+                shortest = min((len(f) for f in (lower_id, address, owner_name) if term in f), default=0)
+                if shortest:
+                    results.append((len(term) / shortest, parcel_id))
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return results
+
+    def page(
+        self, term: str, status: Optional[str], cursor: Optional[str], limit: int
+    ) -> Tuple[List[str], Optional[str]]:
+        """Keyset page over ranked results, using the same cursor format as the SQL path"""
+        results = self.search(term, status)
+        if cursor:
+            after = tuple(decode_cursor(cursor, [rank_expression(term), Parcel.id]))
+            results = [r for r in results if (-r[0], r[1]) > after]
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = encode_cursor([-results[-1][0], results[-1][1]])
+        return [parcel_id for _, parcel_id in results], next_cursor
+
+
+parcel_index = ParcelSearchIndex()
+
+
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("search_changes", [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Parcel):
+            changes.append(("parcel", obj.id, (obj.address, obj.owner_id, obj.status)))
+        elif isinstance(obj, User):
+            changes.append(("user", obj.id, (obj.name,)))
+    for obj in session.deleted:
+        if isinstance(obj, (Parcel, User)):
+            changes.append(("parcel" if isinstance(obj, Parcel) else "user", obj.id, None))
+
+
+def _apply_changes(session):
+    for kind, key, values in session.info.pop("search_changes", []):
+        if kind == "parcel":
+            if values is None:
+                parcel_index.remove_parcel(key)
+            else:
+                parcel_index.upsert_parcel(key, *values)
+        elif values is None:
+            parcel_index.remove_user(key)
+        else:
+            parcel_index.upsert_user(key, *values)
+
+
+def _discard_changes(session, previous_transaction=None):
+    session.info.pop("search_changes", None)
+
+
+def track_changes(session_factory) -> None:
+    """Keep `parcel_index` in sync with committed parcel and user writes"""
+    event.listen(session_factory, "after_flush", _collect_changes)
+    event.listen(session_factory, "after_commit", _apply_changes)
+    event.listen(session_factory, "after_rollback", _discard_changes)
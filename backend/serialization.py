@@ -0,0 +1,106 @@
+import os
+import typing
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import orjson
+except ImportError:  # optional: without it every endpoint uses the pydantic path
+    orjson = None
+
+import metrics
+from schemas import Page
+
+# "all", "none", or a comma-separated list of endpoint names (parcels, users, fraud_alerts, transfers)
+FAST_SERIALIZATION = os.getenv("FAST_SERIALIZATION", "all")
+
+
+def enabled(endpoint: str) -> bool:
+    """Whether `endpoint` encodes its rows with the fast path"""
+    if orjson is None or FAST_SERIALIZATION == "none":
+        return False
+    return FAST_SERIALIZATION == "all" or endpoint in FAST_SERIALIZATION.split(",")
+
+
+def _is_float(annotation) -> bool:
+    if annotation is float:
+        return True
+    return typing.get_origin(annotation) is typing.Union and float in typing.get_args(annotation)
+
+
+class Unencodable(Exception):
+    """Raised for a value orjson would format differently from pydantic"""
+
+
+# pydantic writes 1e+16 where orjson writes 1e16; every smaller magnitude formats the same
+WIDE_FLOAT = 1e16
+
+
+def _float_or_none(value):
+    if value is None:
+        return None
+    value = float(value)
+    if abs(value) >= WIDE_FLOAT and value != float("inf") and value != float("-inf"):
+        raise Unencodable(value)
+    return value
+
+
+class RowEncoder:
+    """Encodes row tuples shaped like `schema` straight to JSON bytes.
+
+    Rows must hold the schema's fields in declaration order (see `columns`).
+    The output is byte-identical to FastAPI's response_model serialization of
+    the same data: orjson and pydantic-core format strings, datetimes, enums
+    and floats the same way, and the only lax coercion pydantic would apply
+    to database values (int -> float) is precompiled per field. `to_dicts`
+    raises Unencodable for the rare float the two format differently, and
+    callers then answer that page with `models`.
+    """
+
+    def __init__(self, schema: typing.Type[BaseModel]):
+        self.schema = schema
+        self.names = tuple(schema.model_fields)
+        self.coercions = tuple(
+            (i, _float_or_none) for i, field in enumerate(schema.model_fields.values()) if _is_float(field.annotation)
+        )
+        # The pydantic path, used when orjson is not installed
+        self.page_adapter = TypeAdapter(Page[schema])
+
+    def columns(self, model) -> List[Any]:
+        """ORM attributes selecting the schema's fields, in order, from `model`"""
+        return [getattr(model, name) for name in self.names]
+
+    def to_dicts(self, rows: Iterable[Sequence]) -> List[Dict[str, Any]]:
+        names, coercions = self.names, self.coercions
+        if not coercions:
+            return [dict(zip(names, row)) for row in rows]
+        out = []
+        for row in rows:
+            values = list(row)
+            for i, coerce in coercions:
+                values[i] = coerce(values[i])
+            out.append(dict(zip(names, values)))
+        return out
+
+    def models(self, rows: Iterable[Sequence]) -> List[BaseModel]:
+        """The pydantic path: validated `schema` instances"""
+        names, schema = self.names, self.schema
+        return [schema.model_validate(dict(zip(names, row))) for row in rows]
+
+    def page(self, rows: Sequence[Sequence], next_cursor: Optional[str]) -> Response:
+        """A `Page[schema]` response"""
+        with metrics.encoding():
+            try:
+                if orjson is None:
+                    raise Unencodable()
+                body = orjson.dumps({"items": self.to_dicts(rows), "next_cursor": next_cursor})
+            except Unencodable:
+                body = self.page_adapter.dump_json(Page(items=self.models(rows), next_cursor=next_cursor))
+        return Response(content=body, media_type="application/json")
+
+
+def dumps(content: Any) -> bytes:
+    """orjson.dumps for already-shaped content built with RowEncoder.to_dicts"""
+    return orjson.dumps(content)
@@ -0,0 +1,257 @@
+import math
+import threading
+from typing import Dict, Iterable, List, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models import Parcel
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """Parse `min_lng,min_lat,max_lng,max_lat` (the GeoJSON/Mapbox order)"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lng,min_lat,max_lng,max_lat")
+    # float() accepts nan and inf, which the grid cannot place in a cell
+    if not (-180 <= min_lng <= 180 and -180 <= max_lng <= 180 and -90 <= min_lat <= 90 and -90 <= max_lat <= 90):
+        raise HTTPException(status_code=400, detail="bbox longitudes must be within ±180 and latitudes within ±90")
+    if min_lng > max_lng or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="bbox minimums must not exceed maximums")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+class _Cell:
+    __slots__ = ("ids", "sum_lat", "sum_lng")
+
+    def __init__(self):
+        self.ids: Set[str] = set()
+        self.sum_lat = 0.0
+        self.sum_lng = 0.0
+
+
+class ParcelGridIndex:
+    """Uniform lat/lng grid over parcel coordinates.
+
+    Each cell keeps its parcel IDs plus coordinate sums, so box and radius
+    queries only touch the cells they overlap and zoomed-out views can be
+    clustered from cell aggregates without visiting individual parcels.
+    """
+
+    def __init__(self, cell_degrees: float = 0.01):
+        self.cell_degrees = cell_degrees
+        self._lock = threading.RLock()
+        self._points: Dict[str, Tuple[float, float]] = {}
+        self._cells: Dict[Tuple[int, int], _Cell] = {}
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell_key(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees)
+
+    def rebuild(self, db: Session, batch_size: int = 10000) -> None:
+        """Reload the grid from the parcels table"""
+        with self._lock:
+            self._points, self._cells = {}, {}
+            rows = db.execute(
+                select(Parcel.id, Parcel.coordinates_lat, Parcel.coordinates_lng)
+                .execution_options(yield_per=batch_size)
+            )
+            for parcel_id, lat, lng in rows:
+                self.upsert(parcel_id, lat, lng)
+
+    def upsert(self, parcel_id: str, lat: float, lng: float) -> None:
+        with self._lock:
+            self.remove(parcel_id)
+            cell = self._cells.setdefault(self._cell_key(lat, lng), _Cell())
+            cell.ids.add(parcel_id)
+            cell.sum_lat += lat
+            cell.sum_lng += lng
+            self._points[parcel_id] = (lat, lng)
+
+    def remove(self, parcel_id: str) -> None:
+        with self._lock:
+            point = self._points.pop(parcel_id, None)
+            if point is None:
+                return
+            key = self._cell_key(*point)
+            cell = self._cells[key]
+            cell.ids.discard(parcel_id)
+            cell.sum_lat -= point[0]
+            cell.sum_lng -= point[1]
+            if not cell.ids:
+                del self._cells[key]
+
+    def _cells_in(
+        self, min_lat: float, min_lng: float, max_lat: float, max_lng: float
+    ) -> Iterable[Tuple[_Cell, bool]]:
+        """Occupied cells overlapping the box, each with whether it lies on the box's edge.
+
+        Cells strictly inside the range of edge cells lie wholly inside the box;
+        edge cells may hold parcels outside it.
+        """
+        lo_y, lo_x = self._cell_key(min_lat, min_lng)
+        hi_y, hi_x = self._cell_key(max_lat, max_lng)
+        # Walk whichever is smaller: the cell range of the box or the occupied cells
+        if (hi_y - lo_y + 1) * (hi_x - lo_x + 1) <= len(self._cells):
+            for y in range(lo_y, hi_y + 1):
+                for x in range(lo_x, hi_x + 1):
+                    cell = self._cells.get((y, x))
+                    if cell is not None:
+                        yield cell, y in (lo_y, hi_y) or x in (lo_x, hi_x)
+        else:
+            for (y, x), cell in self._cells.items():
+                if lo_y <= y <= hi_y and lo_x <= x <= hi_x:
+                    yield cell, y in (lo_y, hi_y) or x in (lo_x, hi_x)
+
+    def _edge_points(
+        self, cell: _Cell, min_lat: float, min_lng: float, max_lat: float, max_lng: float
+    ) -> Iterable[Tuple[str, float, float]]:
+        for parcel_id in cell.ids:
+            lat, lng = self._points[parcel_id]
+            if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                yield parcel_id, lat, lng
+
+    def within(self, min_lng: float, min_lat: float, max_lng: float, max_lat: float) -> List[Tuple[str, float, float]]:
+        """(id, lat, lng) of every parcel inside the box"""
+        with self._lock:
+            found = []
+            for cell, edge in self._cells_in(min_lat, min_lng, max_lat, max_lng):
+                if edge:
+                    found.extend(self._edge_points(cell, min_lat, min_lng, max_lat, max_lng))
+                else:
+                    found.extend((parcel_id, *self._points[parcel_id]) for parcel_id in cell.ids)
+            return found
+
+    def count_within(self, min_lng: float, min_lat: float, max_lng: float, max_lat: float) -> int:
+        """Parcels inside the box: interior cells by their size, edge cells parcel by parcel"""
+        with self._lock:
+            return sum(
+                sum(1 for _ in self._edge_points(cell, min_lat, min_lng, max_lat, max_lng)) if edge else len(cell.ids)
+                for cell, edge in self._cells_in(min_lat, min_lng, max_lat, max_lng)
+            )
+
+    def clusters(
+        self, min_lng: float, min_lat: float, max_lng: float, max_lat: float, grid: int
+    ) -> List[Tuple[float, float, int]]:
+        """Aggregate the parcels inside the box into at most grid x grid clusters of (centroid lat, lng, count)"""
+        step_lat = max((max_lat - min_lat) / grid, self.cell_degrees)
+        step_lng = max((max_lng - min_lng) / grid, self.cell_degrees)
+        buckets: Dict[Tuple[int, int], List[float]] = {}
+
+        def add(lat: float, lng: float, sum_lat: float, sum_lng: float, count: int) -> None:
+            # Points on the box's max edges would start a row or column of their own
+            key = (
+                min(max(int((lat - min_lat) // step_lat), 0), grid - 1),
+                min(max(int((lng - min_lng) // step_lng), 0), grid - 1),
+            )
+            bucket = buckets.setdefault(key, [0.0, 0.0, 0])
+            bucket[0] += sum_lat
+            bucket[1] += sum_lng
+            bucket[2] += count
+
+        with self._lock:
+            for cell, edge in self._cells_in(min_lat, min_lng, max_lat, max_lng):
+                if edge:
+                    for _, lat, lng in self._edge_points(cell, min_lat, min_lng, max_lat, max_lng):
+                        add(lat, lng, lat, lng, 1)
+                else:
+                    count = len(cell.ids)
+                    add(cell.sum_lat / count, cell.sum_lng / count, cell.sum_lat, cell.sum_lng, count)
+        return [(s_lat / n, s_lng / n, n) for s_lat, s_lng, n in buckets.values()]
+
+    def near(self, lat: float, lng: float, radius_m: float) -> List[Tuple[str, float]]:
+        """(id, distance) of parcels within `radius_m`, nearest first"""
+        d_lat = radius_m / METERS_PER_DEGREE
+        # A degree of longitude is shortest at the most poleward edge of the circle
+        poleward = min(abs(lat) + d_lat, 89.9)
+        d_lng = radius_m / (METERS_PER_DEGREE * math.cos(math.radians(poleward)))
+        found = []
+        for parcel_id, p_lat, p_lng in self.within(lng - d_lng, lat - d_lat, lng + d_lng, lat + d_lat):
+            distance = haversine_m(lat, lng, p_lat, p_lng)
+            if distance <= radius_m:
+                found.append((parcel_id, distance))
+        found.sort(key=lambda r: (r[1], r[0]))
+        return found
+
+    def nearest(self, lat: float, lng: float, k: int) -> List[Tuple[str, float]]:
+        """The k parcels closest to a point, searching outward ring by ring"""
+        with self._lock:
+            total = len(self._points)
+            cy, cx = self._cell_key(lat, lng)
+            best: List[Tuple[float, str]] = []
+            seen = 0
+            ring = 0
+            while seen < total:
+                if 8 * ring > len(self._cells):
+                    # Walking the ring now costs more than visiting every parcel
+                    best = [(haversine_m(lat, lng, p_lat, p_lng), parcel_id)
+                            for parcel_id, (p_lat, p_lng) in self._points.items()]
+                    break
+                for y in range(cy - ring, cy + ring + 1):
+                    xs = range(cx - ring, cx + ring + 1) if abs(y - cy) == ring else (cx - ring, cx + ring)
+                    for x in xs:
+                        cell = self._cells.get((y, x))
+                        if cell is None:
+                            continue
+                        seen += len(cell.ids)
+                        for parcel_id in cell.ids:
+                            p_lat, p_lng = self._points[parcel_id]
+                            best.append((haversine_m(lat, lng, p_lat, p_lng), parcel_id))
+                if len(best) >= k:
+                    best.sort()
+                    del best[k:]
+                    # Anything beyond ring r is at least r cells away; longitude
+                    # degrees shrink towards the poles, so bound with the widest latitude
+                    widest = min(abs(lat) + (ring + 1) * self.cell_degrees, 89.9)
+                    if best[-1][0] <= ring * self.cell_degrees * METERS_PER_DEGREE * math.cos(math.radians(widest)):
+                        break
+                ring += 1
+            best.sort()
+            return [(parcel_id, distance) for distance, parcel_id in best[:k]]
+
+
+parcel_grid = ParcelGridIndex()
+
+
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("spatial_changes", [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Parcel):
+            changes.append((obj.id, (obj.coordinates_lat, obj.coordinates_lng)))
+    for obj in session.deleted:
+        if isinstance(obj, Parcel):
+            changes.append((obj.id, None))
+
+
+def _apply_changes(session):
+    for parcel_id, point in session.info.pop("spatial_changes", []):
+        if point is None:
+            parcel_grid.remove(parcel_id)
+        else:
+            parcel_grid.upsert(parcel_id, *point)
+
+
+def _discard_changes(session):
+    session.info.pop("spatial_changes", None)
+
+
+def track_changes(session_factory) -> None:
+    """Keep `parcel_grid` in sync with committed parcel writes"""
+    event.listen(session_factory, "after_flush", _collect_changes)
+    event.listen(session_factory, "after_commit", _apply_changes)
+    event.listen(session_factory, "after_rollback", _discard_changes)
@@ -0,0 +1,277 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import date, datetime, time
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from cache import TTLCache
+from models import FraudAlert, Parcel, SystemStats, Transfer, TransferStatus, User
+from schemas import DashboardStats
+from valuations import month_start
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "5"))
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "900"))
+
+STAT_NAMES = (
+    "total_properties",
+    "pending_transfers",
+    "fraud_alerts",
+    "active_users",
+    "monthly_transfers",
+    "total_transfer_value",
+)
+
+
+# Start of the current month by the database clock, which fills created_at; the
+# application's clock may be in another time zone
+CURRENT_MONTH = month_start(func.now())
+# The monthly_transfers row records the month it counts in stat_metadata; once
+# the database clock enters a new month it is recounted instead of adjusted
+MONTHLY_TRANSFERS = select(func.count()).where(Transfer.created_at >= CURRENT_MONTH).scalar_subquery()
+COUNTED_MONTH = (
+    select(SystemStats.stat_metadata).where(SystemStats.stat_name == "monthly_transfers").scalar_subquery()
+)
+
+
+# Each tracked model maps a snapshot of its column values (and the start of the
+# current month) to its contribution to every stat. A write changes the stats
+# by (contribution after - before).
+
+def _parcel_stats(v: Dict[str, Any], month: datetime) -> Dict[str, float]:
+    return {"total_properties": 1}
+
+def _user_stats(v: Dict[str, Any], month: datetime) -> Dict[str, float]:
+    return {"active_users": 0 if v["is_active"] is False else 1}
+
+def _transfer_stats(v: Dict[str, Any], month: datetime) -> Dict[str, float]:
+    status = v["status"] or TransferStatus.PENDING
+    # No created_at yet: the database fills it in with its current time
+    created_at = v["created_at"]
+    return {
+        "pending_transfers": 1 if status == TransferStatus.PENDING else 0,
+        "monthly_transfers": 1 if created_at is None or created_at >= month else 0,
+        "total_transfer_value": (v["amount"] or 0.0) if status == TransferStatus.COMPLETED else 0.0,
+    }
+
+def _fraud_alert_stats(v: Dict[str, Any], month: datetime) -> Dict[str, float]:
+    return {"fraud_alerts": 0 if v["is_resolved"] else 1}
+
+TRACKED: Dict[type, Callable[[Dict[str, Any], datetime], Dict[str, float]]] = {
+    Parcel: _parcel_stats,
+    User: _user_stats,
+    Transfer: _transfer_stats,
+    FraudAlert: _fraud_alert_stats,
+}
+
+TRACKED_COLUMNS = {
+    Parcel: ("id",),
+    User: ("is_active",),
+    Transfer: ("status", "created_at", "amount"),
+    FraudAlert: ("is_resolved",),
+}
+
+
+def _snapshots(obj):
+    """Column values before and after the pending flush for one object"""
+    state = inspect(obj)
+    before, after = {}, {}
+    for name in TRACKED_COLUMNS[type(obj)]:
+        history = state.attrs[name].history
+        current = history.added[0] if history.added else (history.unchanged[0] if history.unchanged else None)
+        # An unloaded previous value is unknown; assume unchanged and let reconciliation fix any drift
+        after[name] = current
+        before[name] = history.deleted[0] if history.deleted else current
+    return before, after
+
+
+def _collect_deltas(session, flush_context):
+    changed = [
+        (obj, kind) for objects, kind in ((session.new, "new"), (session.dirty, "dirty"), (session.deleted, "deleted"))
+        for obj in objects if type(obj) in TRACKED and (kind != "dirty" or session.is_modified(obj))
+    ]
+    if not changed:
+        return
+    conn = session.connection()
+    month = None
+    rolled_over = False
+    if any(isinstance(obj, Transfer) for obj, _ in changed):
+        current, counted = conn.execute(select(CURRENT_MONTH, COUNTED_MONTH)).one()
+        month = datetime.combine(_as_date(current), time())
+        rolled_over = not _counts_month(counted, month)
+
+    deltas: Dict[str, float] = {}
+
+    def add(contribution: Dict[str, float], sign: int):
+        for name, value in contribution.items():
+            deltas[name] = deltas.get(name, 0) + sign * value
+
+    for obj, kind in changed:
+        stats_of = TRACKED[type(obj)]
+        before, after = _snapshots(obj)
+        if kind != "new":
+            add(stats_of(before, month), -1)
+        if kind != "deleted":
+            add(stats_of(after, month), 1)
+
+    # In name order, as reconcile_stats locks them, so concurrent writers cannot deadlock with it
+    for name in sorted(deltas):
+        if name == "monthly_transfers" and rolled_over:
+            # Last month's count: start over from the transfers this flush can see, its own included
+            conn.execute(
+                update(SystemStats)
+                .where(SystemStats.stat_name == name)
+                .values(stat_value=MONTHLY_TRANSFERS, stat_metadata=_month_metadata(month), updated_at=func.now())
+            )
+        elif deltas[name]:
+            conn.execute(
+                update(SystemStats)
+                .where(SystemStats.stat_name == name)
+                .values(stat_value=SystemStats.stat_value + deltas[name], updated_at=func.now())
+            )
+    if any(deltas.values()):
+        session.info["stats_changed"] = True
+
+
+def _as_date(value: Any) -> date:
+    # SQLite returns date() results as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _month_metadata(month: datetime) -> Dict[str, str]:
+    return {"month": month.date().isoformat()}
+
+
+def _counts_month(metadata: Optional[Dict[str, Any]], month: datetime) -> bool:
+    """Whether a monthly_transfers row with `metadata` counts `month`; rows from before it was recorded do not"""
+    return (metadata or {}).get("month") == month.date().isoformat()
+
+
+def _invalidate_on_commit(session):
+    if session.info.pop("stats_changed", False):
+        stats_cache.clear()
+
+
+def _discard(session):
+    session.info.pop("stats_changed", None)
+
+
+def track_changes(session_factory) -> None:
+    """Apply stat deltas in the same transaction as every parcel/user/transfer/alert write"""
+    event.listen(session_factory, "after_flush", _collect_deltas)
+    event.listen(session_factory, "after_commit", _invalidate_on_commit)
+    event.listen(session_factory, "after_rollback", _discard)
+
+
+def compute_stats(db: Session) -> Dict[str, float]:
+    """Full recount from the source tables"""
+    transfers = db.execute(
+        select(
+            func.count().filter(Transfer.status == TransferStatus.PENDING),
+            func.count().filter(Transfer.created_at >= CURRENT_MONTH),
+            func.coalesce(func.sum(Transfer.amount).filter(Transfer.status == TransferStatus.COMPLETED), 0.0),
+        )
+    ).one()
+    return {
+        "total_properties": db.scalar(select(func.count()).select_from(Parcel)),
+        "pending_transfers": transfers[0],
+        "fraud_alerts": db.scalar(select(func.count()).where(FraudAlert.is_resolved.is_(False))),
+        "active_users": db.scalar(select(func.count()).where(User.is_active.is_(True))),
+        "monthly_transfers": transfers[1],
+        "total_transfer_value": transfers[2],
+    }
+
+
+def _lock_counters(db: Session) -> None:
+    """Hold off counter deltas from other transactions until this one ends.
+
+    PostgreSQL: row locks on the counters, taken in name order like the
+    deltas. SQLite ignores FOR UPDATE; the UPDATE takes its write lock.
+    """
+    counters = SystemStats.stat_name.in_(STAT_NAMES)
+    db.execute(select(SystemStats.id).where(counters).order_by(SystemStats.stat_name).with_for_update())
+    db.execute(update(SystemStats).where(counters).values(updated_at=func.now()))
+
+
+def reconcile_stats(db: Session) -> Dict[str, float]:
+    """Overwrite the incrementally maintained counters with a full recount.
+
+    The counters are locked before the recount, so a write either committed
+    before it (and is counted) or applies its delta after this commits.
+    """
+    _lock_counters(db)
+    month = datetime.combine(_as_date(db.scalar(select(CURRENT_MONTH))), time())
+    actual = compute_stats(db)
+    stored = {row.stat_name: row for row in db.query(SystemStats).filter(SystemStats.stat_name.in_(STAT_NAMES))}
+    for name, value in actual.items():
+        row = stored.get(name)
+        if row is None:
+            row = SystemStats(id=f"stat-{uuid.uuid4().hex[:12]}", stat_name=name, stat_value=float(value))
+            db.add(row)
+        elif row.stat_value != value:
+            logger.info("Reconciled %s: %s -> %s", name, row.stat_value, value)
+            row.stat_value = float(value)
+        if name == "monthly_transfers" and not _counts_month(row.stat_metadata, month):
+            row.stat_metadata = _month_metadata(month)
+    db.commit()
+    stats_cache.clear()
+    return actual
+
+
+stats_cache = TTLCache(STATS_CACHE_TTL)
+
+
+def read_stats(db: Session) -> DashboardStats:
+    """Dashboard stats from the counter rows, served from the TTL cache"""
+
+    def load() -> DashboardStats:
+        rows = db.query(SystemStats.stat_name, SystemStats.stat_value).filter(
+            SystemStats.stat_name.in_(STAT_NAMES)
+        )
+        stats_dict = dict(rows.all())
+        current, counted = db.execute(select(CURRENT_MONTH, COUNTED_MONTH)).one()
+        if not _counts_month(counted, datetime.combine(_as_date(current), time())):
+            # The month has turned since the last transfer write or reconcile
+            stats_dict["monthly_transfers"] = db.scalar(select(MONTHLY_TRANSFERS))
+        return DashboardStats(
+            total_properties=int(stats_dict.get("total_properties", 0)),
+            pending_transfers=int(stats_dict.get("pending_transfers", 0)),
+            fraud_alerts=int(stats_dict.get("fraud_alerts", 0)),
+            active_users=int(stats_dict.get("active_users", 0)),
+            monthly_transfers=int(stats_dict.get("monthly_transfers", 0)),
+            total_transfer_value=stats_dict.get("total_transfer_value", 0.0),
+        )
+
+    return stats_cache.get(load)
+
+
+class Reconciler:
+    """Background thread running reconcile_stats every `interval` seconds"""
+
+    def __init__(self, session_factory, interval: float = STATS_RECONCILE_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="stats-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                with self.session_factory() as db:
+                    reconcile_stats(db)
+            except Exception:
+                logger.exception("Dashboard stats reconciliation failed")
@@ -0,0 +1,47 @@
+"""Shared fixtures: the app running on a temporary SQLite database seeded with the demo data.
+
+    cd backend
+    pytest tests/
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+DATA_DIR = tempfile.mkdtemp(prefix="registry-tests-")
+# Read at import time by database.py and the job modules, so set before any of them is imported.
+# Periodic jobs are off; tests run them explicitly where they need them.
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(DATA_DIR, 'registry.db')}",
+    DOCUMENT_STORAGE_DIR=os.path.join(DATA_DIR, "storage"),
+    STATS_RECONCILE_INTERVAL="0",
+    VALUATION_ROLLUP_INTERVAL="0",
+    ANALYTICS_ROLLUP_INTERVAL="0",
+    LEDGER_WORKERS="1",
+    DOCUMENT_VERIFY_WORKERS="1",
+)
+os.environ.pop("DATABASE_REPLICA_URL", None)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """TestClient of the app; startup creates the tables, seeds the demo data and builds the in-memory indexes"""
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def db(client):
+    """A session on the app's database, with the app's change tracking attached"""
+    from database import SessionLocal
+
+    with SessionLocal() as db:
+        yield db
@@ -0,0 +1,94 @@
+"""Transfer rollups: incremental refreshes from the high-water mark agree with a full rebuild."""
+import time
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+import analytics
+import fraud_scoring
+from database import engine
+from models import AIAnalysis, FraudRiskLevel, Parcel, Transfer, TransferRollup, TransferStatus
+
+
+def rollups() -> list:
+    with engine.connect() as conn:
+        return [
+            (*key, transfers, pytest.approx(total))
+            for *key, transfers, total in conn.execute(select(
+                TransferRollup.grain, TransferRollup.period, TransferRollup.zoning, TransferRollup.status,
+                TransferRollup.risk_level, TransferRollup.transfers, TransferRollup.total_value,
+            ).order_by(
+                TransferRollup.grain, TransferRollup.period, TransferRollup.zoning, TransferRollup.status,
+                TransferRollup.risk_level,
+            ))
+        ]
+
+
+def add_parcel(db, zoning: str = "Commercial C-1") -> str:
+    parcel_id = f"PLT-AN-{uuid.uuid4().hex[:8]}"
+    db.add(Parcel(
+        id=parcel_id, address="3 Rollup Road", coordinates_lat=40.2, coordinates_lng=-74.2,
+        area_sqft=3000.0, zoning=zoning, owner_id="user-001",
+    ))
+    db.add(AIAnalysis(
+        id=f"ai-{parcel_id}", parcel_id=parcel_id, fraud_risk=FraudRiskLevel.LOW, risk_score=0.1,
+        market_value=300000.0, confidence=0.9,
+    ))
+    db.flush()
+    db.add(Transfer(
+        id=f"TXN-{parcel_id}", parcel_id=parcel_id, from_user_id="user-001", to_user_id="user-002",
+        amount=123456.0, status=TransferStatus.PENDING,
+    ))
+    db.commit()
+    return parcel_id
+
+
+def test_incremental_refresh_matches_a_full_rebuild(client, db, monkeypatch):
+    # Every change below is after the mark; nothing needs the settle window
+    monkeypatch.setattr(analytics, "ANALYTICS_SETTLE_SECONDS", 0)
+    analytics.refresh_rollups(engine, full=True)
+
+    moved, rezoned = add_parcel(db), add_parcel(db)
+    report = analytics.refresh_rollups(engine)
+    assert not report.full and report.transfers >= 2
+    # The mark comes from the database clock that stamped the new rows
+    latest = db.scalar(select(func.max(Transfer.updated_at)))
+    assert latest <= report.high_water.replace(tzinfo=None)
+
+    db.get(Transfer, f"TXN-{moved}").status = TransferStatus.APPROVED
+    db.get(Parcel, rezoned).zoning = "Industrial I-1"
+    db.get(AIAnalysis, f"ai-{moved}").fraud_risk = FraudRiskLevel.HIGH
+    db.commit()
+    assert analytics.refresh_rollups(engine).transfers >= 2
+    incremental = rollups()
+
+    analytics.refresh_rollups(engine, full=True)
+    assert incremental == rollups()
+
+
+@pytest.mark.parametrize("write", ["orm", "scoring"])
+def test_rescoring_brings_back_only_changed_risk_levels(client, db, write):
+    kept, moved = add_parcel(db), add_parcel(db)
+    mark = db.scalar(select(func.now()))
+    # SQLite's clock has millisecond resolution
+    time.sleep(0.002)
+
+    def rescore(analysis_id, level):
+        if write == "orm":
+            analysis = db.get(AIAnalysis, analysis_id)
+            analysis.risk_score, analysis.fraud_risk = 0.2, level
+            db.commit()
+        else:
+            with engine.begin() as conn:
+                fraud_scoring._update_scores(
+                    conn, [{"b_id": analysis_id, "b_risk_score": 0.2, "b_fraud_risk": level}], use_copy=False
+                )
+
+    rescore(f"ai-{kept}", FraudRiskLevel.LOW)
+    rescore(f"ai-{moved}", FraudRiskLevel.CRITICAL)
+    db.expire_all()
+    # The score moved on both; updated_at still changes for cache validators
+    assert db.get(AIAnalysis, f"ai-{kept}").updated_at > mark
+    changed = analytics.changed_transfers(db, mark)
+    assert f"TXN-{moved}" in changed and f"TXN-{kept}" not in changed
@@ -0,0 +1,85 @@
+"""Resumable bulk import: the checkpoint commits with its chunk, so a rerun neither skips nor repeats rows."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, func, select
+
+import bulk_import
+from models import Base, ImportCheckpoint, User
+
+RECORDS = [{"id": f"user-bi-{i:03d}", "email": f"bi{i}@example.com", "name": f"Import {i}"} for i in range(10)]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'import.db'}")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def imported(engine) -> int:
+    with engine.connect() as conn:
+        return conn.scalar(select(func.count()).select_from(User))
+
+
+def checkpoint(engine, name: str):
+    with engine.connect() as conn:
+        return conn.execute(select(ImportCheckpoint.entity, ImportCheckpoint.rows_done)
+                            .where(ImportCheckpoint.name == name)).first()
+
+
+@pytest.mark.parametrize("step", ["write_checkpoint", "_write_chunk"])
+def test_crash_inside_a_chunk_rolls_back_its_rows_and_checkpoint(engine, monkeypatch, step):
+    original = getattr(bulk_import, step)
+    calls = 0
+
+    def crash_on_second_chunk(*args):
+        nonlocal calls
+        calls += 1
+        result = original(*args)
+        if calls == 2:
+            raise RuntimeError("killed")
+        return result
+
+    monkeypatch.setattr(bulk_import, step, crash_on_second_chunk)
+    with pytest.raises(RuntimeError):
+        bulk_import.import_records(engine, "users", iter(RECORDS), chunk_size=4, checkpoint="users-run")
+    assert imported(engine) == 4
+    assert tuple(checkpoint(engine, "users-run")) == ("users", 4)
+
+    monkeypatch.undo()
+    report = bulk_import.import_records(engine, "users", iter(RECORDS), chunk_size=4, checkpoint="users-run")
+    assert (report.resumed_from, report.rows_read, report.inserted, report.failed) == (4, 6, 6, 0)
+    assert report.last_row == 10
+    assert imported(engine) == 10
+    assert tuple(checkpoint(engine, "users-run")) == ("users", 10)
+
+
+def test_checkpoint_of_another_entity_is_rejected(engine):
+    bulk_import.import_records(engine, "users", iter(RECORDS[:2]), checkpoint="shared")
+    with pytest.raises(ValueError, match="users"):
+        bulk_import.import_records(engine, "parcels", iter([]), checkpoint="shared")
+
+
+def test_start_row_applies_without_a_stored_checkpoint(engine):
+    report = bulk_import.import_records(engine, "users", iter(RECORDS), start_row=7, checkpoint="late")
+    assert (report.resumed_from, report.inserted) == (7, 3)
+    assert tuple(checkpoint(engine, "late")) == ("users", 10)
+
+
+def test_defaults_take_the_database_clock(engine, monkeypatch):
+    class Skewed(datetime):
+        # An app clock a day off, or in another zone than the database
+        @classmethod
+        def utcnow(cls):
+            return datetime(2000, 1, 1)
+
+    monkeypatch.setattr(bulk_import, "datetime", Skewed)
+    with engine.connect() as conn:
+        before = conn.scalar(select(func.now()))
+    bulk_import.import_records(engine, "users", iter(RECORDS), chunk_size=4)
+    with engine.connect() as conn:
+        after = conn.scalar(select(func.now()))
+        stamps = conn.execute(select(func.min(User.created_at), func.max(User.updated_at))).one()
+    assert before <= stamps[0] and stamps[1] <= after
@@ -0,0 +1,24 @@
+"""Detail response cache: one hit or miss per lookup, per representation."""
+import cache
+
+
+def counted(client, path: str) -> tuple:
+    """(hits, misses) one GET of `path` adds to the response cache counters"""
+    before = cache.response_cache.stats()
+    assert client.get(path).status_code == 200, path
+    after = cache.response_cache.stats()
+    return after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+
+def test_each_lookup_counts_once(client):
+    cache.response_cache.clear()
+    assert counted(client, "/users/user-001") == (0, 1)
+    assert counted(client, "/users/user-001") == (1, 0)
+
+
+def test_a_new_variant_of_a_cached_resource_is_a_miss(client):
+    cache.response_cache.clear()
+    assert counted(client, "/parcel/PLT-2024-001?include=owner") == (0, 1)
+    assert counted(client, "/parcel/PLT-2024-001?include=documents") == (0, 1)
+    assert counted(client, "/parcel/PLT-2024-001?include=owner") == (1, 0)
+    assert counted(client, "/parcel/PLT-2024-001?include=documents") == (1, 0)
@@ -0,0 +1,46 @@
+"""Document uploads: content-addressed dedup never drops the parcel or transfer an upload was meant for."""
+import hashlib
+import os
+import uuid
+
+import documents
+from models import Document
+
+
+def upload(client, body: bytes, **params):
+    return client.post("/documents", content=body, params={"name": "deed.pdf", "type": "title_deed", **params})
+
+
+def test_same_file_for_the_same_parcel_returns_the_existing_document(client):
+    body = f"deed {uuid.uuid4()}".encode()
+    created = upload(client, body, parcel_id="PLT-2024-001")
+    assert created.status_code == 201
+    document = created.json()
+    assert document["file_hash"] == hashlib.sha256(body).hexdigest()
+
+    again = upload(client, body, parcel_id="PLT-2024-001", name="copy.pdf")
+    assert again.status_code == 200
+    assert again.json()["id"] == document["id"]
+    assert client.get(f"/documents/{document['id']}/content").content == body
+
+
+def test_same_file_for_another_parcel_or_transfer_conflicts(client, db):
+    body = f"survey {uuid.uuid4()}".encode()
+    document = upload(client, body, parcel_id="PLT-2024-001").json()
+
+    for params in ({"parcel_id": "PLT-2024-002"}, {"parcel_id": "PLT-2024-001", "transfer_id": "TXN-2024-001"}, {}):
+        conflict = upload(client, body, **params)
+        assert conflict.status_code == 409, params
+        assert document["id"] in conflict.json()["detail"]
+
+    assert db.query(Document).filter(Document.file_hash == document["file_hash"]).count() == 1
+    assert db.get(Document, document["id"]).parcel_id == "PLT-2024-001"
+    # The shared file stays in place for the existing document
+    assert os.path.exists(documents.absolute_path(document["file_path"]))
+
+
+def test_corrupted_upload_is_rejected(client):
+    body = b"signed contract"
+    response = upload(client, body, parcel_id="PLT-2024-001", sha256=hashlib.sha256(b"other").hexdigest())
+    assert response.status_code == 422
+    assert not os.path.exists(documents.absolute_path(documents.content_path(hashlib.sha256(body).hexdigest())))
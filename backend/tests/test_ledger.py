@@ -0,0 +1,129 @@
+"""Merkle tree proofs against a direct transcription of RFC 6962's recursive definitions."""
+import hashlib
+import time
+
+import pytest
+
+from ledger import EMPTY_ROOT, MerkleTree, node_hash, verify_consistency, verify_inclusion
+from models import LedgerEntry
+
+MAX_SIZE = 33
+
+
+def leaf_hash(i: int) -> bytes:
+    return hashlib.sha256(b"\x00" + f"leaf {i}".encode()).digest()
+
+
+LEAVES = [leaf_hash(i) for i in range(MAX_SIZE)]
+
+
+def split(n: int) -> int:
+    k = 1
+    while k * 2 < n:
+        k *= 2
+    return k
+
+
+def mth(leaves):
+    if not leaves:
+        return EMPTY_ROOT
+    if len(leaves) == 1:
+        return leaves[0]
+    k = split(len(leaves))
+    return node_hash(mth(leaves[:k]), mth(leaves[k:]))
+
+
+def path(m, leaves):
+    if len(leaves) == 1:
+        return []
+    k = split(len(leaves))
+    if m < k:
+        return path(m, leaves[:k]) + [mth(leaves[k:])]
+    return path(m - k, leaves[k:]) + [mth(leaves[:k])]
+
+
+def subproof(m, leaves, complete):
+    n = len(leaves)
+    if m == n:
+        return [] if complete else [mth(leaves)]
+    k = split(n)
+    if m <= k:
+        return subproof(m, leaves[:k], complete) + [mth(leaves[k:])]
+    return subproof(m - k, leaves[k:], False) + [mth(leaves[:k])]
+
+
+def proof(m, leaves):
+    return subproof(m, leaves, True) if 0 < m < len(leaves) else []
+
+
+@pytest.fixture(scope="module")
+def tree():
+    tree = MerkleTree()
+    # Uneven appends, so nodes are hashed across extend() calls
+    for start, end in [(0, 1), (1, 4), (4, 5), (5, 17), (17, MAX_SIZE)]:
+        tree.extend(b"".join(LEAVES[start:end]))
+    return tree
+
+
+def test_roots_match_the_reference(tree):
+    assert len(tree) == MAX_SIZE
+    for size in range(MAX_SIZE + 1):
+        assert tree.root(size) == mth(LEAVES[:size]), size
+
+
+def test_inclusion_proofs_match_the_reference_and_verify(tree):
+    for size in range(1, MAX_SIZE + 1):
+        root = tree.root(size)
+        for index in range(size):
+            audit_path = tree.inclusion_proof(index, size)
+            assert audit_path == path(index, LEAVES[:size]), (index, size)
+            assert verify_inclusion(LEAVES[index], index, size, audit_path, root)
+            # Wrong leaf, position or root
+            assert not verify_inclusion(LEAVES[index - 1] if index else leaf_hash(-1), index, size, audit_path, root)
+            if index ^ 1 < size:
+                assert not verify_inclusion(LEAVES[index], index ^ 1, size, audit_path, root)
+            if size > 1:
+                assert not verify_inclusion(LEAVES[index], index, size, audit_path[:-1], root)
+
+
+def test_consistency_proofs_match_the_reference_and_verify(tree):
+    for second in range(MAX_SIZE + 1):
+        second_root = tree.root(second)
+        for first in range(second + 1):
+            consistency = tree.consistency_proof(first, second)
+            assert consistency == proof(first, LEAVES[:second]), (first, second)
+            assert verify_consistency(first, second, tree.root(first), second_root, consistency)
+            if 0 < first < second:
+                # A rewritten history or a truncated proof is rejected
+                assert not verify_consistency(first, second, leaf_hash(-1), second_root, consistency)
+                assert not verify_consistency(first, second, tree.root(first), second_root, consistency[:-1])
+
+
+def test_truncate_then_extend_rebuilds_the_same_tree(tree):
+    copy = MerkleTree()
+    copy.extend(b"".join(LEAVES))
+    copy.truncate(11)
+    assert len(copy) == 11 and copy.root() == mth(LEAVES[:11])
+    copy.extend(b"".join(LEAVES[11:]))
+    assert [copy.root(size) for size in range(MAX_SIZE + 1)] == [tree.root(size) for size in range(MAX_SIZE + 1)]
+
+
+def test_served_proofs_verify(client, db):
+    # The appender adds the seeded records in the background
+    deadline = time.monotonic() + 10
+    while (size := client.get("/ledger/root").json()["size"]) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert size >= 2
+
+    consistency = client.get("/ledger/consistency", params={"first": 1, "second": size}).json()
+    root = bytes.fromhex(consistency["second_root"])
+    assert verify_consistency(
+        1, size, bytes.fromhex(consistency["first_root"]), root, [bytes.fromhex(p) for p in consistency["proof"]]
+    )
+
+    entry = db.query(LedgerEntry).filter(LedgerEntry.seq < size).order_by(LedgerEntry.seq.desc()).first()
+    served = client.get(f"/ledger/proof/{entry.kind}/{entry.record_id}", params={"tree_size": size}).json()
+    assert served["intact"] and served["seq"] == entry.seq
+    assert verify_inclusion(
+        bytes.fromhex(served["leaf_hash"]), entry.seq, size, [bytes.fromhex(p) for p in served["audit_path"]], root
+    )
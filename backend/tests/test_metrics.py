@@ -0,0 +1,89 @@
+"""Per-request metrics: shared batches are charged to every waiting request, and self-encoded bodies are timed."""
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+import batching
+import metrics
+
+STATEMENTS = 6
+
+
+def run_statements(db, keys):
+    for _ in range(STATEMENTS):
+        db.execute(text("SELECT 1"))
+    return {key: key for key in keys}
+
+
+async def as_request(coroutine_fn, *args):
+    request = metrics.RequestMetrics()
+    metrics.current_request.set(request)
+    return request, await coroutine_fn(*args)
+
+
+def gather_requests(*calls):
+    async def main():
+        # Each task runs in its own copy of the context, like requests do
+        return await asyncio.gather(*(as_request(*call) for call in calls))
+
+    return asyncio.run(main())
+
+
+def test_coalesced_batch_is_split_across_its_requests(client):
+    loader = batching.Coalescer(run_statements)
+    results = gather_requests((loader.load, "a"), (loader.load, "b"), (loader.load, "a"))
+
+    assert [value for _, value in results] == ["a", "b", "a"]
+    assert loader.batches == 1
+    assert [request.statements for request, _ in results] == [STATEMENTS / 3] * 3
+    assert all(request.db_time > 0 and request.slowest for request, _ in results)
+
+
+def test_group_commit_is_split_across_its_requests(client):
+    committer = batching.GroupCommitter()
+
+    def write(db, value):
+        db.execute(text("SELECT 1"))
+        return value
+
+    results = gather_requests((committer.submit, write, 1), (committer.submit, write, 2))
+
+    assert [value for _, value in results] == [1, 2]
+    assert committer.batches == 1
+    statements = [request.statements for request, _ in results]
+    assert statements[0] == statements[1] > 0
+
+
+def serialization_seconds(route: str) -> float:
+    series = metrics.serialization_duration._values.get(("GET", route))
+    return series[-1] if series else 0.0
+
+
+def test_self_encoded_bodies_count_as_serialization(client, monkeypatch):
+    import main
+
+    to_dicts = main.user_encoder.to_dicts
+
+    def slow_to_dicts(rows):
+        time.sleep(0.05)
+        return to_dicts(rows)
+
+    monkeypatch.setattr(main.user_encoder, "to_dicts", slow_to_dicts)
+    before = serialization_seconds("/users")
+    assert client.get("/users").status_code == 200
+    assert serialization_seconds("/users") - before >= 0.05
+
+
+def test_failed_statements_leave_no_start_time_behind(client):
+    from database import engine
+
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(DBAPIError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            conn.rollback()
+        conn.execute(text("SELECT 1"))
+        assert conn.info.get("query_start_time") == []
@@ -0,0 +1,103 @@
+"""Keyset cursors: encoding round trip, tie-breaks on equal sort keys, and per-key first pages."""
+import base64
+from datetime import date, datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import Base, Document, DocumentType, Transfer, TransferRollup, TransferStatus
+from pagination import decode_cursor, encode_cursor, first_pages, paginate
+
+# Three rows share each timestamp, so only the ID orders them
+CREATED = [datetime(2024, 1, 1, 12, 0, 0, 123456), datetime(2024, 1, 1, 12, 0, 1), datetime(2024, 1, 2)]
+
+
+@pytest.fixture(scope="module")
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        for i in range(9):
+            db.add(Transfer(
+                id=f"TXN-{8 - i}", parcel_id=f"PLT-{i % 2}", from_user_id="user-a", to_user_id="user-b",
+                amount=1000.0, status=TransferStatus.PENDING, created_at=CREATED[i % 3],
+            ))
+            db.add(Document(
+                id=f"doc-{i}", name=f"{i}.pdf", type=DocumentType.OTHER, parcel_id=f"PLT-{i % 3}",
+                created_at=CREATED[i // 3],
+            ))
+        db.commit()
+        yield db
+    engine.dispose()
+
+
+def walk(query, columns, limit, descending=False):
+    rows, cursor = paginate(query, columns, None, limit, descending)
+    pages = [rows]
+    while cursor:
+        rows, cursor = paginate(query, columns, cursor, limit, descending)
+        pages.append(rows)
+    return pages
+
+
+def test_cursor_round_trip():
+    values = [datetime(2024, 3, 1, 8, 30, 15, 250000), "TXN-0001", 42, None]
+    columns = [Transfer.created_at, Transfer.id, Transfer.amount, Transfer.notes]
+    assert decode_cursor(encode_cursor(values), columns) == values
+    assert decode_cursor(encode_cursor([date(2024, 3, 1), "R-1"]), [TransferRollup.period, TransferRollup.zoning]) \
+        == [date(2024, 3, 1), "R-1"]
+    # Cursors are URL-safe without padding
+    assert "=" not in encode_cursor(values) and "/" not in encode_cursor(values)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 json!", encode_cursor(["only one value"]), base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    encode_cursor(["yesterday", "TXN-1"]),
+])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, [Transfer.created_at, Transfer.id])
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 2, 4, 9, 20])
+def test_pages_break_ties_by_id(session, limit, descending):
+    columns = [Transfer.created_at, Transfer.id]
+    expected = sorted(
+        ((t.created_at, t.id) for t in session.query(Transfer)), reverse=descending
+    )
+    pages = walk(session.query(Transfer), columns, limit, descending)
+    assert [(t.created_at, t.id) for page in pages for t in page] == expected
+    assert all(len(page) == limit for page in pages[:-1])
+    # The last page is never empty: a next cursor is only handed out when more rows follow
+    assert pages[-1]
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_first_pages_match_paginate(session, descending):
+    columns = [Document.created_at, Document.id]
+    keys = ["PLT-0", "PLT-1", "PLT-2", "PLT-none"]
+    pages = first_pages(session, Document, Document.parcel_id, keys, columns, 2, descending)
+    for key in keys:
+        rows, cursor = paginate(
+            session.query(Document).filter(Document.parcel_id == key), columns, None, 2, descending
+        )
+        assert [row.id for row in pages[key][0]] == [row.id for row in rows]
+        assert pages[key][1] == cursor
+
+
+def test_transfers_endpoint_pages_through_every_transfer(client):
+    everything = client.get("/transfers", params={"limit": 500}).json()
+    assert everything["next_cursor"] is None
+    seen, cursor = [], None
+    while True:
+        page = client.get("/transfers", params={"limit": 2, **({"cursor": cursor} if cursor else {})}).json()
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [item["id"] for item in everything["items"]]
+    assert client.get("/transfers", params={"cursor": "garbage"}).status_code == 400
@@ -0,0 +1,85 @@
+"""The SQL statements a list or detail request runs must not grow with the rows it returns."""
+import threading
+
+from sqlalchemy import event
+
+import cache
+import database
+from models import (
+    AIAnalysis, Document, DocumentType, Encumbrance, FraudRiskLevel, Parcel, Transaction, Transfer, TransferStatus, User
+)
+from pagination import MAX_PAGE_SIZE
+
+# Statements from the app's periodic jobs belong to no request
+BACKGROUND_THREADS = {"ledger-appender", "stats-reconciler", "valuation-rollups", "transfer-rollups", "replica-monitor"}
+
+PARCEL = "PLT-QC-0000"
+PATHS = [
+    f"/parcels?limit={MAX_PAGE_SIZE}",
+    f"/parcel/{PARCEL}?include=owner,ai_analysis,documents,transactions,encumbrances"
+    f"&documents_limit={MAX_PAGE_SIZE}&transactions_limit={MAX_PAGE_SIZE}",
+    f"/transfers?limit={MAX_PAGE_SIZE}",
+    f"/transfers?compact=true&limit={MAX_PAGE_SIZE}",
+    f"/users?limit={MAX_PAGE_SIZE}",
+]
+
+
+def grow(db, first: int, count: int) -> None:
+    """Add `count` users, parcels and transfers, and as many documents, transactions and encumbrances of PARCEL"""
+    for i in range(first, first + count):
+        user_id, parcel_id = f"user-qc-{i:04d}", f"PLT-QC-{i:04d}"
+        db.add(User(id=user_id, email=f"qc{i}@example.com", name=f"Query Count {i}", id_number=f"QC-{i:04d}"))
+        db.add(Parcel(
+            id=parcel_id, address=f"{i} Count Street", coordinates_lat=40.0 + i / 1000, coordinates_lng=-75.0,
+            area_sqft=5000.0, zoning="Residential R-1", owner_id=user_id,
+        ))
+        db.add(AIAnalysis(
+            id=f"ai-qc-{i:04d}", parcel_id=parcel_id, fraud_risk=FraudRiskLevel.LOW, risk_score=0.1,
+            market_value=250000.0, confidence=0.9,
+        ))
+        db.flush()
+        db.add(Transfer(
+            id=f"TXN-QC-{i:04d}", parcel_id=parcel_id, from_user_id=user_id, to_user_id="user-001",
+            amount=100000.0 + i, status=TransferStatus.COMPLETED,
+        ))
+        db.add(Document(
+            id=f"doc-qc-{i:04d}", name=f"deed-{i}.pdf", type=DocumentType.OTHER, parcel_id=PARCEL,
+            transfer_id=f"TXN-QC-{i:04d}",
+        ))
+        db.add(Transaction(id=f"tx-qc-{i:04d}", type="verification_update", parcel_id=PARCEL))
+        db.add(Encumbrance(id=f"enc-qc-{i:04d}", type="lien", parcel_id=PARCEL))
+    db.commit()
+
+
+def statements(client, path: str) -> tuple:
+    """(statements run, response size) of one uncached request"""
+    count = 0
+
+    def counted(*args):
+        nonlocal count
+        if threading.current_thread().name not in BACKGROUND_THREADS:
+            count += 1
+
+    engines = [database.engine] + ([database.async_engine.sync_engine] if database.async_engine else [])
+    cache.response_cache.clear()
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", counted)
+    try:
+        response = client.get(path)
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", counted)
+    assert response.status_code == 200, (path, response.text)
+    return count, len(response.content)
+
+
+def test_statements_do_not_grow_with_rows(client, db):
+    grow(db, 0, 3)
+    small = {path: statements(client, path) for path in PATHS}
+    grow(db, 3, 60)
+    large = {path: statements(client, path) for path in PATHS}
+
+    for path in PATHS:
+        # More rows really were returned
+        assert large[path][1] > small[path][1], path
+    assert {path: count for path, (count, _) in large.items()} == {path: count for path, (count, _) in small.items()}
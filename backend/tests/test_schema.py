@@ -0,0 +1,32 @@
+"""Startup brings a database created by an older version up to the current indexes."""
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from models import Base, create_missing_indexes
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def indexes(engine, table: str) -> set:
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_missing_indexes_are_added_to_existing_tables(engine):
+    with engine.begin() as conn:
+        for name in ("ix_transfers_created_at_id", "ix_parcels_owner_id"):
+            conn.execute(text(f"DROP INDEX {name}"))
+    # Tables exist, so create_all adds nothing
+    Base.metadata.create_all(engine)
+    assert "ix_transfers_created_at_id" not in indexes(engine, "transfers")
+
+    create_missing_indexes(engine)
+    assert "ix_transfers_created_at_id" in indexes(engine, "transfers")
+    assert "ix_parcels_owner_id" in indexes(engine, "parcels")
+    create_missing_indexes(engine)
+
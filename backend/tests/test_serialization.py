@@ -0,0 +1,89 @@
+"""The fast-path list serialization answers byte for byte what the pydantic path does."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+import serialization
+from benchmarks import datagen
+from models import FraudAlert, FraudRiskLevel, Parcel, ParcelStatus, Transfer, TransferStatus, User
+
+PATHS = [
+    "/parcels?limit=3",
+    "/parcels?search=oak&limit=3",
+    "/users?limit=3",
+    "/fraud-alerts?limit=3",
+    "/transfers?compact=true&limit=3",
+]
+
+
+def add_edge_cases(engine) -> None:
+    """Rows with awkward values: non-ASCII and control characters, integral and huge floats,
+    microsecond timestamps, NULLs"""
+    odd = "Zoë \"quoted\" \\ back/slash   tab\t nul-ish \x01 emoji \U0001F3E1"
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{
+            "id": "user-edge", "email": "edge@example.com", "name": odd, "phone": None,
+            "created_at": datetime(2024, 2, 29, 23, 59, 59, 123456), "updated_at": datetime(2024, 2, 29, 0, 0, 0, 1),
+        }])
+        conn.execute(insert(Parcel), [{
+            "id": "PLT-edge", "address": "1 Oak Street " + odd, "coordinates_lat": 40.0, "coordinates_lng": -74.0,
+            "area_sqft": 1e16, "area_display": None, "status": ParcelStatus.PENDING, "owner_id": "user-edge",
+            "created_at": datetime(2024, 1, 1), "updated_at": datetime(2024, 1, 1, 0, 0, 0, 500000),
+        }])
+        conn.execute(insert(Transfer), [{
+            "id": "TXN-edge", "parcel_id": "PLT-edge", "from_user_id": "user-edge", "to_user_id": "user-edge",
+            "amount": 2.5e16, "status": TransferStatus.PENDING, "notes": odd,
+            "created_at": datetime(2030, 1, 1, 0, 0, 0, 999999), "updated_at": datetime(2030, 1, 1),
+        }, {
+            "id": "TXN-edge-2", "parcel_id": "PLT-edge", "from_user_id": "user-edge", "to_user_id": "user-edge",
+            "amount": 0.1 + 0.2, "status": TransferStatus.COMPLETED, "notes": None,
+            "created_at": datetime(2030, 1, 1), "updated_at": datetime(2030, 1, 1),
+        }])
+        conn.execute(insert(FraudAlert), [{
+            "id": "alert-edge", "parcel_id": "PLT-edge", "risk_level": FraudRiskLevel.CRITICAL, "reason": odd,
+            "created_at": datetime(2030, 1, 1, 12, 0, 0, 10), "resolved_at": None,
+        }])
+
+
+def fetch_all(client, path: str) -> list:
+    """Bodies of every page of `path`, following next_cursor"""
+    bodies, cursor = [], None
+    while True:
+        response = client.get(path + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200, (path, response.status_code, response.text[:200])
+        bodies.append(response.content)
+        cursor = response.json()["next_cursor"]
+        if not cursor:
+            return bodies
+
+
+@pytest.fixture(scope="module")
+def registry(client):
+    """A small synthetic registry plus the edge cases, added to the app's database"""
+    import cache
+    import search as parcel_search
+    import spatial
+    import stats
+    from database import SessionLocal, engine
+
+    datagen.generate(engine, datagen.Sizes(users=30, parcels=60, transfers=80, documents=0, alerts=30))
+    add_edge_cases(engine)
+    # The rows bypassed the session events that keep the indexes and counters current
+    with SessionLocal() as db:
+        if not parcel_search.uses_sql_trigram(engine):
+            parcel_search.parcel_index.rebuild(db)
+        spatial.parcel_grid.rebuild(db)
+        stats.reconcile_stats(db)
+    cache.response_cache.clear()
+
+
+@pytest.mark.skipif(serialization.orjson is None, reason="orjson is not installed; the fast path is disabled")
+@pytest.mark.parametrize("path", PATHS)
+def test_fast_path_is_byte_identical(client, registry, monkeypatch, path):
+    monkeypatch.setattr(serialization, "FAST_SERIALIZATION", "none")
+    slow = fetch_all(client, path)
+    monkeypatch.setattr(serialization, "FAST_SERIALIZATION", "all")
+    fast = fetch_all(client, path)
+    assert len(fast) > 1
+    assert fast == slow
@@ -0,0 +1,86 @@
+"""Grid index queries against brute force over the same points."""
+import random
+
+import pytest
+
+from spatial import ParcelGridIndex, haversine_m
+
+# Box edges on cell boundaries, inside cells, and a point exactly on each max edge
+BOXES = [
+    (-75.0, 40.0, -74.9, 40.1),
+    (-74.987, 40.013, -74.9031, 40.0777),
+    (-74.95, 40.05, -74.95, 40.05),
+    (-80.0, 35.0, -70.0, 45.0),
+    (-74.9555, 40.0222, -74.9444, 40.0333),
+]
+
+
+@pytest.fixture(scope="module")
+def points():
+    rng = random.Random(3)
+    found = {f"P-{i}": (rng.uniform(39.99, 40.11), rng.uniform(-75.01, -74.89)) for i in range(3000)}
+    found["P-max-edge"] = (40.0777, -74.9031)
+    found["P-corner"] = (40.05, -74.95)
+    return found
+
+
+@pytest.fixture(scope="module")
+def index(points):
+    index = ParcelGridIndex()
+    for parcel_id, (lat, lng) in points.items():
+        index.upsert(parcel_id, lat, lng)
+    return index
+
+
+def inside(points, min_lng, min_lat, max_lng, max_lat):
+    return {
+        parcel_id for parcel_id, (lat, lng) in points.items()
+        if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+    }
+
+
+@pytest.mark.parametrize("box", BOXES)
+def test_within_and_count_are_exact(index, points, box):
+    expected = inside(points, *box)
+    assert {parcel_id for parcel_id, _, _ in index.within(*box)} == expected
+    assert index.count_within(*box) == len(expected)
+
+
+@pytest.mark.parametrize("box", BOXES)
+@pytest.mark.parametrize("grid", [1, 4, 16])
+def test_clusters_cover_exactly_the_box(index, points, box, grid):
+    expected = inside(points, *box)
+    clusters = index.clusters(*box, grid)
+    assert sum(count for _, _, count in clusters) == len(expected)
+    assert len(clusters) <= grid * grid
+    min_lng, min_lat, max_lng, max_lat = box
+    for lat, lng, _ in clusters:
+        assert min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+
+
+def test_near_and_nearest_match_brute_force(index, points):
+    lat, lng = 40.05, -74.95
+    by_distance = sorted(
+        (haversine_m(lat, lng, p_lat, p_lng), parcel_id) for parcel_id, (p_lat, p_lng) in points.items()
+    )
+    nearest = index.nearest(lat, lng, 25)
+    assert [parcel_id for parcel_id, _ in nearest] == [parcel_id for _, parcel_id in by_distance[:25]]
+    assert {parcel_id for parcel_id, _ in index.near(lat, lng, 800)} == {
+        parcel_id for distance, parcel_id in by_distance if distance <= 800
+    }
+
+
+def test_map_view_total_is_exact(client):
+    # Every parcel in the database; limit=1 forces clustering
+    markers = client.get("/parcels/within", params={"bbox": "-180,-90,180,90", "limit": 5000}).json()
+    clustered = client.get("/parcels/within", params={"bbox": "-180,-90,180,90", "limit": 1, "grid": 2}).json()
+    assert clustered["total"] == markers["total"] == len(markers["parcels"])
+    assert sum(cluster["count"] for cluster in clustered["clusters"]) == markers["total"]
+    assert len(clustered["clusters"]) <= 4
+
+
+@pytest.mark.parametrize("bbox", [
+    "nan,0,1,1", "-inf,40,0,41", "0,0,inf,1", "-181,0,0,1", "0,-91,1,0", "0,0,1,90.5", "a,0,1,1", "1,0,0,1",
+])
+def test_invalid_bbox_is_refused(client, bbox):
+    assert client.get("/parcels/within", params={"bbox": bbox}).status_code == 400
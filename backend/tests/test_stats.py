@@ -0,0 +1,92 @@
+"""Dashboard counters: deltas applied with each write agree with a full recount, also across a reconcile."""
+import threading
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import select
+
+import stats
+from database import SessionLocal
+from models import SystemStats, Transfer, TransferStatus
+
+
+def stored(db) -> dict:
+    db.expire_all()
+    return dict(db.query(SystemStats.stat_name, SystemStats.stat_value).filter(SystemStats.stat_name.in_(stats.STAT_NAMES)))
+
+
+def add_transfer(db, transfer_id: str, **values) -> Transfer:
+    transfer = Transfer(
+        id=transfer_id, parcel_id="PLT-2024-001", from_user_id="user-001", to_user_id="user-002",
+        amount=1000.0, **values,
+    )
+    db.add(transfer)
+    db.commit()
+    return transfer
+
+
+def test_month_boundary_comes_from_the_database(db):
+    stats.reconcile_stats(db)
+    first = datetime.combine(stats._as_date(db.scalar(select(stats.CURRENT_MONTH))), time())
+
+    before = stored(db)
+    add_transfer(db, "TXN-ST-LAST", created_at=first - timedelta(microseconds=1))
+    add_transfer(db, "TXN-ST-FIRST", created_at=first)
+    add_transfer(db, "TXN-ST-NOW")
+    after = stored(db)
+    assert after["monthly_transfers"] - before["monthly_transfers"] == 2
+    assert after == stats.compute_stats(db)
+
+    # Moving a transfer out of the month takes it off the counter again
+    db.get(Transfer, "TXN-ST-FIRST").created_at = first - timedelta(days=1)
+    db.get(Transfer, "TXN-ST-NOW").status = TransferStatus.COMPLETED
+    db.commit()
+    assert stored(db) == stats.compute_stats(db)
+
+
+def test_reconcile_keeps_deltas_committed_during_the_recount(db, monkeypatch):
+    compute_stats = stats.compute_stats
+    writer_done = threading.Event()
+
+    def write():
+        with SessionLocal() as other:
+            add_transfer(other, "TXN-ST-RACE", status=TransferStatus.PENDING)
+        writer_done.set()
+
+    def recount_then_write(session):
+        actual = compute_stats(session)
+        # A write landing between the recount and the overwrite must wait for the reconcile to commit
+        writer.start()
+        assert not writer_done.wait(0.5)
+        return actual
+
+    writer = threading.Thread(target=write)
+    monkeypatch.setattr(stats, "compute_stats", recount_then_write)
+    stats.reconcile_stats(db)
+    writer.join()
+    monkeypatch.undo()
+
+    assert db.get(Transfer, "TXN-ST-RACE") is not None
+    assert stored(db) == stats.compute_stats(db)
+
+
+def test_counter_left_from_last_month_is_recounted(db):
+    stats.reconcile_stats(db)
+    first = datetime.combine(stats._as_date(db.scalar(select(stats.CURRENT_MONTH))), time())
+    month = stored(db)["monthly_transfers"]
+
+    def last_reconciled_a_month_ago():
+        counter = db.query(SystemStats).filter(SystemStats.stat_name == "monthly_transfers").one()
+        counter.stat_value = month + 50
+        counter.stat_metadata = {"month": (first - timedelta(days=1)).replace(day=1).date().isoformat()}
+        db.commit()
+        stats.stats_cache.clear()
+
+    # Reads no longer trust it...
+    last_reconciled_a_month_ago()
+    assert stats.read_stats(db).monthly_transfers == month
+    # ...and the first transfer write of the month starts it over
+    add_transfer(db, "TXN-ST-ROLL")
+    assert stored(db)["monthly_transfers"] == month + 1
+    assert stored(db) == stats.compute_stats(db)
+    add_transfer(db, "TXN-ST-ROLL-2")
+    assert stored(db)["monthly_transfers"] == month + 2
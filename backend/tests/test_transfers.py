@@ -0,0 +1,128 @@
+"""Transfer writes: idempotency keys, optimistic concurrency, and group commits that isolate a failing write."""
+import asyncio
+import uuid
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+import batching
+import transfers
+from models import Parcel, Transaction, Transfer, TransferStatus
+
+
+@pytest.fixture
+def parcel(db) -> str:
+    parcel_id = f"PLT-TW-{uuid.uuid4().hex[:8]}"
+    db.add(Parcel(
+        id=parcel_id, address="9 Write Street", coordinates_lat=40.5, coordinates_lng=-74.5,
+        area_sqft=4000.0, zoning="Residential R-1", owner_id="user-001",
+    ))
+    db.commit()
+    return parcel_id
+
+
+def sale(parcel_id: str, **changes) -> dict:
+    return {"parcel_id": parcel_id, "to_user_id": "user-002", "amount": 250000.0, **changes}
+
+
+def transfers_of(db, parcel_id: str) -> list:
+    db.expire_all()
+    return db.query(Transfer).filter(Transfer.parcel_id == parcel_id).all()
+
+
+def test_retry_with_the_same_key_replays_the_first_response(client, db, parcel):
+    headers = {"Idempotency-Key": f"key-{uuid.uuid4()}"}
+    first = client.post("/transfers", json=sale(parcel), headers=headers)
+    assert first.status_code == 201
+    assert "Idempotent-Replayed" not in first.headers
+
+    retry = client.post("/transfers", json=sale(parcel), headers=headers)
+    assert retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.content == first.content
+    assert [t.id for t in transfers_of(db, parcel)] == [first.json()["id"]]
+
+    # Without the key the same request is a second sale, refused while the first is open
+    assert client.post("/transfers", json=sale(parcel)).status_code == 409
+
+
+def test_key_reused_for_a_different_request_is_refused(client, db, parcel):
+    headers = {"Idempotency-Key": f"key-{uuid.uuid4()}"}
+    assert client.post("/transfers", json=sale(parcel), headers=headers).status_code == 201
+
+    different = client.post("/transfers", json=sale(parcel, amount=1.0), headers=headers)
+    assert different.status_code == 422
+    transfer_id = transfers_of(db, parcel)[0].id
+    other_endpoint = client.post(f"/transfers/{transfer_id}/status", json={"status": "approved"}, headers=headers)
+    assert other_endpoint.status_code == 422
+    assert len(transfers_of(db, parcel)) == 1
+
+
+def test_stale_version_is_refused_with_409(client, db, parcel, monkeypatch):
+    transfer_id = client.post("/transfers", json=sale(parcel)).json()["id"]
+    compare_and_set = transfers._compare_and_set
+
+    def changed_meanwhile(session, row, version, values):
+        # Another writer moves the row on between this write's read and its UPDATE
+        if isinstance(row, Transfer):
+            session.execute(update(Transfer).where(Transfer.id == row.id).values(status=TransferStatus.CANCELLED))
+        compare_and_set(session, row, version, values)
+
+    monkeypatch.setattr(transfers, "_compare_and_set", changed_meanwhile)
+    response = client.post(f"/transfers/{transfer_id}/status", json={"status": "approved"})
+    assert response.status_code == 409
+    assert response.json()["detail"].startswith("Changed by a concurrent write")
+    monkeypatch.undo()
+
+    db.expire_all()
+    assert db.get(Transfer, transfer_id).status == TransferStatus.PENDING
+    assert client.post(f"/transfers/{transfer_id}/status", json={"status": "approved"}).status_code == 200
+
+
+def test_changed_parcel_is_refused_with_409(client, parcel):
+    response = client.post("/transfers", json=sale(parcel, expected_owner_id="user-002"))
+    assert response.status_code == 409
+
+
+def test_writes_take_the_database_clock(client, db, parcel, monkeypatch):
+    class Skewed(datetime):
+        # An app clock a day off, or in another zone than the database
+        @classmethod
+        def utcnow(cls):
+            return datetime(2000, 1, 1)
+
+    monkeypatch.setattr(transfers, "datetime", Skewed)
+    before = db.scalar(select(func.now()))
+    transfer_id = client.post("/transfers", json=sale(parcel)).json()["id"]
+    assert client.post(f"/transfers/{transfer_id}/status", json={"status": "approved"}).status_code == 200
+    assert client.post(f"/transfers/{transfer_id}/status", json={"status": "completed"}).status_code == 200
+    after = db.scalar(select(func.now()))
+
+    db.expire_all()
+    transfer = db.get(Transfer, transfer_id)
+    assert before <= transfer.created_at <= transfer.updated_at <= after
+    assert before <= db.get(Parcel, parcel).updated_at <= after
+
+
+def test_failed_group_commit_retries_each_write_alone(client, db):
+    committer = batching.GroupCommitter()
+    taken = f"tx-tw-{uuid.uuid4().hex[:8]}"
+    db.add(Transaction(id=taken, type="verification_update", parcel_id="PLT-2024-001"))
+    db.commit()
+    ids = [f"tx-tw-{uuid.uuid4().hex[:8]}", taken, f"tx-tw-{uuid.uuid4().hex[:8]}"]
+
+    def add(session, transaction_id):
+        session.add(Transaction(id=transaction_id, type="verification_update", parcel_id="PLT-2024-001"))
+        return transaction_id
+
+    async def main():
+        return await asyncio.gather(*(committer.submit(add, i) for i in ids), return_exceptions=True)
+
+    outcomes = asyncio.run(main())
+    assert (committer.batches, committer.retried) == (1, 3)
+    assert outcomes[0] == ids[0] and outcomes[2] == ids[2]
+    assert isinstance(outcomes[1], IntegrityError)
+    db.expire_all()
+    assert db.query(Transaction).filter(Transaction.id.in_(ids)).count() == 3
@@ -0,0 +1,253 @@
+"""Transfer writes: sales and status changes, with idempotency keys and optimistic concurrency.
+
+A client may send an `Idempotency-Key` header with a write. The response of
+the first request with a key is stored in the transaction of its writes; a
+retry with the same key and body gets that response back, marked
+`Idempotent-Replayed: true`, instead of writing again, and the same key with
+a different body is refused with 422. Only successful writes are stored, so
+a refused request can be retried under its key. Keys expire after
+IDEMPOTENCY_KEY_TTL_HOURS.
+
+Double sells are refused without locks. A parcel with an open (pending or
+approved) transfer takes no new one, and each write that depends on a row
+checks the version it read, in the WHERE clause of its UPDATE: (owner_id,
+updated_at) of the parcel, the status of the transfer. Of two racing writes
+one matches no row and fails with 409. Completing a transfer moves the
+parcel to the buyer that way and records an "Ownership Transfer" transaction.
+
+Writes are queued on a batching.GroupCommitter, so a burst of submissions is
+committed in one transaction.
+"""
+import hashlib
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Response
+from pydantic import BaseModel
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+import batching
+import database
+from models import IdempotencyKey, Parcel, Transaction, Transfer, TransferStatus, User
+from schemas import TransferResponse, TransferStatusChange, TransferSubmission
+
+# How long a stored Idempotency-Key response is replayed
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+
+# Seconds between deletions of expired idempotency keys
+PURGE_INTERVAL = 3600
+
+OPEN = (TransferStatus.PENDING, TransferStatus.APPROVED)
+# Allowed status changes; completed, rejected and cancelled transfers are final
+TRANSITIONS = {
+    TransferStatus.PENDING: {TransferStatus.APPROVED, TransferStatus.REJECTED, TransferStatus.CANCELLED},
+    TransferStatus.APPROVED: {TransferStatus.COMPLETED, TransferStatus.REJECTED, TransferStatus.CANCELLED},
+}
+
+committer = batching.GroupCommitter()
+_next_purge = 0.0
+
+
+class Written(NamedTuple):
+    status_code: int
+    body: str
+    # True when answered from a stored Idempotency-Key response
+    replayed: bool
+
+
+def fingerprint(scope: str, payload: Dict[str, Any]) -> str:
+    """SHA-256 of a request, to tell a retry from a different request under the same key"""
+    return hashlib.sha256(json.dumps([scope, payload], sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def _utc(moment: datetime) -> datetime:
+    # Stored timestamps are naive UTC
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def _now(db: Session) -> datetime:
+    """The database clock, as the naive timestamps of `now()` column defaults.
+
+    Analytics and stats take their high-water mark and month boundary from it
+    too, so rows written here fall on the same side of them.
+    """
+    return db.scalar(select(func.now())).replace(tzinfo=None)
+
+
+def _after(now: datetime, previous: Optional[datetime]) -> datetime:
+    """`now`, or just after `previous`, so every write gives its row a new version"""
+    if previous is not None and now <= previous:
+        now = previous + timedelta(microseconds=1)
+    return now
+
+
+def _compare_and_set(db: Session, row: Any, version: Dict[str, Any], values: Dict[str, Any]) -> None:
+    """UPDATE `row` with `values` if its columns still hold `version`.
+
+    Raises StaleDataError when another transaction changed the row since it
+    was read; the caller answers 409.
+    """
+    model = type(row)
+    result = db.execute(
+        update(model)
+        .where(model.id == row.id, *(getattr(model, column) == value for column, value in version.items()))
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise StaleDataError(f"{model.__tablename__} {row.id} was changed by a concurrent write")
+    # The same change on the loaded row, so the session's change listeners see it at flush
+    for column, value in values.items():
+        setattr(row, column, value)
+
+
+def create_transfer(db: Session, submission: TransferSubmission) -> Tuple[int, str]:
+    """Open a pending sale of a parcel from its current owner"""
+    if submission.status != TransferStatus.PENDING:
+        raise HTTPException(status_code=422, detail="New transfers start pending")
+    parcel = db.get(Parcel, submission.parcel_id)
+    if parcel is None:
+        raise HTTPException(status_code=404, detail="Parcel not found")
+    if db.get(User, submission.to_user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if submission.expected_owner_id is not None and parcel.owner_id != submission.expected_owner_id:
+        raise HTTPException(status_code=409, detail="Parcel owner has changed")
+    if submission.expected_updated_at is not None and parcel.updated_at != _utc(submission.expected_updated_at):
+        raise HTTPException(status_code=409, detail="Parcel has changed since it was read")
+    if parcel.owner_id == submission.to_user_id:
+        raise HTTPException(status_code=422, detail="Parcel already belongs to this user")
+    open_transfer = db.scalar(
+        select(Transfer.id).where(Transfer.parcel_id == parcel.id, Transfer.status.in_(OPEN)).limit(1)
+    ) or next((
+        # A sale made earlier in the same group commit is not flushed yet
+        pending.id for pending in db.new
+        if isinstance(pending, Transfer) and pending.parcel_id == parcel.id and pending.status in OPEN
+    ), None)
+    if open_transfer is not None:
+        raise HTTPException(status_code=409, detail=f"Parcel has an open transfer: {open_transfer}")
+
+    now = _after(_now(db), parcel.updated_at)
+    # Claims the parcel: a concurrent sale checked against the same version now matches no row
+    _compare_and_set(db, parcel, {"owner_id": parcel.owner_id, "updated_at": parcel.updated_at}, {"updated_at": now})
+    transfer = Transfer(
+        id=f"TXN-{uuid.uuid4().hex[:16]}", parcel_id=parcel.id, from_user_id=parcel.owner_id,
+        to_user_id=submission.to_user_id, amount=submission.amount, status=TransferStatus.PENDING,
+        transfer_date=submission.transfer_date, notes=submission.notes, created_at=now, updated_at=now,
+    )
+    db.add(transfer)
+    return 201, TransferResponse.model_validate(transfer).model_dump_json()
+
+
+def change_status(db: Session, transfer_id: str, change: TransferStatusChange) -> Tuple[int, str]:
+    """Move a transfer along TRANSITIONS; completing it hands the parcel to the buyer"""
+    transfer = db.get(Transfer, transfer_id)
+    if transfer is None:
+        raise HTTPException(status_code=404, detail="Transfer not found")
+    current = transfer.status or TransferStatus.PENDING
+    if change.status not in TRANSITIONS.get(current, ()):
+        raise HTTPException(
+            status_code=409, detail=f"A {current.value} transfer cannot become {change.status.value}"
+        )
+    clock = _now(db)
+    now = _after(clock, transfer.updated_at)
+    if change.status == TransferStatus.COMPLETED:
+        parcel = db.get(Parcel, transfer.parcel_id)
+        if parcel.owner_id != transfer.from_user_id:
+            raise HTTPException(status_code=409, detail="Parcel no longer belongs to the seller")
+        seller, buyer = db.get(User, transfer.from_user_id), db.get(User, transfer.to_user_id)
+
+    values = {"status": change.status, "updated_at": now}
+    if change.notes is not None:
+        values["notes"] = change.notes
+    _compare_and_set(db, transfer, {"status": transfer.status}, values)
+    if change.status == TransferStatus.COMPLETED:
+        _compare_and_set(
+            db, parcel, {"owner_id": transfer.from_user_id, "updated_at": parcel.updated_at},
+            {"owner_id": transfer.to_user_id, "updated_at": _after(clock, parcel.updated_at)},
+        )
+        db.add(Transaction(
+            id=f"txn-{uuid.uuid4().hex[:16]}", parcel_id=parcel.id, type="Ownership Transfer",
+            from_entity=seller.name, to_entity=buyer.name, transaction_date=now,
+        ))
+    return 200, TransferResponse.model_validate(transfer).model_dump_json()
+
+
+def _replay(record: Optional[IdempotencyKey], scope: str, digest: str) -> Optional[Written]:
+    """The stored response of an unexpired key; 422 if the key was used for another request"""
+    if record is None or record.created_at < datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS):
+        return None
+    if record.scope != scope or record.fingerprint != digest:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    return Written(record.status_code, record.response, True)
+
+
+def _stored(db: Session, key: str, scope: str, digest: str) -> Optional[Written]:
+    return _replay(db.get(IdempotencyKey, key), scope, digest)
+
+
+def _write(db: Session, key: Optional[str], scope: str, digest: str, fn: Callable[..., Tuple[int, str]], *args: Any) -> Written:
+    record = None
+    if key is not None:
+        # Committed since `submit` looked, or added by the original earlier in this batch (not flushed yet)
+        record = db.get(IdempotencyKey, key) or next(
+            (pending for pending in db.new if isinstance(pending, IdempotencyKey) and pending.key == key), None
+        )
+        replayed = _replay(record, scope, digest)
+        if replayed is not None:
+            return replayed
+    status_code, body = fn(db, *args)
+    if key is not None:
+        # Stored with the write it answers: a retry sees both or neither. An expired key is reused.
+        if record is None:
+            record = IdempotencyKey(key=key)
+            db.add(record)
+        record.scope, record.fingerprint = scope, digest
+        record.status_code, record.response = status_code, body
+        record.created_at = datetime.utcnow()
+    return Written(status_code, body, False)
+
+
+def purge_expired_keys(db: Session) -> int:
+    result = db.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.created_at < datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    ))
+    db.commit()
+    return result.rowcount
+
+
+def _response(written: Written) -> Response:
+    headers = {"Idempotent-Replayed": "true"} if written.replayed else None
+    return Response(content=written.body, status_code=written.status_code, media_type="application/json", headers=headers)
+
+
+async def submit(scope: str, request: BaseModel, key: Optional[str], fn: Callable[..., Tuple[int, str]], *args: Any) -> Response:
+    """Run `fn(session, *args)` in the next group commit under an optional idempotency key"""
+    global _next_purge
+    digest = fingerprint(scope, request.model_dump(mode="json"))
+    if key is not None:
+        # A retry of a committed write is answered without waiting for a batch
+        replayed = await database.run_detached(_stored, key, scope, digest)
+        if replayed is not None:
+            return _response(replayed)
+        if time.monotonic() >= _next_purge:
+            _next_purge = time.monotonic() + PURGE_INTERVAL
+            await database.run_detached(purge_expired_keys)
+    try:
+        written = await committer.submit(_write, key, scope, digest, fn, *args)
+    except StaleDataError:
+        raise HTTPException(status_code=409, detail="Changed by a concurrent write; read it again and retry")
+    except IntegrityError:
+        # Most likely the same key committed by a concurrent request: answer with its response
+        if key is not None:
+            replayed = await database.run_detached(_stored, key, scope, digest)
+            if replayed is not None:
+                return _response(replayed)
+        raise HTTPException(status_code=409, detail="Conflicts with a concurrent write; retry")
+    return _response(written)
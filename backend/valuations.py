@@ -0,0 +1,417 @@
+"""Parcel valuation time series and per-zoning rollups.
+
+    cd backend
+    python valuations.py migrate
+    python valuations.py rollups --since 2024-01-01
+
+Valuations are rows of `valuations`, keyed by (parcel_id, date), so one
+parcel's series is a range scan of the primary key. They replace the
+AIAnalysis.price_history JSON array, which `migrate_price_history` moves
+over. Area-wide aggregates are served from `valuation_rollups`: for each
+month and quarter, the median, mean, min and max of every parcel's latest
+valuation in the period, by zoning. The rollups are recomputed with NumPy
+by `refresh_rollups` for the periods written since the last refresh.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import Date, delete, event, func, insert, inspect, null, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import FunctionElement
+
+from fraud_scoring import epoch_seconds
+from models import AIAnalysis, Parcel, Valuation, ValuationRollup
+from pagination import first_pages
+from schemas import ValuationBucket, ValuationCreate, ValuationRollupReport
+
+logger = logging.getLogger(__name__)
+
+# Seconds between rollup refreshes of periods with new or changed valuations (0 disables)
+VALUATION_ROLLUP_INTERVAL = float(os.getenv("VALUATION_ROLLUP_INTERVAL", "60"))
+INTERVALS = ("month", "quarter")
+# Most recent points embedded as ai_analysis.price_history in parcel details
+PRICE_HISTORY_POINTS = 12
+MIGRATION_BATCH_SIZE = 1000
+WRITE_CHUNK_SIZE = 10000
+
+
+class month_start(FunctionElement):
+    """First day of the month of a date column"""
+    type = Date()
+    inherit_cache = True
+
+
+class quarter_start(FunctionElement):
+    """First day of the quarter of a date column"""
+    type = Date()
+    inherit_cache = True
+
+
+@compiles(month_start)
+def _month_start(element, compiler, **kw):
+    return f"CAST(date_trunc('month', {compiler.process(element.clauses, **kw)}) AS DATE)"
+
+
+@compiles(quarter_start)
+def _quarter_start(element, compiler, **kw):
+    return f"CAST(date_trunc('quarter', {compiler.process(element.clauses, **kw)}) AS DATE)"
+
+
+@compiles(month_start, "sqlite")
+def _sqlite_month_start(element, compiler, **kw):
+    return f"date({compiler.process(element.clauses, **kw)}, 'start of month')"
+
+
+@compiles(quarter_start, "sqlite")
+def _sqlite_quarter_start(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return (
+        f"date({column}, 'start of month', "
+        f"printf('-%d months', (CAST(strftime('%m', {column}) AS INTEGER) - 1) % 3))"
+    )
+
+
+PERIOD_START = {"month": month_start, "quarter": quarter_start}
+
+
+def period_of(day: date, interval: str) -> date:
+    month = day.month if interval == "month" else day.month - (day.month - 1) % 3
+    return date(day.year, month, 1)
+
+
+def parse_history_date(value) -> Optional[date]:
+    """Date of a legacy price_history entry: "2024-01", "2024-01-31" or a full timestamp"""
+    try:
+        text = str(value)
+        if len(text) == 7:
+            return date.fromisoformat(text + "-01")
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        return None
+
+
+# Series of one parcel
+
+def series_query(db: Session, parcel_id: str, start: Optional[date], end: Optional[date]):
+    query = db.query(Valuation).filter(Valuation.parcel_id == parcel_id)
+    if start:
+        query = query.filter(Valuation.date >= start)
+    if end:
+        query = query.filter(Valuation.date <= end)
+    return query
+
+
+def downsample(
+    db: Session, parcel_id: str, interval: str, start: Optional[date], end: Optional[date]
+) -> List[ValuationBucket]:
+    """One bucket per period with points, with the period's last value, in one statement"""
+    period = PERIOD_START[interval](Valuation.date)
+    where = [Valuation.parcel_id == parcel_id]
+    if start:
+        where.append(Valuation.date >= start)
+    if end:
+        where.append(Valuation.date <= end)
+    buckets = (
+        select(
+            period.label("period"), func.count().label("points"), func.avg(Valuation.value).label("mean_value"),
+            func.min(Valuation.value).label("min_value"), func.max(Valuation.value).label("max_value"),
+            func.max(Valuation.date).label("last_date"),
+        )
+        .where(*where).group_by(period).subquery()
+    )
+    last = Valuation.__table__.alias("last")
+    rows = db.execute(
+        select(buckets, last.c.value.label("last_value"))
+        .join(last, (last.c.parcel_id == parcel_id) & (last.c.date == buckets.c.last_date))
+        .order_by(buckets.c.period)
+    )
+    return [ValuationBucket.model_validate(row._mapping) for row in rows]
+
+
+def record_valuations(db: Session, parcel_id: str, points: Sequence[ValuationCreate]) -> List[Valuation]:
+    """Insert points, replacing the value of any date that already has one (last point per date wins)"""
+    latest = {point.date: point for point in points}
+    existing = {
+        valuation.date: valuation
+        for valuation in db.scalars(
+            select(Valuation).where(Valuation.parcel_id == parcel_id, Valuation.date.in_(list(latest)))
+        )
+    }
+    written = []
+    for day, point in sorted(latest.items()):
+        valuation = existing.get(day)
+        if valuation is None:
+            valuation = Valuation(parcel_id=parcel_id, date=day)
+            db.add(valuation)
+        valuation.value = point.value
+        valuation.source = point.source
+        written.append(valuation)
+    return written
+
+
+def price_histories(db: Session, parcel_ids: List[str]) -> Dict[str, List[dict]]:
+    """Latest PRICE_HISTORY_POINTS points of each parcel, newest first, in the legacy {date, value} shape"""
+    pages = first_pages(db, Valuation, Valuation.parcel_id, parcel_ids, [Valuation.date], PRICE_HISTORY_POINTS, True)
+    return {
+        parcel_id: [{"date": point.date.isoformat(), "value": point.value} for point in points]
+        for parcel_id, (points, _) in pages.items()
+    }
+
+
+# Migration from AIAnalysis.price_history
+
+def migrate_price_history(engine: Engine, batch_size: int = MIGRATION_BATCH_SIZE) -> Dict[str, Any]:
+    """Move every AIAnalysis.price_history array into `valuations` and clear it.
+
+    Points already in `valuations` are kept; entries without a readable date
+    or a numeric value are dropped. Each batch commits on its own, so an
+    interrupted run resumes where it stopped.
+    """
+    report = {"analyses": 0, "points": 0, "skipped": 0, "earliest": None}
+    table = AIAnalysis.__table__
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.parcel_id, table.c.price_history)
+                .where(table.c.price_history.isnot(None)).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            parcel_ids = [parcel_id for _, parcel_id, _ in rows]
+            taken = set(conn.execute(
+                select(Valuation.parcel_id, Valuation.date).where(Valuation.parcel_id.in_(parcel_ids))
+            ).all())
+            points: Dict[Tuple[str, date], dict] = {}
+            for _, parcel_id, history in rows:
+                for entry in history if isinstance(history, list) else ():
+                    day = parse_history_date(entry.get("date")) if isinstance(entry, dict) else None
+                    value = entry.get("value") if day else None
+                    if not isinstance(value, (int, float)) or isinstance(value, bool) or (parcel_id, day) in taken:
+                        report["skipped"] += 1
+                        continue
+                    points[(parcel_id, day)] = {
+                        "parcel_id": parcel_id, "date": day, "value": float(value), "source": "price_history",
+                        "created_at": datetime.utcnow(),
+                    }
+            if points:
+                conn.execute(insert(Valuation), list(points.values()))
+                earliest = min(day for _, day in points)
+                report["earliest"] = min(filter(None, (report["earliest"], earliest)))
+            conn.execute(update(table).where(table.c.id.in_([row[0] for row in rows])).values(price_history=null()))
+            report["analyses"] += len(rows)
+            report["points"] += len(points)
+    return report
+
+
+# Rollups
+
+def _group_starts(*keys: np.ndarray) -> np.ndarray:
+    """Start positions of runs of equal key tuples in sorted columns"""
+    if not len(keys[0]):
+        return np.zeros(0, dtype=np.int64)
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def compute_rollups(
+    days: np.ndarray, parcels: np.ndarray, zonings: np.ndarray, values: np.ndarray, interval: str
+) -> Dict[str, np.ndarray]:
+    """Per (period, zoning) aggregates of each parcel's latest value in the period.
+
+    `days` are days since 1970 and `parcels`/`zonings` are integer codes;
+    returns columns with the period as months since 1970.
+    """
+    months = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    period = months if interval == "month" else months - months % 3
+
+    # Each parcel's latest point per period
+    order = np.lexsort((days, parcels, period))
+    period, parcels, zonings, values = period[order], parcels[order], zonings[order], values[order]
+    ends = np.r_[_group_starts(period, parcels)[1:], len(period)] - 1
+    period, zonings, values = period[ends], zonings[ends], values[ends]
+
+    # Sorted by value within each (period, zoning), so min, max and median are positional
+    order = np.lexsort((values, zonings, period))
+    period, zonings, values = period[order], zonings[order], values[order]
+    starts = _group_starts(period, zonings)
+    counts = np.diff(np.r_[starts, len(values)])
+    lower, upper = values[starts + (counts - 1) // 2], values[starts + counts // 2]
+    return {
+        "period": period[starts],
+        "zoning": zonings[starts],
+        "parcels": counts,
+        "median_value": (lower + upper) / 2,
+        "mean_value": np.add.reduceat(values, starts) / counts if len(starts) else values[:0],
+        "min_value": values[starts],
+        "max_value": values[np.r_[starts[1:], len(values)] - 1] if len(starts) else values[:0],
+    }
+
+
+def refresh_rollups(engine: Engine, since: Optional[date] = None) -> ValuationRollupReport:
+    """Recompute the rollups of every period from the one containing `since` (default: all)"""
+    report = ValuationRollupReport(since=since)
+    started = time.perf_counter()
+    # Quarters cover whole months, so both intervals are recomputed from the same boundary
+    start = period_of(since, "quarter") if since else None
+
+    query = select(Valuation.parcel_id, epoch_seconds(Valuation.date), Valuation.value)
+    if start:
+        query = query.where(Valuation.date >= start)
+    with engine.connect() as conn:
+        rows = conn.execute(query).all()
+        # Zonings per parcel rather than joined onto every point
+        zoning_of = dict(conn.execute(select(Parcel.id, func.coalesce(Parcel.zoning, ""))).all())
+    parcel_ids, seconds, values = zip(*rows) if rows else ((), (), ())
+    codes: Dict[str, int] = {}
+    parcels = np.fromiter((codes.setdefault(p, len(codes)) for p in parcel_ids), dtype=np.int64, count=len(rows))
+    zoning_codes: Dict[str, int] = {}
+    by_parcel = np.fromiter(
+        (zoning_codes.setdefault(zoning_of.get(p, ""), len(zoning_codes)) for p in codes), dtype=np.int64, count=len(codes)
+    )
+    zonings = by_parcel[parcels]
+    days = np.array(seconds, dtype=np.int64) // 86400
+    values = np.array(values, dtype=np.float64)
+    zoning_names = list(zoning_codes)
+    loaded = time.perf_counter()
+
+    now = datetime.utcnow()
+    rollups = []
+    for interval in INTERVALS:
+        columns = compute_rollups(days, parcels, zonings, values, interval)
+        periods = columns["period"].astype("datetime64[M]").astype(date)
+        for i in range(len(periods)):
+            rollups.append({
+                "interval": interval, "period": periods[i], "zoning": zoning_names[columns["zoning"][i]],
+                "parcels": int(columns["parcels"][i]), "median_value": float(columns["median_value"][i]),
+                "mean_value": float(columns["mean_value"][i]), "min_value": float(columns["min_value"][i]),
+                "max_value": float(columns["max_value"][i]), "computed_at": now,
+            })
+    computed = time.perf_counter()
+
+    with engine.begin() as conn:
+        stale = delete(ValuationRollup)
+        if start:
+            stale = stale.where(ValuationRollup.period >= start)
+        conn.execute(stale)
+        for offset in range(0, len(rollups), WRITE_CHUNK_SIZE):
+            conn.execute(insert(ValuationRollup), rollups[offset:offset + WRITE_CHUNK_SIZE])
+    written = time.perf_counter()
+
+    report.points = len(rows)
+    report.rollups = len(rollups)
+    report.seconds = {
+        "load": round(loaded - started, 3), "compute": round(computed - loaded, 3), "write": round(written - computed, 3),
+    }
+    return report
+
+
+class RollupRefresher:
+    """Background thread refreshing the rollups of periods written since its last run"""
+
+    def __init__(self, engine: Engine, interval: float = VALUATION_ROLLUP_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._since: Optional[date] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def mark(self, since: date) -> None:
+        """Periods from the one containing `since` need recomputing"""
+        with self._lock:
+            self._since = min(self._since, since) if self._since else since
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="valuation-rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def refresh(self) -> Optional[ValuationRollupReport]:
+        with self._lock:
+            since, self._since = self._since, None
+        if since is None:
+            return None
+        try:
+            return refresh_rollups(self.engine, since)
+        except Exception:
+            self.mark(since)
+            raise
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Valuation rollup refresh failed")
+            if self._stop.wait(self.interval):
+                return
+
+
+def _collect_changes(session, flush_context):
+    earliest = session.info.get("valuation_changes")
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Valuation):
+            day = obj.date
+        elif isinstance(obj, Parcel) and inspect(obj).attrs.zoning.history.deleted:
+            # Rollups group by current zoning, so rezoning a parcel moves every period it has points in
+            day = date.min
+        else:
+            continue
+        earliest = min(earliest, day) if earliest else day
+    if earliest:
+        session.info["valuation_changes"] = earliest
+
+
+def _discard_changes(session):
+    session.info.pop("valuation_changes", None)
+
+
+def track_changes(session_factory, refresher: RollupRefresher) -> None:
+    """Mark the periods of committed valuation and zoning writes for `refresher`"""
+
+    def apply_changes(session):
+        earliest = session.info.pop("valuation_changes", None)
+        if earliest:
+            refresher.mark(earliest)
+
+    event.listen(session_factory, "after_flush", _collect_changes)
+    event.listen(session_factory, "after_commit", apply_changes)
+    event.listen(session_factory, "after_rollback", _discard_changes)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Valuation time series maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("migrate", help="Move AIAnalysis.price_history into the valuations table")
+    rollups = commands.add_parser("rollups", help="Recompute the per-zoning rollups")
+    rollups.add_argument("--since", type=date.fromisoformat, help="Only periods from this date on (default: all)")
+    args = parser.parse_args()
+
+    from database import engine
+
+    if args.command == "migrate":
+        report = migrate_price_history(engine)
+        print({**report, "earliest": report["earliest"] and report["earliest"].isoformat()})
+        if report["earliest"]:
+            print(refresh_rollups(engine, report["earliest"]).model_dump_json(indent=2))
+    else:
+        print(refresh_rollups(engine, args.since).model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -45,13 +45,13 @@ END $$;
 -- Create indexes for better performance
 -- These will be created by SQLAlchemy, but we can add custom ones here
 
--- Full text search index for parcels
--- CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parcels_address_gin 
--- ON parcels USING gin(to_tsvector('english', address));
+-- Trigram (pg_trgm) GIN indexes for parcel search on parcels.address,
+-- parcels.id and users.name are declared in backend/models.py and created
+-- by SQLAlchemy together with the tables.
 
--- Spatial index for coordinates (if using PostGIS)
--- CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parcels_coordinates 
--- ON parcels USING gist(ST_Point(coordinates_lng, coordinates_lat));
+-- Spatial lookups (/parcels/within, /parcels/near, /parcels/nearest) are
+-- served by the in-process grid index in backend/spatial.py, so PostGIS is
+-- not required.
 
 -- Comments for documentation
 COMMENT ON DATABASE cyberverse IS 'Cyberverse Land Registry System Database';
@@ -75,14 +75,14 @@ const Admin = () => {
         }
 
         // Load pending transfers
-        const transfersRes = await fetch(`${API_BASE}/transfers?status=pending`);
+        const transfersRes = await fetch(`${API_BASE}/transfers?status=pending&compact=true`);
         if (transfersRes.ok) {
           const transfersData = await transfersRes.json();
-          const formattedTransfers = transfersData.map((t: any) => ({
+          const formattedTransfers = transfersData.items.map((t: any) => ({
             id: t.id,
-            property: t.parcel.address,
-            from: t.from_user.name,
-            to: t.to_user.name,
+            property: transfersData.parcels[t.parcel_id].address,
+            from: transfersData.users[t.from_user_id].name,
+            to: transfersData.users[t.to_user_id].name,
             amount: `$${t.amount.toLocaleString()}`,
             date: t.created_at.split('T')[0],
             status: t.status
@@ -94,7 +94,7 @@ const Admin = () => {
         const alertsRes = await fetch(`${API_BASE}/fraud-alerts?resolved=false`);
         if (alertsRes.ok) {
           const alertsData = await alertsRes.json();
-          const formattedAlerts = alertsData.map((a: any) => ({
+          const formattedAlerts = alertsData.items.map((a: any) => ({
             id: a.id,
             property: a.parcel.address,
             owner: a.parcel.owner.name,
@@ -1,4 +1,4 @@
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { MapPin, Layers, Info, Search as SearchIcon } from "lucide-react";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -11,11 +11,43 @@ const mockMapParcels = [
   { id: "PLT-2024-003", name: "789 Maple Drive", lat: 40.7505, lng: -73.9934, status: "disputed", owner: "Mike Wilson" }
 ];
 
+const API_BASE = import.meta.env.VITE_API_BASE || "http://localhost:8000";
+
+// Initial viewport (min_lng,min_lat,max_lng,max_lat) around the demo registry
+const DEFAULT_BBOX = "-74.10,40.65,-73.90,40.80";
+
+type MapParcel = typeof mockMapParcels[number];
+
 const MapView = () => {
   const [selectedParcel, setSelectedParcel] = useState<any>(null);
+  const [mapParcels, setMapParcels] = useState<MapParcel[]>(mockMapParcels);
   const [mapboxToken, setMapboxToken] = useState("");
   const [showTokenInput, setShowTokenInput] = useState(true);
 
+  useEffect(() => {
+    const loadViewport = async () => {
+      try {
+        const res = await fetch(`${API_BASE}/parcels/within?bbox=${DEFAULT_BBOX}`);
+        if (!res.ok) throw new Error("Failed to load map parcels");
+        const data = await res.json();
+        // Zoomed-out views come back as clusters only; keep markers for individual parcels
+        setMapParcels(data.parcels.map((p: any) => ({
+          id: p.id,
+          name: p.address.split(",")[0],
+          lat: p.coordinates_lat,
+          lng: p.coordinates_lng,
+          status: p.status,
+          owner: p.owner_name,
+        })));
+      } catch (error) {
+        console.error("Failed to load map parcels:", error);
+        // Keep mock data as fallback
+      }
+    };
+
+    loadViewport();
+  }, []);
+
   const getStatusColor = (status: string) => {
     switch (status) {
       case "verified": return "bg-success";
@@ -84,9 +116,9 @@ const MapView = () => {
                       <h3 className="text-lg font-semibold text-foreground mb-2">Map Loading...</h3>
                       <p className="text-muted-foreground">Interactive map with property boundaries will appear here</p>
                       
-                      {/* Mock parcel markers */}
+                      {/* Parcel markers for the current viewport */}
                       <div className="mt-6 flex justify-center gap-4">
-                        {mockMapParcels.map((parcel) => (
+                        {mapParcels.map((parcel) => (
                           <button
                             key={parcel.id}
                             onClick={() => setSelectedParcel(parcel)}
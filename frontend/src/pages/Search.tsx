@@ -55,24 +55,30 @@ const Search = () => {
   const [isSearching, setIsSearching] = useState(false);
   const [loading, setLoading] = useState(true);
 
+  const fetchParcels = async (search?: string): Promise<Parcel[]> => {
+    const params = new URLSearchParams();
+    if (search) params.set("search", search);
+    const res = await fetch(`${API_BASE}/parcels?${params}`);
+    if (!res.ok) throw new Error("Failed to load parcels");
+    const data = await res.json();
+    // Backend returns a page: { items, next_cursor }; each item has id, address, owner_name, area_display, status, blockchain_hash, last_updated, fraud_risk, estimated_value
+    return data.items.map((p: any) => ({
+      id: p.id,
+      address: p.address,
+      owner: p.owner_name,
+      area: p.area_display,
+      status: p.status,
+      blockchainHash: p.blockchain_hash,
+      lastUpdated: p.last_updated,
+      fraudRisk: p.fraud_risk,
+      estimatedValue: p.estimated_value,
+    }));
+  };
+
   useEffect(() => {
     const load = async () => {
       try {
-        const res = await fetch(`${API_BASE}/parcels`);
-        if (!res.ok) throw new Error("Failed to load parcels");
-        const data = await res.json();
-        // Backend now provides: id, address, owner_name, area_display, status, blockchain_hash, last_updated, fraud_risk, estimated_value
-        const formattedParcels: Parcel[] = data.map((p: any) => ({
-          id: p.id,
-          address: p.address,
-          owner: p.owner_name,
-          area: p.area_display,
-          status: p.status,
-          blockchainHash: p.blockchain_hash,
-          lastUpdated: p.last_updated,
-          fraudRisk: p.fraud_risk,
-          estimatedValue: p.estimated_value,
-        }));
+        const formattedParcels = await fetchParcels();
         setAllParcels(formattedParcels);
         setSearchResults(formattedParcels);
       } catch (_) {
@@ -85,21 +91,22 @@ const Search = () => {
     load();
   }, []);
 
-  const handleSearch = () => {
+  const handleSearch = async () => {
     setIsSearching(true);
-    setTimeout(() => {
-      if (searchQuery.trim()) {
-        const filtered = allParcels.filter(parcel => 
-          parcel.address.toLowerCase().includes(searchQuery.toLowerCase()) ||
-          parcel.owner.toLowerCase().includes(searchQuery.toLowerCase()) ||
-          parcel.id.toLowerCase().includes(searchQuery.toLowerCase())
-        );
-        setSearchResults(filtered);
-      } else {
-        setSearchResults(allParcels);
-      }
+    const query = searchQuery.trim();
+    try {
+      setSearchResults(query ? await fetchParcels(query) : allParcels);
+    } catch (_) {
+      // Offline fallback: filter whatever is already loaded
+      const filtered = allParcels.filter(parcel => 
+        parcel.address.toLowerCase().includes(query.toLowerCase()) ||
+        parcel.owner.toLowerCase().includes(query.toLowerCase()) ||
+        parcel.id.toLowerCase().includes(query.toLowerCase())
+      );
+      setSearchResults(filtered);
+    } finally {
       setIsSearching(false);
-    }, 300);
+    }
   };
 
   const getStatusIcon = (status: string) => {
@@ -51,16 +51,16 @@ const Transfers = () => {
   useEffect(() => {
     const loadTransfers = async () => {
       try {
-        const res = await fetch(`${API_BASE}/transfers`);
+        const res = await fetch(`${API_BASE}/transfers?compact=true`);
         if (!res.ok) throw new Error("Failed to load transfers");
         const data = await res.json();
         
-        const formattedTransfers = data.map((t: any) => ({
+        const formattedTransfers = data.items.map((t: any) => ({
           id: t.id,
-          property: t.parcel.address,
-          parcelId: t.parcel.id,
-          from: t.from_user.name,
-          to: t.to_user.name,
+          property: data.parcels[t.parcel_id].address,
+          parcelId: t.parcel_id,
+          from: data.users[t.from_user_id].name,
+          to: data.users[t.to_user_id].name,
           amount: `$${t.amount.toLocaleString()}`,
           date: t.created_at.split('T')[0],
           status: t.status,